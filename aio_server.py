@@ -0,0 +1,355 @@
+import asyncio
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+from werkzeug.http import http_date
+
+from bandwidth import TransferCancelled
+from file_response import FileStream, TRANSFER_SENDFILE
+
+# 请求行和请求头的最大长度
+MAX_HEADER_SIZE = 64 * 1024
+# 空闲长连接的超时时间（秒）
+KEEPALIVE_TIMEOUT = 75
+# 每个连接的发送缓冲上限，超过后暂停写入直到客户端读走数据
+WRITE_BUFFER_HIGH = 256 * 1024
+# 不限速时每次 sendfile 的最大字节数
+SEND_BLOCK_SIZE = 1024 * 1024
+
+# 没有响应体的状态码
+_NO_BODY_STATUSES = (204, 304)
+
+
+class _RequestBody:
+    """wsgi.input：在工作线程中同步读取事件循环里的请求体"""
+
+    def __init__(self, reader, loop, length):
+        self._reader = reader
+        self._loop = loop
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = asyncio.run_coroutine_threadsafe(self._reader.read(size), self._loop).result()
+        self.remaining -= len(data)
+        return data
+
+
+def parse_request_head(head):
+    """解析请求行和请求头，返回 (方法, 目标, 协议版本, [(名称, 值)])，格式错误时返回 None"""
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        return None
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep or not name or name != name.strip():
+            return None
+        headers.append((name, value.strip()))
+    return parts[0], parts[1], parts[2], headers
+
+
+class AsyncHTTPServer:
+    """基于 asyncio 的 HTTP/1.1 服务器
+
+    路由、请求钩子和响应头仍由 Flask 应用在线程池中生成；文件下载的响应体
+    (FileStream) 在事件循环中用非阻塞的 sendfile 发送并按调度器异步限速，
+    慢速客户端只占用一个协程而不占用线程。其他响应体逐块在线程池中迭代，
+    每个连接的发送缓冲有上限，内存占用与文件大小无关。
+    """
+
+    def __init__(self, app, host, port, threads=8, max_connections=10000, server_name="CpolarFileXfer"):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.server_name = server_name
+        # 在构造时绑定端口，与 werkzeug 的 make_server 一致，端口被占用时立即报错
+        self.socket = socket.create_server((host, port), backlog=1024)
+        self.socket.setblocking(False)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="aio-wsgi")
+        self.loop = None
+        self._server = None
+        self._stop_event = None
+        self._shutdown_requested = False
+        self._stopped = threading.Event()
+        # 连接的写端 -> 处理该连接的任务
+        self._connections = {}
+
+    def serve_forever(self):
+        """在当前线程运行事件循环，直到 shutdown() 被调用"""
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+            self.executor.shutdown(wait=False)
+            self._stopped.set()
+
+    def shutdown(self):
+        """停止服务并等待事件循环退出（可在其他线程调用）"""
+        self._shutdown_requested = True
+        loop = self.loop
+        if loop is not None and not loop.is_closed() and self._stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass
+        if self.loop is not None:
+            self._stopped.wait(timeout=5)
+
+    def stop_accepting(self):
+        """关闭监听端口，已建立的连接继续完成（可在其他线程调用）"""
+        if self.loop is not None and self._server is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._server.close)
+            except RuntimeError:
+                pass
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        if self._shutdown_requested:
+            return
+        server = self._server = await asyncio.start_server(
+            self._handle_connection, sock=self.socket, limit=MAX_HEADER_SIZE
+        )
+        async with server:
+            await self._stop_event.wait()
+        # 断开剩余连接并等待各连接的任务结束
+        tasks = list(self._connections.values())
+        for writer, task in list(self._connections.items()):
+            writer.transport.abort()
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        if len(self._connections) >= self.max_connections:
+            writer.transport.abort()
+            return
+        self._connections[writer] = asyncio.current_task()
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self._send_error(writer, "431 Request Header Fields Too Large")
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                request = parse_request_head(head)
+                if request is None:
+                    await self._send_error(writer, "400 Bad Request")
+                    break
+                if not await self._handle_request(reader, writer, peer, *request):
+                    break
+        except (ConnectionError, OSError, TransferCancelled):
+            pass
+        except asyncio.CancelledError:
+            # 服务器关闭时取消；作为连接的顶层任务直接结束即可
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def build_environ(self, method, target, version, headers, peer, body):
+        """生成 WSGI environ"""
+        path, _, query = target.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "RAW_URI": target,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": str(peer[0]),
+            "REMOTE_PORT": str(peer[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers:
+            key = name.upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = "HTTP_" + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _handle_request(self, reader, writer, peer, method, target, version, headers):
+        """处理一个请求，返回连接是否可以继续使用"""
+        loop = asyncio.get_running_loop()
+        header_map = {name.lower(): value for name, value in headers}
+        connection = header_map.get("connection", "").lower()
+        keep_alive = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+
+        if "chunked" in header_map.get("transfer-encoding", "").lower():
+            await self._send_error(writer, "411 Length Required")
+            return False
+        try:
+            content_length = int(header_map.get("content-length", 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            await self._send_error(writer, "400 Bad Request")
+            return False
+        if header_map.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        body = _RequestBody(reader, loop, content_length)
+        environ = self.build_environ(method, target, version, headers, peer, body)
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = response_headers
+            return self._write_unsupported
+
+        app_iter = await loop.run_in_executor(self.executor, self.app, environ, start_response)
+        try:
+            status = response["status"]
+            response_headers = response["headers"]
+            code = int(status.split(" ", 1)[0])
+            has_body = method != "HEAD" and code >= 200 and code not in _NO_BODY_STATUSES
+            if has_body and isinstance(app_iter, FileStream):
+                keep_alive = await self._send_file(writer, status, response_headers, app_iter, keep_alive)
+            else:
+                keep_alive = await self._send_iterable(writer, status, response_headers, app_iter,
+                                                       keep_alive, has_body, version)
+        finally:
+            if hasattr(app_iter, "close"):
+                if isinstance(app_iter, FileStream):
+                    app_iter.close()
+                else:
+                    await loop.run_in_executor(self.executor, app_iter.close)
+
+        # 未读完的请求体会破坏下一个请求的解析，直接关闭连接
+        return keep_alive and body.remaining == 0
+
+    def _write_unsupported(self, data):
+        raise NotImplementedError("不支持 start_response 返回的 write()")
+
+    def _response_head(self, status, headers, keep_alive, chunked=False):
+        lines = [f"HTTP/1.1 {status}"]
+        names = set()
+        for name, value in headers:
+            lines.append(f"{name}: {value}")
+            names.add(name.lower())
+        if "date" not in names:
+            lines.append(f"Date: {http_date()}")
+        if "server" not in names:
+            lines.append(f"Server: {self.server_name}")
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_error(self, writer, status):
+        writer.write(self._response_head(status, [("Content-Length", "0")], False))
+        await writer.drain()
+
+    async def _send_iterable(self, writer, status, headers, app_iter, keep_alive, has_body, version):
+        """发送普通 WSGI 响应体，逐块在线程池中迭代，返回连接是否可以继续使用"""
+        loop = asyncio.get_running_loop()
+        content_length = next((int(value) for name, value in headers if name.lower() == "content-length"), None)
+        has_length = content_length is not None
+        chunked = has_body and not has_length and version == "HTTP/1.1"
+        if has_body and not has_length and not chunked:
+            # HTTP/1.0 客户端只能以关闭连接表示响应结束
+            keep_alive = False
+        writer.write(self._response_head(status, headers, keep_alive, chunked))
+        if not has_body:
+            await writer.drain()
+            return keep_alive
+
+        # 已在内存中的响应体直接发送，其他（如流式打包）在线程池中逐块生成
+        in_memory = isinstance(app_iter, (list, tuple))
+        chunks = iter(app_iter)
+        written = 0
+        while True:
+            if in_memory:
+                chunk = next(chunks, None)
+            else:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            if chunked:
+                writer.write(b"%x\r\n" % len(chunk))
+                writer.write(chunk)
+                writer.write(b"\r\n")
+            else:
+                writer.write(chunk)
+            written += len(chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        # 响应体提前结束（如文件在加密下载中被修改）时不足 Content-Length，
+        # 只能断开连接，客户端才不会一直等待剩余数据
+        return keep_alive and (not has_length or written >= content_length)
+
+    async def _send_file(self, writer, status, headers, stream, keep_alive):
+        """在事件循环中发送文件响应体：非阻塞 sendfile，并按调度器分配的速率异步限速
+
+        返回连接是否可以继续使用：文件在发送过程中被截断时响应体不足
+        Content-Length，只能关闭连接。
+        """
+        loop = asyncio.get_running_loop()
+        transfer = stream.transfer
+        if transfer is not None:
+            await transfer.start_async()
+        # 网络文件系统上打开文件可能很慢，不在事件循环中进行
+        f = await loop.run_in_executor(self.executor, open, stream.file_path, "rb")
+        try:
+            stream.begin(TRANSFER_SENDFILE)
+            writer.write(self._response_head(status, headers, keep_alive))
+            complete = await self._send_segments(writer, stream, f)
+            if complete and stream.trailer:
+                writer.write(stream.trailer)
+                stream.record_sent(len(stream.trailer))
+        finally:
+            f.close()
+        await writer.drain()
+        return keep_alive and complete
+
+    async def _send_segments(self, writer, stream, f):
+        """依次发送各个区间，文件比预期短时返回 False"""
+        loop = asyncio.get_running_loop()
+        transfer = stream.transfer
+        for head, start, length in stream.segments:
+            if head:
+                writer.write(head)
+                stream.record_sent(len(head))
+            offset = start
+            end = start + length
+            while offset < end:
+                block_size = transfer.chunk_size(SEND_BLOCK_SIZE) if transfer is not None else SEND_BLOCK_SIZE
+                await writer.drain()
+                sent = await loop.sendfile(writer.transport, f, offset, min(block_size, end - offset))
+                if sent == 0:
+                    return False
+                offset += sent
+                stream.record_sent(sent)
+                if transfer is not None:
+                    await transfer.throttle_async(sent)
+        return True
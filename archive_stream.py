@@ -0,0 +1,159 @@
+import os
+import tarfile
+import time
+import zipfile
+
+# 每次读取文件的块大小，也是内存占用的上限量级
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+
+# 本身已压缩的文件类型，打包时只存储不再压缩
+COMPRESSED_EXTENSIONS = {
+    "zip", "gz", "tgz", "bz2", "xz", "7z", "rar", "zst", "br", "lz4",
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif",
+    "mp3", "aac", "m4a", "ogg", "opus", "flac",
+    "mp4", "m4v", "mkv", "mov", "avi", "webm", "wmv",
+    "docx", "xlsx", "pptx", "odt", "epub", "jar", "apk", "pdf",
+}
+
+ARCHIVE_FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+
+def is_compressed_file(file_name):
+    """根据扩展名判断文件是否已经压缩过"""
+    _, ext = os.path.splitext(file_name)
+    return ext[1:].lower() in COMPRESSED_EXTENSIONS
+
+
+def archive_names(paths):
+    """为每个文件生成包内路径：相对于所有文件的公共父目录"""
+    try:
+        base = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ""
+    except ValueError:
+        # 不同盘符等无公共路径的情况，只保留文件名
+        base = ""
+
+    names = []
+    used = set()
+    for path in paths:
+        name = os.path.relpath(path, base) if base else os.path.basename(path)
+        name = name.replace(os.sep, "/")
+        stem, ext = os.path.splitext(name)
+        candidate = name
+        counter = 1
+        while candidate in used:
+            candidate = f"{stem} ({counter}){ext}"
+            counter += 1
+        used.add(candidate)
+        names.append(candidate)
+    return names
+
+
+class _StreamBuffer:
+    """zipfile 的只写输出目标，写入的数据由生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(paths):
+    """流式生成zip压缩包，不使用临时文件，内存占用与文件大小无关"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", allowZip64=True) as zf:
+        for path, name in zip(paths, archive_names(paths)):
+            try:
+                src = open(path, "rb")
+            except OSError:
+                continue
+            with src:
+                zinfo = zipfile.ZipInfo.from_file(path, name)
+                if is_compressed_file(name):
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(zinfo, mode="w") as dest:
+                    while True:
+                        chunk = src.read(ARCHIVE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # 中央目录
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def _tar_header(path, name):
+    st = os.stat(path)
+    info = tarfile.TarInfo(name)
+    info.size = st.st_size
+    info.mtime = int(st.st_mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8"), st.st_size
+
+
+def iter_tar(paths):
+    """流式生成tar包，头部自行构造，逐块输出文件内容"""
+    for path, name in zip(paths, archive_names(paths)):
+        try:
+            header, size = _tar_header(path, name)
+            src = open(path, "rb")
+        except OSError:
+            continue
+        with src:
+            yield header
+            remaining = size
+            while remaining > 0:
+                chunk = src.read(min(ARCHIVE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    # 文件在打包过程中变短，用零填充以保持包结构完整
+                    chunk = bytes(min(ARCHIVE_CHUNK_SIZE, remaining))
+                remaining -= len(chunk)
+                yield chunk
+        padding = -size % tarfile.BLOCKSIZE
+        if padding:
+            yield bytes(padding)
+    # 结束标记：两个全零块
+    yield bytes(tarfile.BLOCKSIZE * 2)
+
+
+def iter_archive(archive_format, paths):
+    """按格式生成压缩包数据流"""
+    if archive_format == "zip":
+        return iter_zip(paths)
+    if archive_format == "tar":
+        return iter_tar(paths)
+    raise ValueError(f"不支持的打包格式: {archive_format}")
+
+
+def archive_file_name(paths, archive_format):
+    """下载时使用的压缩包文件名"""
+    if len(paths) == 1:
+        stem = os.path.splitext(os.path.basename(paths[0]))[0]
+    else:
+        try:
+            stem = os.path.basename(os.path.commonpath([os.path.dirname(p) for p in paths]))
+        except ValueError:
+            stem = ""
+    stem = stem or time.strftime("files-%Y%m%d-%H%M%S")
+    return f"{stem}.{archive_format}"
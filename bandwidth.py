@@ -0,0 +1,348 @@
+import heapq
+import itertools
+import threading
+import time
+
+# 优先级及其在分配带宽时的权重
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+PRIORITY_WEIGHTS = {PRIORITY_LOW: 1, PRIORITY_NORMAL: 2, PRIORITY_HIGH: 4}
+
+# 限速时每次发送的块大小范围
+MIN_THROTTLE_CHUNK = 16 * 1024
+MAX_THROTTLE_CHUNK = 256 * 1024
+
+
+class TransferCancelled(Exception):
+    """传输被调度器取消（如服务器关闭时排空超时）"""
+
+
+class TokenBucket:
+    """令牌桶，rate 为每秒字节数，0 表示不限速
+
+    reserve() 允许令牌透支，返回调用方需要等待的秒数，
+    这样大块发送也能平滑地摊到后续时间里。
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.burst = burst if burst is not None else max(rate / 4, MIN_THROTTLE_CHUNK)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """取走 amount 个令牌，返回需要等待的秒数"""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Transfer:
+    """调度器中的一次传输
+
+    start() 在并发数已满时排队等待，throttle(n) 在发送 n 字节后按分配到的
+    速率休眠，finish() 释放名额（可重复调用，未开始的传输也可调用）。
+    cancel() 让排队或限速休眠中的传输立即结束。
+    """
+
+    def __init__(self, scheduler, client, priority):
+        self.scheduler = scheduler
+        self.client = client
+        self.priority = priority
+        self.bucket = TokenBucket()
+        self.bytes_sent = 0
+        self.state = "new"
+        self.cancelled = False
+        self._cancel_event = threading.Event()
+        # 异步排队或限速休眠时调用以唤醒等待的协程
+        self._wakeup = None
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def start(self):
+        if self.state == "new":
+            self.scheduler._admit(self)
+
+    async def start_async(self):
+        """start() 的协程版本，排队时不占用线程"""
+        if self.state == "new":
+            await self.scheduler._admit_async(self)
+
+    def cancel(self):
+        """取消传输；限速很低时一次休眠可达数秒，不等休眠结束"""
+        self.cancelled = True
+        self._cancel_event.set()
+        wakeup = self._wakeup
+        if wakeup is not None:
+            try:
+                wakeup()
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def chunk_size(self, default):
+        """限速时每次发送的字节数，保证速率平滑"""
+        if not self.rate:
+            return default
+        return int(min(default, max(MIN_THROTTLE_CHUNK, min(self.rate / 20, MAX_THROTTLE_CHUNK))))
+
+    def throttle(self, amount):
+        if self.cancelled:
+            raise TransferCancelled()
+        self.bytes_sent += amount
+        delay = self.bucket.reserve(amount)
+        if delay > 0 and self._cancel_event.wait(delay):
+            raise TransferCancelled()
+
+    async def throttle_async(self, amount):
+        """throttle() 的协程版本"""
+        import asyncio
+        
+        if self.cancelled:
+            raise TransferCancelled()
+        self.bytes_sent += amount
+        delay = self.bucket.reserve(amount)
+        if delay <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+        timer = loop.call_later(delay, _resolve, woken)
+        self._wakeup = lambda: loop.call_soon_threadsafe(_resolve, woken)
+        # 在设置 _wakeup 之前发生的取消
+        if self.cancelled:
+            _resolve(woken)
+        try:
+            await woken
+        finally:
+            timer.cancel()
+            self._wakeup = None
+        if self.cancelled:
+            raise TransferCancelled()
+
+    def finish(self):
+        if self.state != "finished":
+            self.scheduler._release(self)
+
+    def iter_throttled(self, chunks):
+        """包装一个字节块迭代器，按本传输的速率输出，被取消时提前结束"""
+        try:
+            self.start()
+            for chunk in chunks:
+                self.throttle(len(chunk))
+                yield chunk
+        except TransferCancelled:
+            return
+        finally:
+            self.finish()
+
+
+class TransferScheduler:
+    """下载带宽调度
+
+    支持全局速率上限、单客户端速率上限、最大并发传输数（超出的请求按
+    优先级排队）。全局带宽按客户端的优先级权重加权公平分配，单个客户端
+    的多个并发连接平分该客户端的份额，因此多开连接不能挤占其他接收方。
+    所有参数都可以在运行中通过 configure() 调整。
+    """
+
+    def __init__(self, global_rate=0, client_rate=0, max_concurrent=0):
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.max_concurrent = max_concurrent
+        # 客户端地址 -> 优先级
+        self.client_priorities = {}
+        self._cond = threading.Condition()
+        self._active = []
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    def open(self, client, priority=None):
+        """为客户端创建一次传输"""
+        if priority is None:
+            priority = self.client_priorities.get(client, PRIORITY_NORMAL)
+        return Transfer(self, client, priority)
+
+    def configure(self, global_rate=None, client_rate=None, max_concurrent=None, client_priorities=None):
+        """调整限制，立即作用于进行中的传输"""
+        with self._cond:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if client_rate is not None:
+                self.client_rate = client_rate
+            if max_concurrent is not None:
+                self.max_concurrent = max_concurrent
+            if client_priorities is not None:
+                self.client_priorities = dict(client_priorities)
+                for transfer in self._active:
+                    transfer.priority = self.client_priorities.get(transfer.client, PRIORITY_NORMAL)
+            self._rebalance()
+            self._notify_waiters()
+
+    def status(self):
+        """当前的传输和排队情况"""
+        with self._cond:
+            return {
+                "active": [
+                    {"client": t.client, "priority": t.priority, "rate": t.rate, "bytes_sent": t.bytes_sent}
+                    for t in self._active
+                ],
+                "queued": len(self._waiting),
+                "global_rate": self.global_rate,
+                "client_rate": self.client_rate,
+                "max_concurrent": self.max_concurrent,
+            }
+
+    def wait_idle(self, timeout=None):
+        """等待所有进行中和排队的传输结束，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._active and not self._waiting, timeout)
+
+    def cancel_all(self):
+        """取消所有进行中和排队的传输，它们会在发送下一块数据前结束"""
+        with self._cond:
+            for transfer in self._active:
+                transfer.cancel()
+            for _, _, transfer in self._waiting:
+                transfer.cancel()
+            self._notify_waiters()
+
+    def _has_slot(self):
+        return not self.max_concurrent or len(self._active) < self.max_concurrent
+
+    def _enqueue(self, transfer):
+        """在锁内调用"""
+        entry = (-transfer.priority, next(self._sequence), transfer)
+        heapq.heappush(self._waiting, entry)
+        transfer.state = "queued"
+        return entry
+
+    def _try_activate(self, entry):
+        """在锁内调用：轮到该传输且有空闲名额时开始传输"""
+        if not (self._waiting[0] is entry and self._has_slot()):
+            return False
+        heapq.heappop(self._waiting)
+        transfer = entry[2]
+        transfer.state = "active"
+        transfer._wakeup = None
+        self._active.append(transfer)
+        self._rebalance()
+        # 队首已变化，让下一个排队者检查是否轮到自己
+        self._notify_waiters()
+        return True
+
+    def _notify_waiters(self):
+        """在锁内调用：唤醒所有排队者（线程和协程）"""
+        self._cond.notify_all()
+        for _, _, transfer in self._waiting:
+            if transfer._wakeup is not None:
+                try:
+                    transfer._wakeup()
+                except RuntimeError:
+                    # 事件循环已关闭
+                    pass
+
+    def _admit(self, transfer):
+        with self._cond:
+            entry = self._enqueue(transfer)
+            while not self._try_activate(entry):
+                if transfer.cancelled:
+                    self._dequeue(transfer)
+                    raise TransferCancelled()
+                self._cond.wait()
+
+    async def _admit_async(self, transfer):
+        # 只有 asyncio 引擎用到，延迟导入以加快启动
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._cond:
+            entry = self._enqueue(transfer)
+            transfer._wakeup = lambda: loop.call_soon_threadsafe(event.set)
+        while True:
+            with self._cond:
+                if transfer.state != "queued" or self._try_activate(entry):
+                    return
+                if transfer.cancelled:
+                    self._dequeue(transfer)
+                    raise TransferCancelled()
+                event.clear()
+            await event.wait()
+
+    def _dequeue(self, transfer):
+        """在锁内调用：移出排队的传输"""
+        self._waiting = [e for e in self._waiting if e[2] is not transfer]
+        heapq.heapify(self._waiting)
+        transfer.state = "finished"
+        transfer._wakeup = None
+        self._notify_waiters()
+
+    def _release(self, transfer):
+        with self._cond:
+            if transfer.state == "active":
+                self._active.remove(transfer)
+                self._rebalance()
+            elif transfer.state == "queued":
+                self._dequeue(transfer)
+            transfer.state = "finished"
+            transfer._wakeup = None
+            self._notify_waiters()
+
+    def _rebalance(self):
+        """在锁内调用：重新计算每个传输的速率"""
+        clients = {}
+        for transfer in self._active:
+            clients.setdefault(transfer.client, []).append(transfer)
+
+        cap = self.client_rate or float("inf")
+        rates = {}
+        if self.global_rate:
+            # 加权的注水分配：份额超过单客户端上限的客户端取上限，剩余带宽再分给其他客户端
+            remaining = self.global_rate
+            pending = {c: max(PRIORITY_WEIGHTS[t.priority] for t in ts) for c, ts in clients.items()}
+            while pending:
+                total_weight = sum(pending.values())
+                capped = [c for c, w in pending.items() if remaining * w / total_weight >= cap]
+                if not capped:
+                    for c, w in pending.items():
+                        rates[c] = remaining * w / total_weight
+                    break
+                for c in capped:
+                    rates[c] = cap
+                    remaining -= cap
+                    del pending[c]
+        else:
+            for c in clients:
+                rates[c] = 0 if cap == float("inf") else cap
+
+        for c, transfers in clients.items():
+            for transfer in transfers:
+                transfer.bucket.set_rate(rates[c] / len(transfers))
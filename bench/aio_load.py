@@ -0,0 +1,134 @@
+"""负载测试：大量限速的慢速客户端同时下载同一个文件
+
+    python bench/aio_load.py --clients 2000 --client-rate 16 --size 256
+
+服务器在本进程中运行，客户端在子进程中运行，输出的内存和线程数只包含服务器。
+每个客户端使用不同的回环地址（127.1.x.y，仅 Linux），单客户端限速按地址生效。
+用 --engine waitress 可以对比线程池引擎在同样负载下的表现。
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def client_address(index):
+    if not sys.platform.startswith("linux"):
+        return "127.0.0.1"
+    return f"127.1.{index // 250}.{index % 250 + 1}"
+
+
+def raise_fd_limit():
+    """每个连接占用一个文件描述符，尽量调高软上限"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+
+
+async def download(port, url, index, results):
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, local_addr=(client_address(index), 0))
+        writer.write(f"GET {url} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: identity\r\n"
+                     f"Connection: close\r\n\r\n".encode())
+        await writer.drain()
+        received = 0
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        writer.close()
+        results.append(received)
+    except OSError as e:
+        results.append(e)
+
+
+async def run_clients(port, url, count, size):
+    results = []
+    started = time.monotonic()
+    await asyncio.gather(*(download(port, url, i, results) for i in range(count)))
+    # 收到的字节数包括响应头
+    completed = sum(1 for r in results if isinstance(r, int) and r > size)
+    errors = [r for r in results if not isinstance(r, int)]
+    print(f"客户端: {count}  完成: {completed}  错误: {len(errors)} {errors[:3]}  "
+          f"用时: {time.monotonic() - started:.1f} 秒")
+    return completed == count
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(args):
+    from server import ServerManager
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "payload.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(args.size * 1024))
+        manager = ServerManager(engine=args.engine, threads=args.threads, state_path=None,
+                                upload_folder=os.path.join(folder, "received"),
+                                preview_folder=os.path.join(folder, "previews"))
+        manager.registry.add_paths([path])
+        entry = manager.registry.get_by_path(path)
+        manager.scheduler.configure(client_rate=args.client_rate * 1024)
+        port = free_port()
+        manager.start(port)
+        manager.ready.wait(10)
+
+        client = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "--client",
+            str(port), f"/files/{entry['id']}/payload.bin", str(args.clients), str(args.size * 1024)
+        ])
+        peak_active = peak_threads = 0
+        while client.poll() is None:
+            peak_active = max(peak_active, len(manager.metrics.active_transfers()))
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.2)
+        summary = manager.metrics.snapshot()
+        manager.stop(drain_timeout=1)
+        manager.close()
+
+    print(f"引擎: {args.engine}  同时进行的下载峰值: {peak_active}  完成: {summary['completed']}  "
+          f"中断: {summary['aborted']}  线程数峰值: {peak_threads}")
+    if resource is not None:
+        # Linux 上 ru_maxrss 的单位是 KB
+        print(f"服务器进程内存峰值: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    return client.returncode
+
+
+def main():
+    if sys.argv[1:2] == ["--client"]:
+        raise_fd_limit()
+        port, url, count, size = sys.argv[2:6]
+        sys.exit(0 if asyncio.run(run_clients(int(port), url, int(count), int(size))) else 1)
+
+    parser = argparse.ArgumentParser(description="大量慢速客户端的下载负载测试")
+    parser.add_argument("--engine", default="asyncio", help="服务引擎（默认 asyncio）")
+    parser.add_argument("--threads", type=int, default=8, help="工作线程数")
+    parser.add_argument("--clients", type=int, default=2000, help="并发客户端数")
+    parser.add_argument("--client-rate", dest="client_rate", type=int, default=16, help="单客户端限速 (KB/s)")
+    parser.add_argument("--size", type=int, default=256, help="下载文件的大小 (KB)")
+    args = parser.parse_args()
+    raise_fd_limit()
+    sys.exit(serve(args))
+
+
+if __name__ == "__main__":
+    main()
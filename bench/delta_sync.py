@@ -0,0 +1,137 @@
+"""增量同步：大文件少量修改后，用旧版本重建新版本需要下载的数据量和耗时
+
+    python bench/delta_sync.py --size 2048 --changed 1
+
+服务器在本进程中运行，客户端 (DeltaDownload) 在子进程中运行。先生成 --size MB
+的随机文件并复制一份作为客户端的旧版本，再随机选取共享文件中 --changed %
+的块，在块内的随机位置原地改写一段数据。输出服务端计算签名、客户端匹配和
+下载缺少的块的耗时，以及下载量与整个文件的比例；重建结果与新版本逐字节校验。
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WRITE_SIZE = 8 * 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(WRITE_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def write_random_file(path, size):
+    with open(path, "wb") as f:
+        for offset in range(0, size, WRITE_SIZE):
+            f.write(os.urandom(min(WRITE_SIZE, size - offset)))
+
+
+def mutate(path, size, block_size, fraction, seed):
+    """随机选取 fraction 比例的块，在每块中改写一段随机位置和长度的数据，返回改写的块数"""
+    rng = random.Random(seed)
+    total = (size + block_size - 1) // block_size
+    blocks = rng.sample(range(total), max(1, int(total * fraction)))
+    with open(path, "r+b") as f:
+        for index in blocks:
+            length = min(block_size, size - index * block_size)
+            start = rng.randrange(length)
+            f.seek(index * block_size + start)
+            f.write(os.urandom(rng.randint(1, length - start)))
+    return len(blocks)
+
+
+def run_client(args):
+    from delta_client import DeltaDownload, fetch_signature
+    from delta_sync import BlockMatcher, MAX_DELTA_RUNS, block_count
+    from file_registry import format_size
+
+    base_url, file_id, basis, output, digest = args
+    download = DeltaDownload(base_url, int(file_id), basis, output)
+
+    # 与 DeltaDownload.run() 的步骤相同，分别计时
+    started = time.perf_counter()
+    download.signature = signature = fetch_signature(download.base_url, download.file_id)
+    fetched = time.perf_counter()
+    download.matcher = BlockMatcher(signature)
+    download.matcher.match_file(basis)
+    matched = time.perf_counter()
+    with open(output, "wb") as out:
+        out.truncate(signature.size)
+        download.copy_matched(out)
+        runs = download.matcher.missing_runs()
+        for start in range(0, len(runs), MAX_DELTA_RUNS):
+            download.fetch_runs(out, runs[start:start + MAX_DELTA_RUNS])
+    finished = time.perf_counter()
+
+    total = block_count(signature.size, signature.block_size)
+    print(f"  获取签名 {fetched - started:6.2f} 秒（包括服务端计算）  匹配旧版本 {matched - fetched:6.2f} 秒  "
+          f"复制和下载 {finished - matched:6.2f} 秒  总计 {finished - started:6.2f} 秒", flush=True)
+    print(f"  复用 {download.matcher.matched}/{total} 块，下载 {format_size(download.downloaded)} / "
+          f"{format_size(signature.size)}（{download.downloaded / signature.size * 100:.2f}%），"
+          f"内容{'一致' if file_digest(output) == digest else '不一致'}", flush=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    if sys.argv[1:2] == ["--client"]:
+        run_client(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="大文件少量修改后的增量同步")
+    parser.add_argument("--size", type=int, default=2048, help="文件大小 (MB)")
+    parser.add_argument("--changed", type=float, default=1, help="改写的块占全部块的百分比")
+    parser.add_argument("--seed", type=int, default=1, help="改写位置的随机种子")
+    args = parser.parse_args()
+
+    from delta_sync import choose_block_size
+    from server import ServerManager
+
+    size = args.size * 1024 * 1024
+    block_size = choose_block_size(size)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "disk.img")
+        basis = os.path.join(folder, "basis.img")
+        write_random_file(path, size)
+        shutil.copyfile(path, basis)
+        changed = mutate(path, size, block_size, args.changed / 100, args.seed)
+
+        manager = ServerManager(state_path=None, upload_folder=os.path.join(folder, "received"),
+                                preview_folder=os.path.join(folder, "previews"))
+        try:
+            manager.registry.add_paths([path])
+            entry = manager.registry.get_by_path(path)
+            port = free_port()
+            manager.start(port)
+            manager.ready.wait(10)
+            print(f"{args.size} MB，块大小 {block_size // 1024} KB，改写了 {changed} 块"
+                  f"（{changed / ((size + block_size - 1) // block_size) * 100:.2f}%）", flush=True)
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), "--client",
+                f"http://127.0.0.1:{port}", str(entry["id"]), basis, os.path.join(folder, "output.img"),
+                file_digest(path)
+            ], check=True)
+        finally:
+            manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""加密下载与明文下载的吞吐量对比
+
+    python bench/encryption.py --size 512 --rates 0,8192
+
+服务器在本进程中运行，客户端在子进程中运行。每个速率下先下载明文，再下载
+加密的密文（?encrypted=1），输出吞吐量、服务器的 CPU 占用和加密相对明文的
+吞吐量比例。速率为 0 时不限速，即本机回环上的极限；其他速率由调度器的全局
+限速模拟隧道的带宽。客户端只接收数据，不解密。
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def download(port, url):
+    """下载一次，返回 (收到的字节数, 秒)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {url} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: identity\r\n"
+                 f"Connection: close\r\n\r\n".encode())
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    received = 0
+    while True:
+        chunk = await reader.read(1024 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+    writer.close()
+    return received, time.perf_counter() - started
+
+
+def run_client(port, url):
+    received, elapsed = asyncio.run(download(port, url))
+    print(f"{received} {elapsed}")
+
+
+def measure(port, url):
+    """在子进程中下载，返回 (字节数, 秒, 服务器进程的 CPU 秒)"""
+    cpu = time.process_time()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--client", str(port), url],
+                            check=True, capture_output=True, text=True)
+    received, elapsed = result.stdout.split()
+    return int(received), float(elapsed), time.process_time() - cpu
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    if sys.argv[1:2] == ["--client"]:
+        run_client(int(sys.argv[2]), sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="加密下载与明文下载的吞吐量对比")
+    parser.add_argument("--size", type=int, default=512, help="下载文件的大小 (MB)")
+    parser.add_argument("--rates", default="0,8192", help="全局限速 (KB/s，0 为不限)，逗号分隔")
+    parser.add_argument("--engine", default="waitress", help="服务引擎")
+    args = parser.parse_args()
+
+    from encryption import encrypted_size, encryption_backend
+    from server import ServerManager
+
+    if encryption_backend() is None:
+        sys.exit("需要安装 cryptography 或 pycryptodome")
+    size = args.size * 1024 * 1024
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "payload.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        manager = ServerManager(engine=args.engine, state_path=None,
+                                upload_folder=os.path.join(folder, "received"),
+                                preview_folder=os.path.join(folder, "previews"))
+        try:
+            manager.enable_encryption()
+            manager.registry.add_paths([path])
+            entry = manager.registry.get_by_path(path)
+            url = f"/files/{entry['id']}/{entry['name']}"
+            port = free_port()
+            manager.start(port)
+            manager.ready.wait(10)
+            print(f"{args.size} MB（{args.engine}，加密实现 {encryption_backend()}，"
+                  f"{manager.encryption.workers} 个加密线程，{os.cpu_count()} 个 CPU）", flush=True)
+            for rate in (int(r) for r in args.rates.split(",")):
+                manager.scheduler.configure(global_rate=rate * 1024)
+                print(f"限速 {f'{rate} KB/s' if rate else '不限'}:", flush=True)
+                results = {}
+                for label, target, expected in (("明文", url, size),
+                                                ("加密", url + "?encrypted=1", encrypted_size(size))):
+                    received, elapsed, cpu = measure(port, target)
+                    results[label] = size / elapsed
+                    print(f"  {label} {size / elapsed / 2 ** 20:8.1f} MB/s  服务器 CPU {cpu / elapsed * 100:5.0f}%"
+                          f"{'' if received == expected else f'  收到 {received} 字节，应为 {expected}'}", flush=True)
+                print(f"  加密/明文 {results['加密'] / results['明文'] * 100:.0f}%", flush=True)
+        finally:
+            manager.close()
+
+
+if __name__ == "__main__":
+    main()
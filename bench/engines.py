@@ -0,0 +1,184 @@
+"""各服务引擎在不同并发数下的下载吞吐量和延迟
+
+    python bench/engines.py --size 1024 --concurrency 1,16,128 --duration 5
+
+服务器在本进程中运行，客户端在子进程中运行。每个并发客户端在测试时间内
+反复下载同一个文件（每次新建连接），输出每秒完成的请求数、吞吐量和延迟。
+随后在几个限速下载进行中时调用 stop()，输出停止的用时以及端口是否已释放。
+服务器和客户端在同一台机器上运行，结果适合比较引擎之间的相对差异。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 停止测试中同时进行的下载数和单客户端限速 (KB/s)
+STOP_CLIENTS = 8
+STOP_CLIENT_RATE = 64
+
+
+def request_bytes(url):
+    return (f"GET {url} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: identity\r\n"
+            f"Connection: close\r\n\r\n").encode()
+
+
+async def fetch(port, request):
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    received = 0
+    while True:
+        chunk = await reader.read(262144)
+        if not chunk:
+            break
+        received += len(chunk)
+    writer.close()
+    return received, time.perf_counter() - started
+
+
+async def worker(port, request, size, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        try:
+            received, elapsed = await fetch(port, request)
+        except OSError as e:
+            errors.append(e)
+            await asyncio.sleep(0.01)
+            continue
+        # 收到的字节数包括响应头
+        if received > size:
+            latencies.append(elapsed)
+        else:
+            errors.append(f"只收到 {received} 字节")
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_level(port, url, size, clients, duration):
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(worker(port, request_bytes(url), size, deadline, latencies, errors)
+                           for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"  并发 {clients:4d}: {len(latencies) / elapsed:7.1f} 请求/秒  "
+          f"{len(latencies) * size / elapsed / 2 ** 20:7.1f} MB/s  "
+          f"延迟 p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+          f"错误 {len(errors)} {[str(e) for e in errors[:2]]}", flush=True)
+
+
+async def run_clients(port, url, size, levels, duration):
+    for clients in levels:
+        await run_level(port, url, size, clients, duration)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def port_released(port):
+    with socket.socket() as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("0.0.0.0", port))
+        except OSError:
+            return False
+    return True
+
+
+def slow_download(port, url):
+    """一直读到连接关闭，与真实的慢速客户端一样"""
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(request_bytes(url))
+        try:
+            while client.recv(65536):
+                pass
+        except OSError:
+            pass
+
+
+def check_stop(manager, port, url):
+    """限速下载进行中调用 stop()，返回 (停止用时, 端口是否已释放)"""
+    manager.scheduler.configure(client_rate=STOP_CLIENT_RATE * 1024)
+    clients = [threading.Thread(target=slow_download, args=(port, url), daemon=True) for _ in range(STOP_CLIENTS)]
+    for client in clients:
+        client.start()
+    deadline = time.monotonic() + 10
+    while len(manager.metrics.active_transfers()) < STOP_CLIENTS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    started = time.perf_counter()
+    manager.stop(drain_timeout=1)
+    elapsed = time.perf_counter() - started
+    released = port_released(port)
+    for client in clients:
+        client.join(5)
+    return elapsed, released
+
+
+def bench_engine(args, engine, folder, path):
+    from server import ServerManager
+
+    manager = ServerManager(engine=engine, threads=args.threads, state_path=None,
+                            upload_folder=os.path.join(folder, "received"),
+                            preview_folder=os.path.join(folder, "previews"))
+    try:
+        manager.registry.add_paths([path])
+        entry = manager.registry.get_by_path(path)
+        url = f"/files/{entry['id']}/{entry['name']}"
+        port = free_port()
+        manager.start(port)
+        manager.ready.wait(10)
+
+        print(f"引擎: {engine}（{args.threads} 个工作线程）", flush=True)
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), "--client",
+            str(port), url, str(args.size * 1024), args.concurrency, str(args.duration)
+        ], check=True)
+        elapsed, released = check_stop(manager, port, url)
+        print(f"  停止: {STOP_CLIENTS} 个限速下载进行中（最多等待 1 秒后取消），用时 {elapsed:.2f} 秒，"
+              f"端口{'已释放' if released else '未释放'}", flush=True)
+    finally:
+        manager.close()
+
+
+def main():
+    if sys.argv[1:2] == ["--client"]:
+        port, url, size, levels, duration = sys.argv[2:7]
+        asyncio.run(run_clients(int(port), url, int(size), [int(n) for n in levels.split(",")], float(duration)))
+        return
+
+    parser = argparse.ArgumentParser(description="比较各服务引擎的下载吞吐量")
+    parser.add_argument("--engines", default="waitress,werkzeug,asyncio", help="要测试的引擎，逗号分隔")
+    parser.add_argument("--threads", type=int, default=8, help="工作线程数")
+    parser.add_argument("--concurrency", default="1,16,128", help="并发客户端数，逗号分隔")
+    parser.add_argument("--duration", type=float, default=5, help="每个并发数的测试秒数")
+    parser.add_argument("--size", type=int, default=1024, help="下载文件的大小 (KB)")
+    args = parser.parse_args()
+    # werkzeug 为每个请求输出一行日志，waitress 在请求排队和停止时取消传输时输出警告
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    logging.getLogger("waitress").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "payload.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(args.size * 1024))
+        for engine in args.engines.split(","):
+            bench_engine(args, engine, folder, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""经过限速代理时单连接下载与分块并行下载的吞吐量
+
+    python bench/range_download.py --size 64 --conn-rate 4096 --total-rate 16384
+
+服务器在本进程中运行，限速代理和客户端在子进程中运行。代理对每个连接和
+全部连接分别限速，模拟按连接限速的隧道。客户端按网页的做法下载：先用 HEAD
+取得 ETag，再按 8 MB 一块发送带 If-Range 的 Range 请求，几个连接并行。
+--drop-after 让代理在每个连接转发这么多 MB 后断开，客户端从已收到的位置续传。
+每次下载都校验内容与原文件一致。
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 与网页中的分块大小一致
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 16 * 1024
+MAX_RETRIES = 20
+
+
+class ThrottledProxy:
+    """转发到服务器的 TCP 代理，下行方向按连接和总量限速"""
+
+    def __init__(self, target_port, conn_rate, total_rate, drop_after=0):
+        self.target_port = target_port
+        self.conn_rate = conn_rate
+        self.total_rate = total_rate
+        self.drop_after = drop_after
+        # 总量限速：下一块数据最早可以发出的时间
+        self._next_free = 0.0
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        upstream = asyncio.ensure_future(self._copy(client_reader, server_writer))
+        try:
+            await self._copy_throttled(server_reader, client_writer)
+        finally:
+            upstream.cancel()
+            server_writer.close()
+            client_writer.close()
+
+    async def _copy(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    async def _copy_throttled(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        forwarded = 0
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                if self.drop_after and forwarded + len(data) > self.drop_after:
+                    # 模拟隧道断开：已发出的部分之后直接关闭连接
+                    writer.write(data[:self.drop_after - forwarded])
+                    await writer.drain()
+                    break
+                forwarded += len(data)
+                now = loop.time()
+                ready = started + forwarded / self.conn_rate if self.conn_rate else now
+                if self.total_rate:
+                    self._next_free = max(now, self._next_free) + len(data) / self.total_rate
+                    ready = max(ready, self._next_free)
+                if ready > now:
+                    await asyncio.sleep(ready - now)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+
+
+async def http_request(port, method, path, headers=None):
+    """发送一个请求，返回 (状态码, 响应头, 收到的正文)；连接中断时正文不完整"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", "Host: bench", "Accept-Encoding: identity", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        response_headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                response_headers[name.strip().lower()] = value.strip()
+        body = bytearray()
+        if method != "HEAD":
+            while True:
+                data = await reader.read(262144)
+                if not data:
+                    break
+                body += data
+        return int(status_line.split()[1]), response_headers, bytes(body)
+    finally:
+        writer.close()
+
+
+async def fetch_chunk(port, path, start, end, etag, stats):
+    """下载 [start, end] 区间，连接中断时用 Range + If-Range 从已收到的位置续传"""
+    parts = []
+    offset = start
+    for _ in range(MAX_RETRIES):
+        status, _, body = await http_request(port, "GET", path, {"Range": f"bytes={offset}-{end}", "If-Range": etag})
+        stats["requests"] += 1
+        if status != 206:
+            raise RuntimeError(f"意外的响应状态: {status}")
+        parts.append(body)
+        offset += len(body)
+        if offset > end:
+            return b"".join(parts)
+        stats["resumed"] += 1
+    raise RuntimeError("重试次数过多")
+
+
+async def single_download(port, path, size):
+    stats = {"requests": 1, "resumed": 0}
+    status, _, body = await http_request(port, "GET", path)
+    if status != 200 or len(body) != size:
+        raise RuntimeError(f"单连接下载失败: 状态 {status}，收到 {len(body)} 字节")
+    return body, stats
+
+
+async def parallel_download(port, path, size, connections):
+    """与网页相同：HEAD 取得 ETag，按 CHUNK_SIZE 分块，connections 个连接并行"""
+    status, headers, _ = await http_request(port, "HEAD", path)
+    etag = headers.get("etag")
+    if status != 200 or headers.get("accept-ranges") != "bytes" or not etag:
+        raise RuntimeError("服务器不支持区间请求")
+    stats = {"requests": 1, "resumed": 0}
+    chunk_count = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    blobs = [None] * chunk_count
+    indexes = iter(range(chunk_count))
+
+    async def worker():
+        for index in indexes:
+            start = index * CHUNK_SIZE
+            end = min(start + CHUNK_SIZE, size) - 1
+            blobs[index] = await fetch_chunk(port, path, start, end, etag, stats)
+
+    await asyncio.gather(*(worker() for _ in range(min(connections, chunk_count))))
+    return b"".join(blobs), stats
+
+
+async def run_clients(args):
+    port, path, size, digest = int(args[0]), args[1], int(args[2]), args[3]
+    conn_rate, total_rate, drop_after = (int(v) for v in args[4:7])
+    connections = [int(n) for n in args[7].split(",")]
+
+    async def measure(label, proxy, download):
+        server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+        proxy_port = server.sockets[0].getsockname()[1]
+        started = time.perf_counter()
+        try:
+            data, stats = await download(proxy_port)
+        finally:
+            server.close()
+        elapsed = time.perf_counter() - started
+        ok = hashlib.sha256(data).hexdigest() == digest
+        print(f"  {label:18} {elapsed:6.1f} 秒  {size / elapsed / 2 ** 20:6.1f} MB/s  "
+              f"请求 {stats['requests']:3d}  续传 {stats['resumed']:3d}  内容{'一致' if ok else '不一致'}", flush=True)
+
+    await measure("单连接", ThrottledProxy(port, conn_rate, total_rate),
+                  lambda p: single_download(p, path, size))
+    for n in connections:
+        await measure(f"{n} 个连接分块", ThrottledProxy(port, conn_rate, total_rate),
+                      lambda p, n=n: parallel_download(p, path, size, n))
+    if drop_after:
+        n = connections[0]
+        await measure(f"{n} 个连接分块+断线", ThrottledProxy(port, conn_rate, total_rate, drop_after),
+                      lambda p: parallel_download(p, path, size, n))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    if sys.argv[1:2] == ["--client"]:
+        asyncio.run(run_clients(sys.argv[2:]))
+        return
+
+    parser = argparse.ArgumentParser(description="限速代理下单连接与分块并行下载的对比")
+    parser.add_argument("--size", type=int, default=64, help="下载文件的大小 (MB)")
+    parser.add_argument("--conn-rate", dest="conn_rate", type=int, default=4096, help="代理的单连接限速 (KB/s)")
+    parser.add_argument("--total-rate", dest="total_rate", type=int, default=16384,
+                        help="代理的总限速 (KB/s，0 为不限)")
+    parser.add_argument("--connections", default="4,8", help="分块下载的并行连接数，逗号分隔")
+    parser.add_argument("--drop-after", dest="drop_after", type=float, default=3,
+                        help="断线测试中每个连接转发多少 MB 后断开，0 为不测试")
+    parser.add_argument("--engine", default="waitress", help="服务引擎")
+    args = parser.parse_args()
+
+    from server import ServerManager
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "payload.bin")
+        digest = hashlib.sha256()
+        with open(path, "wb") as f:
+            for _ in range(args.size):
+                block = os.urandom(1024 * 1024)
+                digest.update(block)
+                f.write(block)
+        manager = ServerManager(engine=args.engine, state_path=None,
+                                upload_folder=os.path.join(folder, "received"),
+                                preview_folder=os.path.join(folder, "previews"))
+        try:
+            manager.registry.add_paths([path])
+            entry = manager.registry.get_by_path(path)
+            port = free_port()
+            manager.start(port)
+            manager.ready.wait(10)
+            print(f"{args.size} MB，代理单连接 {args.conn_rate} KB/s，总量 "
+                  f"{args.total_rate or '不限'}{' KB/s' if args.total_rate else ''}（{args.engine}）", flush=True)
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), "--client",
+                str(port), f"/files/{entry['id']}/{entry['name']}", str(args.size * 1024 * 1024),
+                digest.hexdigest(), str(args.conn_rate * 1024), str(args.total_rate * 1024),
+                str(int(args.drop_after * 1024 * 1024)), args.connections
+            ], check=True)
+        finally:
+            manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""共享列表的冷启动与热启动：恢复条目的耗时，以及热启动时是否重新哈希
+
+    python bench/warm_start.py --files 100000
+
+第一次启动添加文件并等待哈希完成，关闭时保存共享列表；第二次启动从共享
+列表恢复，统计重新提交哈希的条目数、摘要全部可用的时间和重复文件关系。
+应用数据目录放在临时目录中，不影响本机的共享列表和哈希缓存。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wait_until(condition, timeout=600):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("等待超时")
+        time.sleep(0.01)
+
+
+def make_files(folder, count):
+    """每 10 个文件中有一个与前一个内容相同"""
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"{i:06d}.txt")
+        content = f"file {i - 1 if i % 10 == 9 else i}\n".encode()
+        with open(path, "wb") as f:
+            f.write(content * 64)
+        paths.append(path)
+    return paths
+
+
+def start(state_path):
+    from server import ServerManager
+
+    started = time.perf_counter()
+    manager = ServerManager(state_path=state_path)
+    return manager, time.perf_counter() - started
+
+
+def all_hashed(manager, count):
+    entries = manager.registry.snapshot()
+    return len(entries) == count and all(e["hash"] for e in entries)
+
+
+def run(args, folder):
+    from hashing import FileHasher
+
+    paths = make_files(os.path.join(folder, "files"), args.files)
+    state_path = os.path.join(folder, "shares.sqlite3")
+
+    manager, elapsed = start(state_path)
+    started = time.perf_counter()
+    manager.registry.add_paths(paths)
+    wait_until(lambda: all_hashed(manager, args.files))
+    print(f"冷启动: 初始化 {elapsed * 1000:.0f} ms，添加并哈希 {args.files} 个文件 {time.perf_counter() - started:.2f} 秒")
+    duplicates = {e["path"]: e["duplicate_of"] for e in manager.registry.snapshot()}
+    manager.close()
+
+    submitted = []
+    hash_entry = FileHasher._hash_entry
+    FileHasher._hash_entry = lambda self, *a: (submitted.append(a), hash_entry(self, *a))[1]
+    try:
+        manager, elapsed = start(state_path)
+        started = time.perf_counter()
+        probe = paths[-1]
+        wait_until(lambda: manager.hasher.lookup(probe, os.stat(probe)) is not None)
+        ready = time.perf_counter() - started
+        wait_until(lambda: not manager.share_store.revalidating)
+        restored = {e["path"]: e["duplicate_of"] for e in manager.registry.snapshot()}
+        print(f"热启动: 恢复 {len(manager.registry)} 个条目 {elapsed * 1000:.0f} ms，摘要可用 {ready * 1000:.0f} ms，"
+              f"重新提交哈希 {len(submitted)} 个，重复文件关系一致: {restored == duplicates}")
+        manager.close()
+    finally:
+        FileHasher._hash_entry = hash_entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享列表冷启动与热启动的耗时")
+    parser.add_argument("--files", type=int, default=100000, help="文件数")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, "files"))
+        # 应用数据目录由用户主目录决定，必须在导入服务器模块之前设置
+        os.environ["HOME"] = os.environ["USERPROFILE"] = folder
+        run(args, folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,18 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, scrolledtext
 import threading
 import os
-import socket as socket_module  # 重命名socket模块导入，避免命名冲突
 import time
-import subprocess
-import re
-import sys
+
+from file_registry import format_size
+from folder_scanner import FolderScanner
+from bandwidth import PRIORITY_LOW, PRIORITY_HIGH
+from server import SERVER_ENGINES, get_local_ip
+from tunnel_log import TunnelLog, EVENT_RECONNECT, EVENT_ERROR
+from tunnel import TunnelSupervisor, STATE_ERROR, cpolar_available
+from virtual_list import VirtualFileList
+
+# cpolar日志刷新到界面的间隔（毫秒）
+LOG_FLUSH_INTERVAL_MS = 100
 
 class FileTransferGUI:
     """文件互传应用的图形用户界面"""
@@ -21,48 +28,69 @@ class FileTransferGUI:
         # 设置微软雅黑字体
         self.font_family = "微软雅黑"
         
-        # 存储文件信息的列表
-        self.shared_files = []
+        # 与服务器共用的共享文件注册表
+        self.registry = server_manager.registry
+        
+        # 当前的后台文件夹扫描
+        self.folder_scanner = None
         
         # cpolar状态
         self.cpolar_running = False
-        self.cpolar_thread = None
         self.cpolar_public_url = ""
-        
-        # 获取本机IP
-        self.local_ip = self.get_local_ip()
-        
-        # 检查cpolar是否安装
-        self.cpolar_installed = self.check_cpolar_installed()
+        # cpolar输出的环形缓冲，界面定时批量刷新
+        self.tunnel_log = TunnelLog()
+        self.tunnel_log.subscribe(self.on_tunnel_event)
+        self.tunnel_log_cursor = None
+        # 隧道监督：自动重启、健康检查、多隧道轮询分发
+        self.tunnel_supervisor = TunnelSupervisor(self.tunnel_log)
+        self.tunnel_supervisor.subscribe(lambda: self.root.after(0, self.update_tunnel_status))
+        
+        # 本机IP和cpolar安装状态在后台检测，窗口先显示
+        self.local_ip = "127.0.0.1"
+        self.cpolar_installed = False
         
         self.create_widgets()
+        threading.Thread(target=self.probe_environment, daemon=True).start()
+        
+        # 远端上传完成的通知
+        self.server_manager.upload_callback = lambda path: self.root.after(0, self.upload_received, path)
         
-        # 连接服务器管理器的回调
-        self.server_manager.set_file_list_callback(self.update_file_list)
+        # 定时刷新传输监控和cpolar日志
+        self.refresh_monitor()
+        self.flush_cpolar_log()
     
-    def get_local_ip(self):
-        """获取本机IP地址"""
-        try:
-            # 使用重命名后的socket模块
-            s = socket_module.socket(socket_module.AF_INET, socket_module.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except Exception as e:
-            print(f"获取IP失败: {e}")
-            return "127.0.0.1"
+    def run(self):
+        """运行主循环，关闭窗口时停止服务并保存共享列表"""
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.mainloop()
     
-    def check_cpolar_installed(self):
-        """检查cpolar是否安装"""
-        try:
-            # 尝试运行cpolar命令检查版本
-            result = subprocess.run(['cpolar', '--version'], capture_output=True, text=True)
-            if result.returncode == 0:
-                return True
-            return False
-        except FileNotFoundError:
-            return False
+    def on_close(self):
+        """关闭窗口"""
+        if self.folder_scanner is not None:
+            self.folder_scanner.cancel()
+        self.tunnel_supervisor.stop()
+        self.server_manager.close()
+        self.root.destroy()
+    
+    def probe_environment(self):
+        """检测本机IP和cpolar是否安装（在后台线程中运行）"""
+        local_ip = get_local_ip()
+        installed = cpolar_available()
+        self.root.after(0, self.environment_probed, local_ip, installed)
+    
+    def environment_probed(self, local_ip, installed):
+        """环境检测完成，更新界面"""
+        self.local_ip = local_ip
+        self.server_manager.local_ip = local_ip
+        self.ip_label.config(text=f"本机IP: {local_ip}")
+        
+        self.cpolar_installed = installed
+        if installed:
+            self.cpolar_status_label.config(text="cpolar状态: 已安装", fg="green")
+        else:
+            self.cpolar_status_label.config(text="cpolar状态: 未安装", fg="red")
+        if not self.cpolar_running:
+            self.start_cpolar_button.config(state=tk.NORMAL if installed else tk.DISABLED)
     
     def create_widgets(self):
         """创建Tkinter界面组件"""
@@ -73,6 +101,14 @@ class FileTransferGUI:
         file_tab = ttk.Frame(tab_control)
         tab_control.add(file_tab, text="文件共享")
         
+        # 传输控制选项卡
+        bandwidth_tab = ttk.Frame(tab_control)
+        tab_control.add(bandwidth_tab, text="传输控制")
+        
+        # 传输监控选项卡
+        monitor_tab = ttk.Frame(tab_control)
+        tab_control.add(monitor_tab, text="传输监控")
+        
         # cpolar选项卡
         cpolar_tab = ttk.Frame(tab_control)
         tab_control.add(cpolar_tab, text="内网穿透 (cpolar)")
@@ -88,8 +124,8 @@ class FileTransferGUI:
         info_frame = tk.Frame(file_tab)
         info_frame.pack(fill=tk.X, padx=20, pady=5)
         
-        ip_label = tk.Label(info_frame, text=f"本机IP: {self.local_ip}", font=(self.font_family, 10))
-        ip_label.pack(side=tk.LEFT, padx=5)
+        self.ip_label = tk.Label(info_frame, text="本机IP: 检测中...", font=(self.font_family, 10))
+        self.ip_label.pack(side=tk.LEFT, padx=5)
         
         self.port_var = tk.StringVar(value="5000")
         port_label = tk.Label(info_frame, text="端口:", font=(self.font_family, 10))
@@ -97,6 +133,34 @@ class FileTransferGUI:
         port_entry = tk.Entry(info_frame, textvariable=self.port_var, width=8, font=(self.font_family, 10))
         port_entry.pack(side=tk.LEFT, padx=5)
         
+        # 服务引擎配置
+        engine_frame = tk.Frame(file_tab)
+        engine_frame.pack(fill=tk.X, padx=20, pady=5)
+        
+        tk.Label(engine_frame, text="服务引擎:", font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.engine_var = tk.StringVar(value=self.server_manager.engine)
+        engine_combo = ttk.Combobox(engine_frame, textvariable=self.engine_var, values=list(SERVER_ENGINES),
+                                    width=10, state="readonly", font=(self.font_family, 10))
+        engine_combo.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(engine_frame, text="线程数:", font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.threads_var = tk.StringVar(value=str(self.server_manager.threads))
+        threads_entry = tk.Entry(engine_frame, textvariable=self.threads_var, width=5, font=(self.font_family, 10))
+        threads_entry.pack(side=tk.LEFT, padx=5)
+        
+        # 接收目录
+        upload_frame = tk.Frame(file_tab)
+        upload_frame.pack(fill=tk.X, padx=20, pady=5)
+        
+        tk.Label(upload_frame, text="接收目录:", font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.upload_folder_var = tk.StringVar(value=self.server_manager.uploads.upload_folder)
+        tk.Label(upload_frame, textvariable=self.upload_folder_var, font=(self.font_family, 9), fg="gray").pack(side=tk.LEFT, padx=5)
+        tk.Button(upload_frame, text="更改", command=self.choose_upload_folder, font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        # 远端上传默认关闭：公网地址对任何人开放，开启前需要确认
+        self.uploads_enabled_var = tk.BooleanVar(value=self.server_manager.uploads.enabled)
+        tk.Checkbutton(upload_frame, text="允许远端上传", variable=self.uploads_enabled_var,
+                       command=self.apply_upload_settings, font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        
         # 服务器控制按钮
         control_frame = tk.Frame(file_tab)
         control_frame.pack(fill=tk.X, padx=20, pady=5)
@@ -120,50 +184,95 @@ class FileTransferGUI:
         remove_button = tk.Button(button_frame, text="移除选中", command=self.remove_selected, font=(self.font_family, 10))
         remove_button.pack(side=tk.LEFT, padx=5)
         
-        # 文件列表
-        list_frame = tk.Frame(file_tab)
-        list_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
+        self.cancel_scan_button = tk.Button(button_frame, text="取消扫描", command=self.cancel_scan, state=tk.DISABLED, font=(self.font_family, 10))
+        self.cancel_scan_button.pack(side=tk.LEFT, padx=5)
+        
+        self.scan_progress_var = tk.StringVar(value="")
+        scan_progress_label = tk.Label(button_frame, textvariable=self.scan_progress_var, font=(self.font_family, 9), fg="gray")
+        scan_progress_label.pack(side=tk.LEFT, padx=5)
         
-        columns = ("文件名", "大小", "路径")
-        self.file_tree = ttk.Treeview(list_frame, columns=columns, show="headings")
+        # 筛选（文件名，或 size>10MB、mtime>2024-01-01、mtime<7d 等数值条件）
+        filter_frame = tk.Frame(file_tab)
+        filter_frame.pack(fill=tk.X, padx=20, pady=2)
         
-        # 设置列标题
-        for col in columns:
-            self.file_tree.heading(col, text=col)
-            self.file_tree.column(col, width=100)
+        tk.Label(filter_frame, text="筛选:", font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.file_filter_var = tk.StringVar()
+        filter_entry = tk.Entry(filter_frame, textvariable=self.file_filter_var, width=30, font=(self.font_family, 10))
+        filter_entry.pack(side=tk.LEFT, padx=5)
+        filter_entry.bind("<Return>", lambda e: self.apply_file_filter())
+        tk.Button(filter_frame, text="应用", command=self.apply_file_filter, font=(self.font_family, 9)).pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="例: report size>10MB mtime<7d", font=(self.font_family, 9), fg="gray").pack(side=tk.LEFT, padx=5)
         
-        # 调整列宽
-        self.file_tree.column("文件名", width=200)
-        self.file_tree.column("大小", width=100)
-        self.file_tree.column("路径", width=250)
+        self.file_count_var = tk.StringVar(value="")
+        tk.Label(filter_frame, textvariable=self.file_count_var, font=(self.font_family, 9), fg="gray").pack(side=tk.RIGHT, padx=5)
         
         # 设置Treeview字体
         style = ttk.Style()
         style.configure("Treeview", font=(self.font_family, 10))
         style.configure("Treeview.Heading", font=(self.font_family, 10, "bold"))
         
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.file_tree.yview)
-        self.file_tree.configure(yscrollcommand=scrollbar.set)
+        # 文件列表：只渲染可见行，列表随注册表变更自动刷新
+        self.file_list = VirtualFileList(file_tab, self.registry, on_change=self.file_list_changed)
+        self.file_list.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
+        
+        # ===== 传输控制选项卡内容 =====
+        scheduler = self.server_manager.scheduler
+        limits_frame = tk.Frame(bandwidth_tab)
+        limits_frame.pack(fill=tk.X, padx=20, pady=10)
+        
+        tk.Label(limits_frame, text="全局限速(KB/s):", font=(self.font_family, 10)).grid(row=0, column=0, sticky=tk.W, padx=5, pady=3)
+        self.global_rate_var = tk.StringVar(value=str(scheduler.global_rate // 1024))
+        tk.Entry(limits_frame, textvariable=self.global_rate_var, width=10, font=(self.font_family, 10)).grid(row=0, column=1, sticky=tk.W, padx=5)
+        
+        tk.Label(limits_frame, text="单客户端限速(KB/s):", font=(self.font_family, 10)).grid(row=1, column=0, sticky=tk.W, padx=5, pady=3)
+        self.client_rate_var = tk.StringVar(value=str(scheduler.client_rate // 1024))
+        tk.Entry(limits_frame, textvariable=self.client_rate_var, width=10, font=(self.font_family, 10)).grid(row=1, column=1, sticky=tk.W, padx=5)
+        
+        tk.Label(limits_frame, text="最大并发传输:", font=(self.font_family, 10)).grid(row=2, column=0, sticky=tk.W, padx=5, pady=3)
+        self.max_concurrent_var = tk.StringVar(value=str(scheduler.max_concurrent))
+        tk.Entry(limits_frame, textvariable=self.max_concurrent_var, width=10, font=(self.font_family, 10)).grid(row=2, column=1, sticky=tk.W, padx=5)
+        
+        tk.Label(limits_frame, text="高优先级IP:", font=(self.font_family, 10)).grid(row=3, column=0, sticky=tk.W, padx=5, pady=3)
+        self.high_priority_var = tk.StringVar()
+        tk.Entry(limits_frame, textvariable=self.high_priority_var, width=40, font=(self.font_family, 10)).grid(row=3, column=1, sticky=tk.W, padx=5)
+        
+        tk.Label(limits_frame, text="低优先级IP:", font=(self.font_family, 10)).grid(row=4, column=0, sticky=tk.W, padx=5, pady=3)
+        self.low_priority_var = tk.StringVar()
+        tk.Entry(limits_frame, textvariable=self.low_priority_var, width=40, font=(self.font_family, 10)).grid(row=4, column=1, sticky=tk.W, padx=5)
         
-        self.file_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tk.Label(bandwidth_tab, text="0 表示不限制；多个IP用逗号分隔。修改后立即作用于进行中的下载。",
+                 font=(self.font_family, 9), fg="gray").pack(anchor=tk.W, padx=25)
+        tk.Button(bandwidth_tab, text="应用", command=self.apply_bandwidth_settings,
+                  font=(self.font_family, 10)).pack(anchor=tk.W, padx=25, pady=10)
+        
+        # ===== 传输监控选项卡内容 =====
+        self.monitor_summary_var = tk.StringVar(value="")
+        tk.Label(monitor_tab, textvariable=self.monitor_summary_var, font=(self.font_family, 10),
+                 justify=tk.LEFT, anchor=tk.W).pack(fill=tk.X, padx=20, pady=10)
+        
+        monitor_frame = tk.Frame(monitor_tab)
+        monitor_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
+        
+        monitor_columns = ("客户端", "文件", "进度", "速度", "已用时间")
+        self.monitor_tree = ttk.Treeview(monitor_frame, columns=monitor_columns, show="headings")
+        for col in monitor_columns:
+            self.monitor_tree.heading(col, text=col)
+            self.monitor_tree.column(col, width=90)
+        self.monitor_tree.column("文件", width=220)
+        
+        monitor_scrollbar = ttk.Scrollbar(monitor_frame, orient="vertical", command=self.monitor_tree.yview)
+        self.monitor_tree.configure(yscrollcommand=monitor_scrollbar.set)
+        self.monitor_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        monitor_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # ===== cpolar选项卡内容 =====
         cpolar_info_frame = tk.Frame(cpolar_tab)
         cpolar_info_frame.pack(fill=tk.X, padx=20, pady=10)
         
-        # 显示cpolar安装状态
-        if self.cpolar_installed:
-            status_text = "已安装"
-            status_color = "green"
-        else:
-            status_text = "未安装"
-            status_color = "red"
-        
-        cpolar_status_label = tk.Label(cpolar_info_frame, text=f"cpolar状态: {status_text}", 
-                                        font=(self.font_family, 10), fg=status_color)
-        cpolar_status_label.pack(side=tk.LEFT, padx=5)
+        # 显示cpolar安装状态（后台检测完成后更新）
+        self.cpolar_status_label = tk.Label(cpolar_info_frame, text="cpolar状态: 检测中...", 
+                                            font=(self.font_family, 10), fg="gray")
+        self.cpolar_status_label.pack(side=tk.LEFT, padx=5)
         
         # cpolar token输入
         token_frame = tk.Frame(cpolar_tab)
@@ -188,12 +297,17 @@ class FileTransferGUI:
         protocol_combo = ttk.Combobox(config_frame, textvariable=self.cpolar_protocol_var, values=["http", "https", "tcp", "tls"], width=8, font=(self.font_family, 10))
         protocol_combo.pack(side=tk.LEFT, padx=5)
         
+        tk.Label(config_frame, text="隧道数:", font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.tunnel_count_var = tk.StringVar(value="1")
+        tk.Spinbox(config_frame, from_=1, to=8, width=3, textvariable=self.tunnel_count_var,
+                   font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        
         # cpolar控制按钮
         cpolar_control_frame = tk.Frame(cpolar_tab)
         cpolar_control_frame.pack(fill=tk.X, padx=20, pady=5)
         
         self.start_cpolar_button = tk.Button(cpolar_control_frame, text="启动内网穿透", command=self.start_cpolar, 
-                                            state=tk.NORMAL if self.cpolar_installed else tk.DISABLED, 
+                                            state=tk.DISABLED, 
                                             font=(self.font_family, 10))
         self.start_cpolar_button.pack(side=tk.LEFT, padx=5)
         
@@ -213,11 +327,31 @@ class FileTransferGUI:
         copy_button = tk.Button(url_frame, text="复制", command=self.copy_url, font=(self.font_family, 10))
         copy_button.pack(side=tk.LEFT, padx=5)
         
+        # 加密下载：复制的地址带上密钥（# 之后的部分不会发给服务器）
+        encryption_frame = tk.Frame(cpolar_tab)
+        encryption_frame.pack(fill=tk.X, padx=20, pady=5)
+        
+        self.encryption_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(encryption_frame, text="加密下载", variable=self.encryption_var,
+                       command=self.apply_encryption_settings, font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        self.encryption_required_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(encryption_frame, text="仅允许加密下载", variable=self.encryption_required_var,
+                       command=self.apply_encryption_settings, font=(self.font_family, 10)).pack(side=tk.LEFT, padx=5)
+        
         # cpolar日志显示
         log_frame = tk.Frame(cpolar_tab)
         log_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
         
-        tk.Label(log_frame, text="cpolar日志:", font=(self.font_family, 10)).pack(anchor=tk.W, pady=2)
+        log_header = tk.Frame(log_frame)
+        log_header.pack(fill=tk.X, pady=2)
+        tk.Label(log_header, text="cpolar日志:", font=(self.font_family, 10)).pack(side=tk.LEFT)
+        self.log_lines_var = tk.StringVar(value=str(self.tunnel_log.max_lines))
+        log_lines_spin = tk.Spinbox(log_header, from_=100, to=100000, increment=500, width=7,
+                                    textvariable=self.log_lines_var, command=self.apply_log_lines,
+                                    font=(self.font_family, 10))
+        log_lines_spin.pack(side=tk.RIGHT)
+        log_lines_spin.bind("<Return>", lambda e: self.apply_log_lines())
+        tk.Label(log_header, text="保留行数:", font=(self.font_family, 10)).pack(side=tk.RIGHT, padx=5)
         
         self.cpolar_log = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, width=80, height=15, font=(self.font_family, 9))
         self.cpolar_log.pack(fill=tk.BOTH, expand=True)
@@ -235,85 +369,170 @@ class FileTransferGUI:
             self.status_var.set(f"已添加文件: {os.path.basename(file_path)}")
     
     def add_folder(self):
-        """添加文件夹中的所有文件到共享列表"""
+        """在后台扫描文件夹，并把其中的文件分批添加到共享列表"""
+        if self.folder_scanner is not None and self.folder_scanner.running:
+            messagebox.showinfo("提示", "正在扫描文件夹，请稍候或先取消扫描")
+            return
+        
         folder_path = filedialog.askdirectory()
         if folder_path:
-            files_added = 0
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    self.add_file_to_list(file_path)
-                    files_added += 1
-            self.status_var.set(f"已添加 {files_added} 个文件")
+            watcher = self.server_manager.watcher
+            if watcher.find_root(folder_path) is not None:
+                messagebox.showinfo("提示", "该文件夹已在共享中，其中的变化会自动同步")
+                return
+            # 先开始监控再扫描，扫描期间发生的变化不会丢失
+            watcher.add_root(folder_path)
+            
+            self.folder_scanner = FolderScanner(
+                folder_path,
+                on_batch=self.registry.add_stats,
+                on_done=lambda scanner: self.root.after(0, self.scan_finished, scanner)
+            )
+            self.folder_scanner.start()
+            self.cancel_scan_button.config(state=tk.NORMAL)
+            self.status_var.set(f"正在扫描: {folder_path}")
+            self.update_scan_progress()
     
-    def add_file_to_list(self, file_path):
-        """将文件添加到列表和共享文件列表中"""
-        if not os.path.exists(file_path):
+    def update_scan_progress(self):
+        """定时刷新扫描进度"""
+        scanner = self.folder_scanner
+        if scanner is None or not scanner.running:
             return
-        
-        file_name = os.path.basename(file_path)
-        file_size = self.format_size(os.path.getsize(file_path))
-        
-        # 添加到Treeview
-        self.file_tree.insert("", tk.END, values=(file_name, file_size, file_path))
-        
-        # 添加到共享文件列表
-        file_info = {
-            "name": file_name,
-            "size": file_size,
-            "path": file_path
-        }
-        self.shared_files.append(file_info)
-        
-        # 更新服务器文件列表
-        self.server_manager.update_file_list(self.shared_files)
+        self.scan_progress_var.set(f"已扫描 {scanner.files_found} 个文件 ({scanner.files_per_second:.0f} 个/秒)")
+        self.root.after(200, self.update_scan_progress)
+    
+    def cancel_scan(self):
+        """取消正在进行的文件夹扫描"""
+        if self.folder_scanner is not None:
+            self.folder_scanner.cancel()
+    
+    def scan_finished(self, scanner):
+        """文件夹扫描结束"""
+        self.cancel_scan_button.config(state=tk.DISABLED)
+        self.scan_progress_var.set("")
+        
+        summary = f"{scanner.files_found} 个文件，用时 {scanner.elapsed:.1f} 秒"
+        if scanner.errors:
+            summary += f"，跳过 {scanner.errors} 个无法访问的项目"
+        if scanner.cancelled:
+            # 取消扫描时同时停止监控，避免之后的事件继续添加文件
+            self.server_manager.watcher.remove_root(scanner.folder_path, remove_files=False)
+            self.status_var.set(f"扫描已取消，已添加 {summary}")
+        elif self.server_manager.watcher.available:
+            self.status_var.set(f"已添加 {summary}，文件夹变化将自动同步")
+        else:
+            self.status_var.set(f"已添加 {summary}")
+    
+    def add_file_to_list(self, file_path):
+        """将文件添加到共享注册表"""
+        self.registry.add_paths([file_path])
     
     def remove_selected(self):
         """移除选中的文件"""
-        selected_items = self.file_tree.selection()
-        if not selected_items:
-            return
-        
-        for item in selected_items:
-            values = self.file_tree.item(item, "values")
-            file_path = values[2]
-            
-            # 从共享文件列表中移除
-            for i, file_info in enumerate(self.shared_files):
-                if file_info["path"] == file_path:
-                    self.shared_files.pop(i)
-                    break
-            
-            # 从Treeview中移除
-            self.file_tree.delete(item)
-        
-        # 更新服务器文件列表
-        self.server_manager.update_file_list(self.shared_files)
+        selected_ids = self.file_list.selected_ids
+        if selected_ids:
+            self.registry.remove(selected_ids)
     
-    def update_file_list(self, file_list):
-        """更新文件列表显示"""
-        # 清空现有列表
-        for item in self.file_tree.get_children():
-            self.file_tree.delete(item)
-        
-        # 添加新的文件列表
-        for file_info in file_list:
-            self.file_tree.insert("", tk.END, values=(
-                file_info["name"],
-                file_info["size"],
-                file_info["path"]
-            ))
-        
-        # 更新本地文件列表
-        self.shared_files = file_list
+    def apply_file_filter(self):
+        """应用文件列表的筛选条件"""
+        try:
+            self.file_list.set_filter(self.file_filter_var.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+    
+    def file_list_changed(self, shown, total):
+        """文件列表重建后更新计数"""
+        if shown == total:
+            self.file_count_var.set(f"共 {total} 个文件")
+        else:
+            self.file_count_var.set(f"显示 {shown} / {total} 个文件")
     
     def format_size(self, size_bytes):
         """格式化文件大小显示"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
+        return format_size(size_bytes)
+    
+    def choose_upload_folder(self):
+        """选择接收远端上传文件的目录"""
+        folder_path = filedialog.askdirectory()
+        if folder_path:
+            self.server_manager.uploads.upload_folder = folder_path
+            self.upload_folder_var.set(folder_path)
+    
+    def apply_upload_settings(self):
+        """开关远端上传"""
+        enabled = self.uploads_enabled_var.get()
+        self.server_manager.uploads.enabled = enabled
+        if enabled:
+            limit = self.server_manager.uploads.max_upload_size
+            limit_text = f"，单个文件不超过 {format_size(limit)}" if limit else ""
+            self.status_var.set(f"已允许远端上传到 {self.server_manager.uploads.upload_folder}{limit_text}")
+        else:
+            self.status_var.set("已关闭远端上传")
+    
+    def upload_received(self, file_path):
+        """远端上传完成"""
+        self.status_var.set(f"已接收文件: {file_path}")
+    
+    def refresh_monitor(self):
+        """刷新传输监控选项卡，只读取内存中的统计，不阻塞主循环"""
+        metrics = self.server_manager.metrics
+        summary = metrics.snapshot()
+        ttfb = f"{summary['ttfb_avg'] * 1000:.0f} ms" if summary["ttfb_avg"] is not None else "-"
+        self.monitor_summary_var.set(
+            f"进行中: {summary['active']}    排队: {self.server_manager.scheduler.status()['queued']}    "
+            f"总速度: {format_size(summary['throughput'])}/s\n"
+            f"已完成: {summary['completed']}    中断: {summary['aborted']}    "
+            f"已发送: {format_size(summary['bytes_sent'])}    平均首字节时间: {ttfb}    "
+            f"服务器错误: {summary['errors']}/{summary['responses']}"
+        )
+        
+        now = time.monotonic()
+        active = {str(id(stats)): stats for stats in metrics.active_transfers()}
+        for iid in self.monitor_tree.get_children():
+            if iid not in active:
+                self.monitor_tree.delete(iid)
+        for iid, stats in active.items():
+            progress = stats.bytes_sent / stats.expected_bytes * 100 if stats.expected_bytes else 100.0
+            values = (
+                stats.client or "-",
+                os.path.basename(stats.file_path),
+                f"{progress:.1f}%  ({format_size(stats.bytes_sent)})",
+                f"{format_size(stats.bytes_per_second)}/s",
+                f"{now - stats.started_at:.0f} 秒"
+            )
+            if self.monitor_tree.exists(iid):
+                self.monitor_tree.item(iid, values=values)
+            else:
+                self.monitor_tree.insert("", tk.END, iid=iid, values=values)
+        
+        self.root.after(1000, self.refresh_monitor)
+    
+    def apply_bandwidth_settings(self):
+        """把传输控制选项卡中的设置应用到调度器"""
+        try:
+            global_rate = int(self.global_rate_var.get() or 0) * 1024
+            client_rate = int(self.client_rate_var.get() or 0) * 1024
+            max_concurrent = int(self.max_concurrent_var.get() or 0)
+        except ValueError:
+            messagebox.showerror("错误", "限速和并发数必须是数字")
+            return
+        if min(global_rate, client_rate, max_concurrent) < 0:
+            messagebox.showerror("错误", "限速和并发数不能为负数")
+            return
+        
+        priorities = {}
+        for level, var in ((PRIORITY_LOW, self.low_priority_var), (PRIORITY_HIGH, self.high_priority_var)):
+            for ip in var.get().split(","):
+                if ip.strip():
+                    priorities[ip.strip()] = level
+        
+        self.server_manager.scheduler.configure(
+            global_rate=global_rate,
+            client_rate=client_rate,
+            max_concurrent=max_concurrent,
+            client_priorities=priorities
+        )
+        self.status_var.set("传输控制设置已应用")
     
     def start_server(self):
         """启动Flask服务器"""
@@ -323,24 +542,42 @@ class FileTransferGUI:
             messagebox.showerror("错误", "端口必须是数字")
             return
         
+        try:
+            threads = int(self.threads_var.get())
+        except ValueError:
+            messagebox.showerror("错误", "线程数必须是数字")
+            return
+        self.server_manager.configure_engine(engine=self.engine_var.get(), threads=threads)
+        
         # 更新cpolar内网地址
         self.cpolar_local_addr_var.set(f"127.0.0.1:{port}")
         
-        # 启动服务器
-        success = self.server_manager.start_server(port, self.shared_files)
-        if success:
-            self.status_var.set(f"服务器已启动在 http://{self.local_ip}:{port}")
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
-        else:
-            messagebox.showerror("错误", "无法启动服务器")
+        # 启动服务器：绑定端口后立即返回，不需要等待
+        try:
+            self.server_manager.start(port, local_ip=self.local_ip)
+        except Exception as e:
+            messagebox.showerror("错误", f"无法启动服务器: {e}")
+            return
+        
+        self.status_var.set(f"服务器已启动在 http://{self.local_ip}:{port} ({self.server_manager.engine})")
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
     
     def stop_server(self):
-        """停止Flask服务器"""
-        self.server_manager.stop_server()
+        """停止Flask服务器，在后台等待进行中的传输完成，不阻塞界面"""
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.DISABLED)
+        self.status_var.set("正在停止服务器，等待进行中的传输完成...")
+        
+        def stop():
+            self.server_manager.stop()
+            self.root.after(0, self.server_stopped)
         
+        threading.Thread(target=stop, daemon=True).start()
+    
+    def server_stopped(self):
+        """服务器已停止（在主线程中调用）"""
         self.start_button.config(state=tk.NORMAL)
-        self.stop_button.config(state=tk.DISABLED)
         self.status_var.set("服务器已停止")
         
         # 如果cpolar正在运行，也停止它
@@ -353,12 +590,10 @@ class FileTransferGUI:
             messagebox.showerror("错误", "未检测到cpolar安装，请先安装cpolar")
             return
         
-        if not self.server_manager.is_server_running():
+        if not self.server_manager.is_running():
             messagebox.showwarning("警告", "Flask服务器未启动，将自动启动")
             self.start_server()
-            time.sleep(1)  # 等待服务器启动
-            
-            if not self.server_manager.is_server_running():
+            if not self.server_manager.is_running():
                 return
         
         token = self.cpolar_token_var.get().strip()
@@ -366,115 +601,125 @@ class FileTransferGUI:
             messagebox.showerror("错误", "请输入cpolar认证令牌")
             return
         
-        # 配置cpolar
         try:
-            # 设置认证令牌
-            subprocess.run(['cpolar', 'authtoken', token], check=True, capture_output=True)
-            
-            # 启动cpolar
-            self.cpolar_running = True
-            self.start_cpolar_button.config(state=tk.DISABLED)
-            self.stop_cpolar_button.config(state=tk.NORMAL)
-            
-            self.cpolar_thread = threading.Thread(
-                target=self.run_cpolar,
-                daemon=True
-            )
-            self.cpolar_thread.start()
-            
-            self.status_var.set("正在启动cpolar内网穿透...")
-            self.cpolar_log.delete(1.0, tk.END)
-            self.cpolar_log.insert(tk.END, "正在启动cpolar...\n")
-            self.cpolar_log.see(tk.END)
-            
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("错误", f"cpolar配置失败: {e.stderr.decode()}")
+            count = int(self.tunnel_count_var.get())
+        except ValueError:
+            messagebox.showerror("错误", "隧道数必须是数字")
+            return
+        
+        # 设置认证令牌和启动cpolar都在监督线程中进行
+        self.cpolar_running = True
+        self.start_cpolar_button.config(state=tk.DISABLED)
+        self.stop_cpolar_button.config(state=tk.NORMAL)
+        self.status_var.set("正在启动cpolar内网穿透...")
+        self.tunnel_log.clear()
+        self.tunnel_log.append("正在启动cpolar...")
+        self.tunnel_supervisor.start(
+            self.cpolar_local_addr_var.get(),
+            protocol=self.cpolar_protocol_var.get(),
+            count=max(1, count),
+            authtoken=token
+        )
     
-    def run_cpolar(self):
-        """运行cpolar进程"""
-        try:
-            protocol = self.cpolar_protocol_var.get()
-            local_addr = self.cpolar_local_addr_var.get()
-            
-            # 启动cpolar进程，指定UTF-8编码
-            cpolar_process = subprocess.Popen(
-                ['cpolar', protocol, local_addr],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=False  # 使用二进制模式读取输出
-            )
-            
-            # 读取输出并更新UI
-            while self.cpolar_running and cpolar_process.poll() is None:
-                try:
-                    line = cpolar_process.stdout.readline()
-                    if not line:
-                        break
-                    
-                    # 尝试使用UTF-8解码，如果失败则使用系统默认编码
-                    try:
-                        decoded_line = line.decode('utf-8')
-                    except UnicodeDecodeError:
-                        # 尝试使用系统默认编码
-                        decoded_line = line.decode(sys.getdefaultencoding(), errors='replace')
-                    
-                    # 更新日志
-                    self.root.after(0, lambda l=decoded_line: self.update_cpolar_log(l))
-                    
-                    # 提取公网地址
-                    if 'Forwarding' in decoded_line:
-                        match = re.search(r'https?://[^\s]+', decoded_line)
-                        if match:
-                            public_url = match.group(0)
-                            self.root.after(0, lambda url=public_url: self.update_cpolar_url(url))
-                except Exception as e:
-                    # 捕获并记录读取错误
-                    self.root.after(0, lambda: self.update_cpolar_log(f"读取错误: {str(e)}\n"))
-            
-            # 进程结束
-            self.root.after(0, self.cpolar_stopped)
-            
-        except Exception as e:
-            self.root.after(0, lambda: self.update_cpolar_log(f"错误: {str(e)}\n"))
-            self.root.after(0, self.cpolar_stopped)
+    def on_tunnel_event(self, event):
+        """cpolar日志事件（在读取线程中调用）"""
+        if event.kind in (EVENT_RECONNECT, EVENT_ERROR):
+            self.root.after(0, self.status_var.set, f"cpolar: {event.line[-120:]}")
     
-    def update_cpolar_log(self, line):
-        """更新cpolar日志"""
-        self.cpolar_log.insert(tk.END, line)
-        self.cpolar_log.see(tk.END)
+    def flush_cpolar_log(self):
+        """按固定频率把缓冲中的新行批量写入日志控件，并删除超出保留行数的旧行"""
+        lines, self.tunnel_log_cursor, reset = self.tunnel_log.read_since(self.tunnel_log_cursor)
+        if lines or reset:
+            # 只有用户停留在底部时才自动滚动
+            follow = self.cpolar_log.yview()[1] >= 0.999
+            if reset:
+                self.cpolar_log.delete("1.0", tk.END)
+            if lines:
+                self.cpolar_log.insert(tk.END, "\n".join(lines) + "\n")
+            line_count = int(self.cpolar_log.index("end-1c").split(".")[0]) - 1
+            excess = line_count - self.tunnel_log.max_lines
+            if excess > 0:
+                self.cpolar_log.delete("1.0", f"{excess + 1}.0")
+            if follow:
+                self.cpolar_log.see(tk.END)
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_cpolar_log)
     
-    def update_cpolar_url(self, url):
-        """更新cpolar公网地址"""
-        self.cpolar_public_url = url
-        self.cpolar_url_var.set(url)
-        self.status_var.set(f"cpolar已启动，公网地址: {url}")
+    def apply_log_lines(self):
+        """调整cpolar日志保留行数"""
+        try:
+            max_lines = int(self.log_lines_var.get())
+        except ValueError:
+            return
+        if max_lines > 0:
+            self.tunnel_log.set_max_lines(max_lines)
+            # 下次刷新时整体重绘
+            self.tunnel_log_cursor = None
+    
+    def update_tunnel_status(self):
+        """隧道状态变化后更新公网地址显示（在主线程中调用）"""
+        if not self.cpolar_running:
+            return
+        supervisor = self.tunnel_supervisor
+        urls = supervisor.urls()
+        self.cpolar_public_url = urls[0] if urls else ""
+        if urls:
+            self.cpolar_url_var.set("  ".join(urls))
+            self.status_var.set(f"cpolar已启动，{len(urls)}/{len(supervisor.tunnels)} 个隧道可用")
+        elif supervisor.state == STATE_ERROR:
+            self.cpolar_stopped()
+            messagebox.showerror("错误", "cpolar配置失败，详见cpolar日志")
+        else:
+            self.cpolar_url_var.set("连接中...")
     
     def cpolar_stopped(self):
         """处理cpolar停止事件"""
         if self.cpolar_running:
             self.cpolar_running = False
+            self.cpolar_public_url = ""
             self.start_cpolar_button.config(state=tk.NORMAL)
             self.stop_cpolar_button.config(state=tk.DISABLED)
             self.cpolar_url_var.set("未启动")
             self.status_var.set("cpolar已停止")
     
     def stop_cpolar(self):
-        """停止cpolar内网穿透"""
+        """停止cpolar内网穿透，等待进程退出在后台进行"""
         if not self.cpolar_running:
             return
         
+        self.stop_cpolar_button.config(state=tk.DISABLED)
+        self.status_var.set("正在停止cpolar...")
+        
+        def stop():
+            self.tunnel_supervisor.stop()
+            self.root.after(0, self.cpolar_stopped)
+        
+        threading.Thread(target=stop, daemon=True).start()
+    
+    def apply_encryption_settings(self):
+        """按cpolar选项卡中的选项开关加密下载"""
+        if self.encryption_required_var.get():
+            self.encryption_var.set(True)
+        if not self.encryption_var.get():
+            self.server_manager.disable_encryption()
+            self.status_var.set("加密下载已关闭")
+            return
         try:
-            # 尝试终止cpolar进程
-            subprocess.run(['cpolar', 'kill'], check=True)
-            self.cpolar_stopped()
-        except Exception as e:
-            messagebox.showerror("错误", f"停止cpolar失败: {str(e)}")
+            self.server_manager.enable_encryption(required=self.encryption_required_var.get())
+        except RuntimeError as e:
+            self.encryption_var.set(False)
+            self.encryption_required_var.set(False)
+            messagebox.showerror("错误", str(e))
+            return
+        self.status_var.set("加密下载已开启，复制的公网地址会包含密钥")
     
     def copy_url(self):
         """复制公网地址到剪贴板"""
-        if self.cpolar_public_url:
+        # 多个隧道时轮流分发，把接收方分散到不同隧道
+        url = self.tunnel_supervisor.next_url()
+        if url:
+            key_text = self.server_manager.encryption_key_text()
             self.root.clipboard_clear()
-            self.root.clipboard_append(self.cpolar_public_url)
-            self.status_var.set("公网地址已复制到剪贴板")
+            self.root.clipboard_append(f"{url.rstrip('/')}/#key={key_text}" if key_text else url)
+            self.status_var.set(f"公网地址已复制到剪贴板: {url}" + ("（含密钥）" if key_text else ""))
         else:
             messagebox.showinfo("提示", "没有可用的公网地址")
\ No newline at end of file
@@ -0,0 +1,346 @@
+import mimetypes
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from functools import partial
+
+from flask import request
+
+from file_response import FileStream, TransferStream, TRANSFER_COMPRESSED
+
+# 可选的压缩库：未安装时只提供 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 可选的文件类型检测
+try:
+    import magic
+except ImportError:
+    magic = None
+
+# 服务端偏好顺序
+ENCODING_PREFERENCE = ("br", "zstd", "gzip")
+
+# 可压缩的非 text/* 类型
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "application/xml",
+    "application/xhtml+xml", "application/rss+xml", "application/x-sh",
+    "application/sql", "application/x-yaml", "application/toml",
+    "image/svg+xml", "image/bmp", "application/x-ndjson",
+}
+
+# 常见已压缩格式的文件头
+COMPRESSED_SIGNATURES = (
+    b"\x1f\x8b",                # gzip
+    b"PK\x03\x04",              # zip / docx / jar
+    b"7z\xbc\xaf\x27\x1c",      # 7z
+    b"Rar!",                    # rar
+    b"\xfd7zXZ\x00",            # xz
+    b"BZh",                     # bzip2
+    b"\x28\xb5\x2f\xfd",        # zstd
+    b"\x89PNG",                 # png
+    b"\xff\xd8\xff",            # jpeg
+    b"GIF8",                    # gif
+    b"RIFF",                    # webp / avi / wav
+    b"OggS",                    # ogg
+    b"fLaC",                    # flac
+    b"ID3",                     # mp3
+    b"\x1a\x45\xdf\xa3",        # mkv / webm
+    b"%PDF",                    # pdf（内部流通常已压缩）
+)
+
+# 文件嗅探读取的字节数
+SNIFF_SIZE = 4096
+
+
+def available_encodings():
+    """当前环境支持的压缩编码"""
+    encodings = ["gzip"]
+    if zstandard is not None:
+        encodings.insert(0, "zstd")
+    if brotli is not None:
+        encodings.insert(0, "br")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择编码，q值相同时按服务端偏好"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in available_encodings():
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def is_compressible_type(mimetype):
+    """判断MIME类型是否值得压缩"""
+    if not mimetype:
+        return False
+    mimetype = mimetype.split(";")[0].strip().lower()
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES or mimetype.endswith("+json")
+
+
+def is_compressible_file(file_path):
+    """通过文件头（及python-magic）判断文件内容是否可压缩"""
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return False
+    if not head or head.startswith(COMPRESSED_SIGNATURES) or head[4:8] == b"ftyp":
+        return False
+
+    if magic is not None:
+        try:
+            return is_compressible_type(magic.from_buffer(head, mime=True))
+        except Exception:
+            pass
+
+    guessed, encoding = mimetypes.guess_type(file_path)
+    if encoding is not None:
+        return False
+    if guessed is not None and is_compressible_type(guessed):
+        return True
+    # 未知类型：不含NUL字节的按文本处理
+    return b"\x00" not in head
+
+
+class _Compressor:
+    """统一的流式压缩接口"""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=level if level is not None else 5)
+            self._compress = self._obj.process
+            self._finish = self._obj.finish
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+            self._compress = self._obj.compress
+            self._finish = self._obj.flush
+        else:
+            self._obj = zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+            self._compress = self._obj.compress
+            self._finish = self._obj.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def compress_bytes(data, encoding, level=None):
+    """一次性压缩整段数据"""
+    compressor = _Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+class CompressedStream(TransferStream):
+    """压缩后的文件下载响应体
+
+    接管原响应体的带宽调度和传输统计回调，压缩的下载同样出现在传输监控
+    和指标中。data 为缓存的压缩结果；为 None 时边读边压缩，统计按读取的
+    原始字节计算，完整压缩后调用 on_compressed(data)。
+    """
+
+    def __init__(self, source, encoding, data=None, on_compressed=None):
+        super().__init__(source.file_path, source.environ, on_finish=source.on_finish, transfer=source.transfer,
+                         on_start=source.on_start)
+        # 原响应体只负责读取文件；sendfile 会绕过响应体直接写 socket，必须关闭
+        source.on_start = source.on_finish = source.transfer = None
+        source.allow_sendfile = False
+        self.source = source
+        self.encoding = encoding
+        self.data = data
+        self.on_compressed = on_compressed
+
+    def content_length(self):
+        if self.data is not None:
+            return len(self.data)
+        return self.source.content_length()
+
+    def close(self):
+        self.source.close()
+        super().close()
+
+    def _generate_body(self):
+        if self.transfer is not None:
+            self.transfer.start()
+        self.begin(TRANSFER_COMPRESSED)
+
+        if self.data is not None:
+            offset = 0
+            while offset < len(self.data):
+                piece = self.data[offset:offset + self._chunk_size(self.source.settings.buffer_size)]
+                offset += len(piece)
+                self._sent(len(piece))
+                yield piece
+            return
+
+        compressor = _Compressor(self.encoding)
+        output = [] if self.on_compressed is not None else None
+        for chunk in self.source:
+            self.record_sent(len(chunk))
+            yield from self._output(compressor.compress(chunk), output)
+        yield from self._output(compressor.finish(), output)
+        if output is not None and self.stats.completed:
+            self.on_compressed(b"".join(output))
+
+    def _output(self, data, output):
+        # 按压缩后的字节限速
+        if not data:
+            return
+        if output is not None:
+            output.append(data)
+        if self.transfer is not None:
+            self.transfer.throttle(len(data))
+        yield data
+
+
+class CompressedCache:
+    """已压缩文件的LRU缓存，键为 (路径, 修改时间, 大小, 编码)，按总字节数限制容量"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._items[key] = data
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+
+class ResponseCompressor:
+    """Flask after_request 钩子：按 Accept-Encoding 压缩响应
+
+    页面和JSON在内存中压缩；下载的文件先按文件头判断类型，已压缩的媒体和
+    压缩包原样发送，其他文件在输出响应体时流式压缩，不占用请求处理的时间；
+    较小的文件压缩结果进入LRU缓存，之后的请求直接发送并带上 Content-Length。
+    区间请求(206)和条件请求(304)的响应不压缩。HEAD 请求得到与 GET 相同的
+    响应头，但不生成响应体。
+    """
+
+    def __init__(self, min_size=1024, cache_max_file_size=8 * 1024 * 1024, cache_max_bytes=64 * 1024 * 1024):
+        self.enabled = True
+        self.min_size = min_size
+        self.cache_max_file_size = cache_max_file_size
+        self.cache = CompressedCache(cache_max_bytes)
+
+    def __call__(self, response):
+        if (not self.enabled
+                or response.status_code != 200
+                or "Content-Encoding" in response.headers
+                or "Content-Range" in response.headers):
+            return response
+
+        body = response.response
+        if isinstance(body, FileStream):
+            if not body.is_whole_file() or not is_compressible_file(body.file_path):
+                return response
+        elif response.direct_passthrough or not is_compressible_type(response.mimetype):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+
+        if isinstance(body, FileStream):
+            return self.compress_file_response(response, body, encoding)
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+        self.mark_encoded(response, encoding)
+        return response
+
+    def compress_file_response(self, response, body, encoding):
+        """压缩文件下载：缓存命中时直接发送，否则流式压缩，小文件压缩完成后写入缓存"""
+        try:
+            st = os.stat(body.file_path)
+        except OSError:
+            return response
+
+        data = on_compressed = None
+        if st.st_size <= self.cache_max_file_size:
+            key = (body.file_path, st.st_mtime_ns, st.st_size, encoding)
+            data = self.cache.get(key)
+            if data is None:
+                if request.method != "HEAD":
+                    on_compressed = partial(self._cache_file, key, body.file_path, st)
+            elif len(data) >= st.st_size:
+                # 压缩没有收益，原样发送（仍可使用 sendfile）
+                return response
+
+        if request.method != "HEAD":
+            response.response = CompressedStream(body, encoding, data, on_compressed)
+        if data is not None:
+            response.headers["Content-Length"] = str(len(data))
+        else:
+            response.headers.pop("Content-Length", None)
+        self.mark_encoded(response, encoding)
+        return response
+
+    def _cache_file(self, key, file_path, stat_result, data):
+        # 压缩期间文件发生变化时，结果与缓存键对应的版本不一致
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        if (st.st_size, st.st_mtime_ns) == (stat_result.st_size, stat_result.st_mtime_ns):
+            self.cache.put(key, data)
+
+    def mark_encoded(self, response, encoding):
+        """设置编码相关的响应头"""
+        response.headers["Content-Encoding"] = encoding
+        # 压缩后的表示不支持区间请求，ETag 改为弱校验器
+        response.headers.pop("Accept-Ranges", None)
+        # 摘要是未编码内容的，与编码后的响应体不符
+        for name in ("Digest", "Repr-Digest", "Content-MD5"):
+            response.headers.pop(name, None)
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
@@ -0,0 +1,221 @@
+import json
+import os
+import signal
+import threading
+import time
+
+# 配置文件中可用的字段及默认值，命令行参数优先于配置文件
+DEFAULT_CONFIG = {
+    "port": 5000,
+    "engine": "waitress",
+    "threads": 8,
+    # 共享的文件和文件夹
+    "shares": [],
+    "upload_folder": None,
+    # 是否接收远端上传，以及单个上传的大小上限（MB，0 为不限）
+    "uploads": False,
+    "max_upload_size": 4096,
+    # 共享列表的保存位置，None 为默认位置，空字符串表示不保存
+    "state": None,
+    # 限速（KB/s，0 为不限）和最大并发下载数
+    "global_rate": 0,
+    "client_rate": 0,
+    "max_concurrent": 0,
+    # cpolar 隧道数，0 表示不启动；认证令牌也可以通过 CPOLAR_AUTHTOKEN 环境变量提供
+    "tunnels": 0,
+    "tunnel_protocol": "http",
+    "authtoken": None,
+    # 加密下载：off、on 或 required；密钥为空时每次启动随机生成
+    "encryption": "off",
+    "encryption_key": None,
+    # 停止时等待进行中的下载完成的秒数
+    "drain_timeout": 10,
+    # 是否允许远端访问 /metrics 和 /api/transfers，默认只允许本机
+    "public_stats": False,
+}
+
+
+def load_config(path):
+    """读取 JSON 配置文件，格式错误或有未知字段时抛出 ValueError"""
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("配置文件必须是 JSON 对象")
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的配置项: {', '.join(sorted(unknown))}")
+    return config
+
+
+def resolve_config(args):
+    """合并默认值、配置文件和命令行参数（值为 None 的参数表示未指定）"""
+    config = dict(DEFAULT_CONFIG)
+    if args.config:
+        config.update(load_config(args.config))
+    for key in DEFAULT_CONFIG:
+        value = getattr(args, key, None)
+        if value is None:
+            continue
+        if key == "shares":
+            config["shares"] = list(config["shares"]) + list(value)
+        else:
+            config[key] = value
+    if not config["authtoken"]:
+        config["authtoken"] = os.environ.get("CPOLAR_AUTHTOKEN")
+    return config
+
+
+class Daemon:
+    """无界面运行：直接驱动 ServerManager，不导入 Tkinter
+
+    服务器相关模块在 start() 中才导入，解析参数和 --help 不需要加载 Flask；
+    本机IP等环境检测在后台进行，不推迟端口开始监听的时间。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.server_manager = None
+        self.tunnel_supervisor = None
+        self.stop_event = threading.Event()
+        self.started_at = time.monotonic()
+        self._tunnel_urls = []
+
+    def start(self):
+        from server import ServerManager, SERVER_ENGINES, DEFAULT_STATE_PATH
+
+        config = self.config
+        if config["engine"] not in SERVER_ENGINES:
+            raise ValueError(f"不支持的服务引擎: {config['engine']}")
+        state = config["state"]
+        options = {
+            "engine": config["engine"],
+            "threads": config["threads"],
+            "state_path": DEFAULT_STATE_PATH if state is None else (state or None),
+        }
+        if config["upload_folder"]:
+            options["upload_folder"] = config["upload_folder"]
+        self.server_manager = ServerManager(**options)
+        uploads = self.server_manager.uploads
+        uploads.enabled = bool(config["uploads"])
+        uploads.max_upload_size = config["max_upload_size"] * 1024 * 1024 or None
+        if uploads.enabled:
+            print(f"已允许远端上传到 {uploads.upload_folder}")
+        self.server_manager.public_stats = bool(config["public_stats"])
+        self.server_manager.scheduler.configure(
+            global_rate=config["global_rate"] * 1024,
+            client_rate=config["client_rate"] * 1024,
+            max_concurrent=config["max_concurrent"]
+        )
+        self.add_shares(config["shares"])
+        if config["encryption"] != "off":
+            self.enable_encryption()
+
+        self.server_manager.start(config["port"])
+        print(f"服务器已启动在端口 {config['port']} ({config['engine']})，"
+              f"用时 {time.monotonic() - self.started_at:.2f} 秒，共享 {len(self.server_manager.registry)} 个文件")
+        threading.Thread(target=self.probe_local_ip, daemon=True).start()
+
+        if config["tunnels"]:
+            self.start_tunnels()
+
+    def enable_encryption(self):
+        from encryption import decode_key
+
+        config = self.config
+        if config["encryption"] not in ("on", "required"):
+            raise ValueError(f"不支持的加密下载设置: {config['encryption']}")
+        key = decode_key(config["encryption_key"]) if config["encryption_key"] else None
+        self.server_manager.enable_encryption(key, required=config["encryption"] == "required")
+        print("加密下载已开启" + ("，不允许明文下载" if config["encryption"] == "required" else "")
+              + "，请分享下面带 #key= 的完整地址")
+
+    def share_url(self, url):
+        """分享给接收方的地址，开启加密下载时带上密钥"""
+        key_text = self.server_manager.encryption_key_text()
+        return f"{url.rstrip('/')}/#key={key_text}" if key_text else url
+
+    def add_shares(self, paths):
+        """添加共享的文件；文件夹在后台扫描并持续监控"""
+        from folder_scanner import FolderScanner
+
+        registry = self.server_manager.registry
+        watcher = self.server_manager.watcher
+        files = []
+        for path in paths:
+            path = os.path.abspath(os.path.expanduser(path))
+            if os.path.isfile(path):
+                files.append(path)
+            elif os.path.isdir(path):
+                # 从上次保存的状态恢复的文件夹由后台校验负责同步
+                if watcher.find_root(path) is not None:
+                    continue
+                watcher.add_root(path)
+                FolderScanner(path, on_batch=registry.add_stats, on_done=self.scan_finished).start()
+            else:
+                print(f"跳过不存在的路径: {path}")
+        if files:
+            registry.add_paths(files)
+
+    def scan_finished(self, scanner):
+        summary = f"{scanner.files_found} 个文件，用时 {scanner.elapsed:.1f} 秒"
+        if scanner.errors:
+            summary += f"，跳过 {scanner.errors} 个无法访问的项目"
+        print(f"已扫描 {scanner.folder_path}: {summary}")
+
+    def probe_local_ip(self):
+        from server import get_local_ip
+
+        local_ip = get_local_ip()
+        self.server_manager.local_ip = local_ip
+        url = self.share_url(f"http://{local_ip}:{self.config['port']}")
+        print(f"局域网访问地址: {url}")
+
+    def start_tunnels(self):
+        from tunnel import TunnelSupervisor
+        from tunnel_log import TunnelLog
+
+        config = self.config
+        log = TunnelLog()
+        log.subscribe(self.tunnel_event)
+        self.tunnel_supervisor = TunnelSupervisor(log)
+        self.tunnel_supervisor.subscribe(self.tunnel_changed)
+        self.tunnel_supervisor.start(
+            f"127.0.0.1:{config['port']}",
+            protocol=config["tunnel_protocol"],
+            count=config["tunnels"],
+            authtoken=config["authtoken"]
+        )
+
+    def tunnel_event(self, event):
+        from tunnel_log import EVENT_RECONNECT, EVENT_ERROR
+
+        if event.kind in (EVENT_RECONNECT, EVENT_ERROR):
+            print(f"cpolar: {event.line}")
+
+    def tunnel_changed(self):
+        urls = self.tunnel_supervisor.urls()
+        if urls != self._tunnel_urls:
+            self._tunnel_urls = urls
+            shown = [self.share_url(url) for url in urls]
+            print(f"公网访问地址: {'  '.join(shown) if shown else '（暂无可用隧道）'}")
+
+    def stop(self):
+        """停止隧道和服务器，先等待进行中的下载完成"""
+        if self.tunnel_supervisor is not None:
+            self.tunnel_supervisor.stop()
+        if self.server_manager is not None:
+            self.server_manager.stop(drain_timeout=self.config["drain_timeout"])
+            self.server_manager.close()
+
+    def run(self):
+        """启动并阻塞到收到 SIGINT/SIGTERM"""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda signum, frame: self.stop_event.set())
+        try:
+            self.start()
+            # 定时醒来，让 Windows 上的 Ctrl+C 也能及时处理
+            while not self.stop_event.wait(1):
+                pass
+            print("正在停止...")
+        finally:
+            self.stop()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+import urllib.request
+
+from delta_sync import (BlockMatcher, BLOCK_RECORD, MAX_DELTA_RUNS, block_count, run_segments,
+                        signature_from_dict, strong_checksum)
+from file_registry import format_size
+
+# 网络请求超时（秒）
+REQUEST_TIMEOUT = 60
+# 从旧版本复制数据时每次写入的字节数
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def fetch_signature(base_url, file_id):
+    """获取服务端文件当前版本的签名"""
+    url = f"{base_url}/api/files/{file_id}/signature"
+    with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response:
+        return signature_from_dict(json.load(response))
+
+
+def read_exact(stream, length):
+    data = stream.read(length)
+    if len(data) != length:
+        raise ValueError("增量数据不完整，连接可能已中断")
+    return data
+
+
+class DeltaDownload:
+    """用本地旧版本和服务端的块签名重建新版本，只下载内容变化的块
+
+    重建结果先写入临时文件，所有块都通过强校验后才替换输出文件，
+    输出文件可以就是旧版本本身。
+    """
+
+    def __init__(self, base_url, file_id, basis_path, output_path=None):
+        self.base_url = base_url.rstrip("/")
+        self.file_id = file_id
+        self.basis_path = basis_path
+        self.output_path = output_path or basis_path
+        self.signature = None
+        self.matcher = None
+        self.downloaded = 0
+
+    def run(self):
+        self.signature = fetch_signature(self.base_url, self.file_id)
+        self.matcher = BlockMatcher(self.signature)
+        self.matcher.match_file(self.basis_path)
+
+        temp_path = self.output_path + ".delta-part"
+        try:
+            with open(temp_path, "wb") as out:
+                out.truncate(self.signature.size)
+                self.copy_matched(out)
+                runs = self.matcher.missing_runs()
+                for start in range(0, len(runs), MAX_DELTA_RUNS):
+                    self.fetch_runs(out, runs[start:start + MAX_DELTA_RUNS])
+            os.replace(temp_path, self.output_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def copy_matched(self, out):
+        """从旧版本复制匹配的块，来源连续的块合并为一次复制"""
+        block_size = self.signature.block_size
+        pieces = []
+        for index, source in enumerate(self.matcher.sources):
+            if source is None:
+                continue
+            length = min(block_size, self.signature.size - index * block_size)
+            target = index * block_size
+            if pieces and pieces[-1][0] + pieces[-1][2] == target and pieces[-1][1] + pieces[-1][2] == source:
+                pieces[-1][2] += length
+            else:
+                pieces.append([target, source, length])
+        if not pieces:
+            return
+        with open(self.basis_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for target, source, length in pieces:
+                out.seek(target)
+                for offset in range(source, source + length, COPY_BUFFER_SIZE):
+                    out.write(data[offset:min(offset + COPY_BUFFER_SIZE, source + length)])
+
+    def fetch_runs(self, out, runs):
+        """下载一批缺少的块，逐块校验后写入"""
+        signature = self.signature
+        block_size = signature.block_size
+        request = urllib.request.Request(
+            f"{self.base_url}/api/files/{self.file_id}/delta",
+            data=json.dumps({"block_size": block_size, "blocks": runs}).encode("utf-8"),
+            headers={"Content-Type": "application/json", "If-Match": f'"{signature.etag}"'},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            for (first, count), (_, start, length) in zip(runs, run_segments(runs, block_size, signature.size)):
+                out.seek(start)
+                for index in range(first, first + count):
+                    block = read_exact(response, min(block_size, start + length - index * block_size))
+                    _, strong = BLOCK_RECORD.unpack_from(signature.blocks, index * BLOCK_RECORD.size)
+                    if strong_checksum(block) != strong:
+                        raise ValueError(f"第 {index} 块校验失败")
+                    out.write(block)
+                    self.downloaded += len(block)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="增量下载：用本地的旧版本重建共享文件的新版本，只下载内容变化的块"
+    )
+    parser.add_argument("server", help="服务器地址，如 http://192.168.1.5:5000 或 cpolar 公网地址")
+    parser.add_argument("file_id", type=int, help="文件ID（见 /api/files 中的 id）")
+    parser.add_argument("basis", help="本地的旧版本文件")
+    parser.add_argument("-o", "--output", help="输出文件（默认原地更新旧版本）")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    download = DeltaDownload(args.server, args.file_id, args.basis, args.output)
+    try:
+        download.run()
+    except (OSError, ValueError) as e:
+        print(f"增量下载失败: {e}")
+        return 1
+
+    signature = download.signature
+    total = block_count(signature.size, signature.block_size)
+    print(f"已更新 {download.output_path}: 复用 {download.matcher.matched}/{total} 块，"
+          f"下载 {format_size(download.downloaded)} / {format_size(signature.size)}，"
+          f"用时 {time.monotonic() - started:.1f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import base64
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# 块大小取文件大小的平方根，向上取整到 2 的幂并限制在以下范围内
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# 弱校验和为可滚动计算的 Adler-32；强校验为 SHA-256 的前 16 字节，
+# 浏览器中可以用 WebCrypto 计算
+WEAK_ALGORITHM = "adler32"
+STRONG_ALGORITHM = "sha256"
+STRONG_LENGTH = 16
+ADLER_MOD = 65521
+# 签名中每块一条记录：弱校验和（大端 32 位）+ 强校验
+BLOCK_RECORD = struct.Struct(f">I{STRONG_LENGTH}s")
+
+# 计算签名时每个任务处理的块数
+SIGNATURE_BATCH_BLOCKS = 64
+# 内存中缓存的签名数
+SIGNATURE_CACHE_SIZE = 32
+
+# 一次增量请求最多包含的块区间数
+MAX_DELTA_RUNS = 4096
+
+# 匹配失败后沿同一块网格向后探测的块数，原地修改时不需要逐字节滚动
+GRID_PROBE_BLOCKS = 16
+# 滚动搜索一个块的范围仍未命中时向后跳过的块数，每次翻倍直到该上限
+MAX_SKIP_BLOCKS = 64
+
+# 一个文件版本的签名：大小、块大小、ETag 和按块顺序打包的记录
+Signature = namedtuple("Signature", ["size", "block_size", "etag", "blocks"])
+
+
+class DeltaError(Exception):
+    """增量同步错误，带有应答的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def choose_block_size(file_size):
+    """按文件大小选择块大小（2GB 的文件为 64KB）"""
+    block_size = MIN_BLOCK_SIZE
+    while block_size * block_size < file_size and block_size < MAX_BLOCK_SIZE:
+        block_size *= 2
+    return block_size
+
+
+def block_count(file_size, block_size):
+    return (file_size + block_size - 1) // block_size
+
+
+def strong_checksum(data):
+    return hashlib.sha256(data).digest()[:STRONG_LENGTH]
+
+
+def _signature_batch(file_path, first, count, block_size):
+    """在线程池中执行：计算从第 first 块开始的 count 块的记录"""
+    records = []
+    with open(file_path, "rb") as f:
+        f.seek(first * block_size)
+        data = memoryview(f.read(count * block_size))
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        records.append(BLOCK_RECORD.pack(zlib.adler32(block), strong_checksum(block)))
+    return b"".join(records)
+
+
+def compute_signature(file_path, block_size=None, executor=None):
+    """计算文件的块签名；计算期间文件被修改时抛出 DeltaError"""
+    # 只有服务端计算签名，客户端导入本模块时不需要加载 Flask
+    from file_response import make_etag
+
+    st = os.stat(file_path)
+    block_size = block_size or choose_block_size(st.st_size)
+    count = block_count(st.st_size, block_size)
+    batches = range(0, count, SIGNATURE_BATCH_BLOCKS)
+
+    def batch(first):
+        return _signature_batch(file_path, first, min(SIGNATURE_BATCH_BLOCKS, count - first), block_size)
+
+    if executor is None:
+        blocks = b"".join(map(batch, batches))
+    else:
+        blocks = b"".join(executor.map(batch, batches))
+
+    after = os.stat(file_path)
+    if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+        raise DeltaError("文件在计算签名时被修改，请稍后重试", 409)
+    if len(blocks) != count * BLOCK_RECORD.size:
+        raise DeltaError("文件在计算签名时被截断，请稍后重试", 409)
+    return Signature(st.st_size, block_size, make_etag(st), blocks)
+
+
+def signature_as_dict(signature):
+    """签名的 JSON 表示，块记录以 base64 编码"""
+    return {
+        "size": signature.size,
+        "block_size": signature.block_size,
+        "etag": signature.etag,
+        "weak": WEAK_ALGORITHM,
+        "strong": STRONG_ALGORITHM,
+        "strong_length": STRONG_LENGTH,
+        "blocks": base64.b64encode(signature.blocks).decode("ascii"),
+    }
+
+
+def signature_from_dict(data):
+    """解析签名的 JSON 表示，格式不支持时抛出 ValueError"""
+    if (data.get("weak"), data.get("strong"), data.get("strong_length")) != \
+            (WEAK_ALGORITHM, STRONG_ALGORITHM, STRONG_LENGTH):
+        raise ValueError("不支持的签名算法")
+    signature = Signature(int(data["size"]), int(data["block_size"]), data["etag"],
+                          base64.b64decode(data["blocks"]))
+    if len(signature.blocks) != block_count(signature.size, signature.block_size) * BLOCK_RECORD.size:
+        raise ValueError("签名长度与文件大小不符")
+    return signature
+
+
+def parse_runs(value, total_blocks):
+    """解析增量请求中的块区间 [[起始块, 块数], ...]，要求递增且不重叠，相邻区间合并"""
+    if not isinstance(value, list) or not value or len(value) > MAX_DELTA_RUNS:
+        raise DeltaError(f"blocks 必须是 1 到 {MAX_DELTA_RUNS} 个区间")
+    runs = []
+    next_block = 0
+    for item in value:
+        if (not isinstance(item, list) or len(item) != 2
+                or not all(isinstance(v, int) and not isinstance(v, bool) for v in item)):
+            raise DeltaError("区间格式应为 [起始块, 块数]")
+        first, count = item
+        if count <= 0 or first < next_block or first + count > total_blocks:
+            raise DeltaError("区间必须递增、不重叠且不超出文件")
+        if runs and runs[-1][0] + runs[-1][1] == first:
+            runs[-1][1] += count
+        else:
+            runs.append([first, count])
+        next_block = first + count
+    return runs
+
+
+def run_segments(runs, block_size, file_size):
+    """块区间对应的文件响应分段 (前置字节, 起始偏移, 长度)"""
+    segments = []
+    for first, count in runs:
+        start = first * block_size
+        segments.append((b"", start, min(start + count * block_size, file_size) - start))
+    return segments
+
+
+class SignatureCache:
+    """(路径, 大小, 修改时间) -> 签名 的内存缓存
+
+    签名在线程池中按批并行计算；同一文件版本同时被多个接收方请求时
+    只计算一次，其余请求等待同一个结果。
+    """
+
+    def __init__(self, max_entries=SIGNATURE_CACHE_SIZE, workers=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 2),
+            thread_name_prefix="signature"
+        )
+
+    def get(self, file_path):
+        """返回文件当前版本的签名"""
+        st = os.stat(file_path)
+        key = (os.path.normpath(file_path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            future = self._entries.get(key)
+            owner = future is None
+            if owner:
+                future = self._entries[key] = Future()
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+
+        if owner:
+            try:
+                future.set_result(compute_signature(file_path, executor=self._executor))
+            except Exception as e:
+                with self._lock:
+                    if self._entries.get(key) is future:
+                        del self._entries[key]
+                future.set_exception(e)
+        return future.result()
+
+    def shutdown(self):
+        """停止线程池"""
+        self._executor.shutdown(wait=False)
+
+
+class BlockMatcher:
+    """在本地旧版本中查找与签名中的块内容相同的位置
+
+    先在与上一个匹配对齐的块网格上用 C 实现的 Adler-32 检查，原地修改
+    （虚拟机镜像、数据库）和追加（日志）都只走这条快速路径；只有内容发生
+    偏移时才逐字节滚动计算弱校验和，滚动一个块的范围仍未命中时按翻倍的
+    步长向后跳过，避免在完全不同的内容上逐字节扫描整个文件。
+    """
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.block_size = signature.block_size
+        self.count = block_count(signature.size, signature.block_size)
+        # 每块在旧版本中的偏移，None 表示需要下载
+        self.sources = [None] * self.count
+        self.matched = 0
+        # 弱校验和 -> 强校验 -> 块序号列表（内容相同的块共享一个来源）
+        self._table = {}
+        # 完整块和末尾不足一块的块分开查找
+        self._tail = None
+        tail_size = signature.size - (self.count - 1) * self.block_size if self.count else 0
+        for index, (weak, strong) in enumerate(BLOCK_RECORD.iter_unpack(signature.blocks)):
+            if index == self.count - 1 and tail_size < self.block_size:
+                self._tail = (index, tail_size, weak, strong)
+                continue
+            self._table.setdefault(weak, {}).setdefault(strong, []).append(index)
+
+    def match_file(self, basis_path):
+        """扫描旧版本文件，返回每块的来源偏移列表"""
+        size = os.path.getsize(basis_path)
+        if size == 0 or self.count == 0:
+            return self.sources
+        with open(basis_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            self.match(data, size)
+        return self.sources
+
+    def match(self, data, size):
+        block_size = self.block_size
+        pos = 0
+        skip = 1
+        # 当前未匹配区域的起点，跳过的部分在重新对齐后向前补查
+        gap_start = None
+        while pos + block_size <= size and self.matched < self.count:
+            if self._check(data, pos):
+                pos += block_size
+                skip = 1
+                gap_start = None
+                continue
+            if gap_start is None:
+                gap_start = pos
+            found = self._probe_grid(data, pos, size)
+            if found is None:
+                found = self._roll(data, pos, min(pos + block_size, size - block_size))
+                if found is not None:
+                    self._backfill(data, found, gap_start)
+            if found is not None:
+                pos = found + block_size
+                skip = 1
+                gap_start = None
+                continue
+            pos += skip * block_size
+            skip = min(skip * 2, MAX_SKIP_BLOCKS)
+        self._match_tail(data, size)
+
+    def _check(self, data, pos):
+        window = data[pos:pos + self.block_size]
+        return self._assign(zlib.adler32(window), window, pos)
+
+    def _assign(self, weak, window, pos):
+        """弱校验和命中时比较强校验，记录所有内容相同且未匹配的块"""
+        candidates = self._table.get(weak)
+        if candidates is None:
+            return False
+        indexes = candidates.get(strong_checksum(window))
+        if indexes is None:
+            return False
+        for index in indexes:
+            if self.sources[index] is None:
+                self.sources[index] = pos
+                self.matched += 1
+        return True
+
+    def _probe_grid(self, data, pos, size):
+        """在 pos 之后的块网格上查找匹配，返回命中的偏移"""
+        block_size = self.block_size
+        for step in range(1, GRID_PROBE_BLOCKS + 1):
+            offset = pos + step * block_size
+            if offset + block_size > size:
+                break
+            if self._check(data, offset):
+                return offset
+        return None
+
+    def _backfill(self, data, found, gap_start):
+        """滚动命中后沿新的块网格向前检查，找回跳过步长时越过的块"""
+        offset = found - self.block_size
+        while offset >= gap_start and self._check(data, offset):
+            offset -= self.block_size
+
+    def _roll(self, data, pos, stop):
+        """从 pos+1 到 stop 逐字节滚动弱校验和，返回第一个命中的偏移"""
+        block_size = self.block_size
+        table = self._table
+        value = zlib.adler32(data[pos:pos + block_size])
+        a = value & 0xffff
+        b = value >> 16
+        i = pos
+        while i < stop:
+            out_byte = data[i]
+            in_byte = data[i + block_size]
+            a = (a - out_byte + in_byte) % ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+            i += 1
+            weak = b << 16 | a
+            if weak in table and self._assign(weak, data[i:i + block_size], i):
+                return i
+        return None
+
+    def _match_tail(self, data, size):
+        """末尾不足一块的块只在旧版本的相同位置和末尾查找"""
+        if self._tail is None:
+            return
+        index, length, weak, strong = self._tail
+        if self.sources[index] is not None:
+            return
+        for pos in (index * self.block_size, size - length):
+            if 0 <= pos and pos + length <= size:
+                window = data[pos:pos + length]
+                if zlib.adler32(window) == weak and strong_checksum(window) == strong:
+                    self.sources[index] = pos
+                    self.matched += 1
+                    return
+
+    def missing_runs(self):
+        """需要下载的块区间 [[起始块, 块数], ...]"""
+        runs = []
+        for index, source in enumerate(self.sources):
+            if source is not None:
+                continue
+            if runs and runs[-1][0] + runs[-1][1] == index:
+                runs[-1][1] += 1
+            else:
+                runs.append([index, 1])
+        return runs
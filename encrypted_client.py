@@ -0,0 +1,137 @@
+import argparse
+import os
+import sys
+import time
+import urllib.request
+from urllib.parse import urldefrag, urlsplit, unquote, parse_qs
+
+from encryption import HEADER, TAG_SIZE, ChunkCipher, decode_key
+from file_registry import format_size
+
+# 网络请求超时（秒）
+REQUEST_TIMEOUT = 60
+
+
+def parse_link(link):
+    """拆分带密钥的链接，返回 (不含 # 部分的地址, 密钥)"""
+    url, fragment = urldefrag(link)
+    values = parse_qs(fragment).get("key")
+    if not values:
+        raise ValueError("链接中没有密钥（#key=...）")
+    return url, decode_key(values[0])
+
+
+def with_encrypted(url):
+    return url + ("&" if urlsplit(url).query else "?") + "encrypted=1"
+
+
+def read_exact(stream, length):
+    data = stream.read(length)
+    if len(data) != length:
+        raise ValueError("数据不完整，连接可能已中断")
+    return data
+
+
+class EncryptedDownload:
+    """下载分块加密的文件并逐块解密校验
+
+    解密后的明文按整块写入 <输出>.part；中断后再次运行时从最后一个完整的块
+    续传（If-Range 保证服务端的密文没有变化），完成后改名为输出文件。
+    """
+
+    def __init__(self, url, key, output_path):
+        self.url = with_encrypted(url)
+        self.key = key
+        self.output_path = output_path
+        self.part_path = output_path + ".part"
+        self.header_path = output_path + ".part-header"
+        self.cipher = None
+        self.etag = None
+        self.downloaded = 0
+        self.resumed_from = 0
+
+    def open(self, range_start, range_end=None):
+        headers = {"Range": f"bytes={range_start}-{'' if range_end is None else range_end}"}
+        if self.etag:
+            headers["If-Range"] = self.etag
+        request = urllib.request.Request(self.url, headers=headers)
+        return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+
+    def run(self):
+        with self.open(0, HEADER.size - 1) as response:
+            self.etag = response.headers.get("ETag")
+            self.cipher = ChunkCipher(self.key, read_exact(response, HEADER.size))
+        cipher = self.cipher
+        stride = cipher.chunk_size + TAG_SIZE
+
+        # 已解密的完整块可以直接保留；密文头（含文件版本的盐）变化说明
+        # 服务端文件已变化，只能从头下载
+        done = 0
+        if os.path.exists(self.part_path) and self.saved_header() == cipher.header:
+            done = min(os.path.getsize(self.part_path) // cipher.chunk_size, cipher.chunk_count)
+        else:
+            with open(self.header_path, "wb") as f:
+                f.write(cipher.header)
+        self.resumed_from = done * cipher.chunk_size
+
+        with open(self.part_path, "ab" if done else "wb") as out:
+            out.truncate(self.resumed_from)
+            out.seek(self.resumed_from)
+            if done < cipher.chunk_count:
+                with self.open(HEADER.size + done * stride) as response:
+                    if response.status != 206:
+                        raise ValueError("服务端文件在下载过程中发生变化，请重新运行")
+                    for index in range(done, cipher.chunk_count):
+                        length = min(cipher.chunk_size, cipher.plain_size - index * cipher.chunk_size) + TAG_SIZE
+                        data = cipher.decrypt(index, read_exact(response, length))
+                        out.write(data)
+                        self.downloaded += length
+        os.replace(self.part_path, self.output_path)
+        os.remove(self.header_path)
+
+    def saved_header(self):
+        try:
+            with open(self.header_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+def decrypt_file(input_path, key, output_path):
+    """解密已保存的 .cfxenc 文件"""
+    with open(input_path, "rb") as f, open(output_path, "wb") as out:
+        cipher = ChunkCipher(key, read_exact(f, HEADER.size))
+        for index in range(cipher.chunk_count):
+            length = min(cipher.chunk_size, cipher.plain_size - index * cipher.chunk_size) + TAG_SIZE
+            out.write(cipher.decrypt(index, read_exact(f, length)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下载并解密分享者提供的加密下载链接")
+    parser.add_argument("link", help="带密钥的下载链接，如 https://xxxx.cpolar.top/files/12/a.zip#key=...")
+    parser.add_argument("-o", "--output", help="输出文件（默认使用链接中的文件名）")
+    parser.add_argument("-i", "--input", help="解密已保存的 .cfxenc 文件，而不是从链接下载（链接可以只写 #key=...）")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    try:
+        url, key = parse_link(args.link)
+        output = args.output or unquote(os.path.basename(urlsplit(url).path)) or "download"
+        if args.input:
+            decrypt_file(args.input, key, output)
+            print(f"已解密到 {output}")
+            return 0
+        download = EncryptedDownload(url, key, output)
+        download.run()
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"下载失败: {e}")
+        return 1
+
+    resumed = f"，从 {format_size(download.resumed_from)} 处续传" if download.resumed_from else ""
+    print(f"已下载 {output}: {format_size(download.cipher.plain_size)}{resumed}，"
+          f"用时 {time.monotonic() - started:.1f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# 明文按固定大小分块，每块独立用 AES-256-GCM 加密并附带 16 字节认证标签，
+# 密文中任意位置都可以换算到所在的块，区间请求和断点续传不受影响。
+# 块大小记录在密文头中；块越大，每块在线程之间交接的开销占比越小
+CHUNK_SIZE = 1024 * 1024
+TAG_SIZE = 16
+KEY_SIZE = 32
+SALT_SIZE = 16
+
+# 密文头：魔数、块大小、明文大小和文件盐；整个头作为每块的附加认证数据
+MAGIC = b"CFXENC01"
+HEADER = struct.Struct(f">8sIQ{SALT_SIZE}s")
+KEY_INFO = b"CpolarFileXfer AES-256-GCM chunk key"
+
+# 每个工作线程最多预先加密的块数，限制一个下载占用的内存
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# (实现名称, 算法类, 认证失败的异常类)，第一次使用时导入，不开启加密时不增加启动时间
+_backend = None
+
+
+def load_backend():
+    """优先使用 cryptography（OpenSSL 实现，快一个数量级），未安装时使用 pycryptodome"""
+    global _backend
+    if _backend is None:
+        try:
+            from cryptography.exceptions import InvalidTag
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+            _backend = ("cryptography", AESGCM, InvalidTag)
+        except ImportError:
+            try:
+                from Crypto.Cipher import AES
+                _backend = ("pycryptodome", AES, ValueError)
+            except ImportError:
+                _backend = (None, None, None)
+    return _backend
+
+
+def encryption_backend():
+    """可用的加密实现名称，都未安装时返回 None"""
+    return load_backend()[0]
+
+
+def generate_key():
+    return os.urandom(KEY_SIZE)
+
+
+def encode_key(key):
+    """密钥的 URL 安全文本形式，放在链接的 # 部分，浏览器不会把它发给服务器"""
+    return base64.urlsafe_b64encode(key).rstrip(b"=").decode("ascii")
+
+
+def decode_key(text):
+    """解析密钥文本，格式错误时抛出 ValueError"""
+    text = text.strip()
+    try:
+        key = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("密钥格式错误")
+    if len(key) != KEY_SIZE:
+        raise ValueError("密钥长度错误")
+    return key
+
+
+def hkdf_sha256(key, salt, info, length=KEY_SIZE):
+    """RFC 5869 HKDF，浏览器中用 WebCrypto 的 HKDF 得到相同的结果"""
+    prk = hmac.new(salt, key, hashlib.sha256).digest()
+    output = b""
+    block = b""
+    counter = 1
+    while len(output) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+def chunk_count(plain_size, chunk_size=CHUNK_SIZE):
+    return (plain_size + chunk_size - 1) // chunk_size
+
+
+def encrypted_size(plain_size, chunk_size=CHUNK_SIZE):
+    return HEADER.size + plain_size + chunk_count(plain_size, chunk_size) * TAG_SIZE
+
+
+def make_header(plain_size, salt, chunk_size=CHUNK_SIZE):
+    return HEADER.pack(MAGIC, chunk_size, plain_size, salt)
+
+
+def parse_header(data):
+    """解析密文头，返回 (块大小, 明文大小, 盐)"""
+    if len(data) < HEADER.size:
+        raise ValueError("密文头不完整")
+    magic, chunk_size, plain_size, salt = HEADER.unpack_from(data)
+    if magic != MAGIC or chunk_size <= 0:
+        raise ValueError("不是加密下载的数据")
+    return chunk_size, plain_size, salt
+
+
+class ChunkCipher:
+    """一个密文头对应的分块加解密
+
+    每块的密钥由主密钥和头中的盐经 HKDF 派生，nonce 为块序号，
+    头作为附加认证数据，篡改大小或调换块的顺序都会导致认证失败。
+    """
+
+    def __init__(self, key, header):
+        self.header = bytes(header)
+        self.chunk_size, self.plain_size, self.salt = parse_header(self.header)
+        self._key = hkdf_sha256(key, self.salt, KEY_INFO)
+        backend, self._algorithm, self._invalid_tag = load_backend()
+        if backend is None:
+            raise RuntimeError("加密下载需要安装 cryptography 或 pycryptodome")
+        # cryptography 的 AESGCM 对象可以复用；pycryptodome 每块新建一个 GCM 对象
+        self._aead = self._algorithm(self._key) if backend == "cryptography" else None
+
+    @property
+    def chunk_count(self):
+        return chunk_count(self.plain_size, self.chunk_size)
+
+    def nonce(self, index):
+        return index.to_bytes(12, "big")
+
+    def encrypt(self, index, data):
+        """加密第 index 块，返回密文加认证标签"""
+        if self._aead is not None:
+            return self._aead.encrypt(self.nonce(index), bytes(data), self.header)
+        cipher = self._algorithm.new(self._key, self._algorithm.MODE_GCM, nonce=self.nonce(index))
+        cipher.update(self.header)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return ciphertext + tag
+
+    def decrypt(self, index, data):
+        """解密并校验第 index 块，认证失败时抛出 ValueError"""
+        if self._aead is not None:
+            try:
+                return self._aead.decrypt(self.nonce(index), bytes(data), self.header)
+            except self._invalid_tag:
+                raise ValueError(f"第 {index} 块认证失败")
+        cipher = self._algorithm.new(self._key, self._algorithm.MODE_GCM, nonce=self.nonce(index))
+        cipher.update(self.header)
+        try:
+            return cipher.decrypt_and_verify(data[:-TAG_SIZE], data[-TAG_SIZE:])
+        except ValueError:
+            raise ValueError(f"第 {index} 块认证失败")
+
+
+class DownloadEncryption:
+    """服务端的加密下载设置
+
+    主密钥只保存在本机，通过链接的 # 部分交给接收方，不经过隧道。每个
+    文件版本的盐由进程内的随机数和 (路径, 大小, 修改时间, inode) 计算，
+    同一版本的多次请求得到完全相同的密文（断点续传和并行区间下载依赖
+    这一点），文件变化或程序重启后盐随之改变，块序号 nonce 不会在同一
+    密钥下重复使用。required 为 True 时拒绝明文下载。
+    """
+
+    def __init__(self, key=None, required=False, workers=None):
+        if encryption_backend() is None:
+            raise RuntimeError("加密下载需要安装 cryptography 或 pycryptodome")
+        self.key = key or generate_key()
+        self.required = required
+        self._secret = os.urandom(32)
+        self.workers = workers or min(8, os.cpu_count() or 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encrypt")
+
+    @property
+    def key_text(self):
+        return encode_key(self.key)
+
+    def cipher_for(self, file_path, stat_result):
+        """文件当前版本的 ChunkCipher"""
+        identity = "\0".join(str(v) for v in (
+            os.path.normpath(file_path), stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+        ))
+        digest = hmac.new(self._secret, identity.encode("utf-8", "surrogateescape"), hashlib.sha256).digest()
+        return ChunkCipher(self.key, make_header(stat_result.st_size, digest[:SALT_SIZE]))
+
+    def shutdown(self):
+        """停止线程池"""
+        self.executor.shutdown(wait=False)
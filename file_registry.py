@@ -0,0 +1,206 @@
+import os
+import threading
+from collections import namedtuple
+
+# 一次注册表变更：新增、移除和字段被修改的条目列表
+RegistryDelta = namedtuple("RegistryDelta", ["added", "removed", "updated"])
+
+
+def format_size(size_bytes):
+    """格式化文件大小显示"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.2f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.2f} PB"
+
+
+class FileRegistry:
+    """共享文件注册表
+
+    每个条目有一个稳定的整数ID，同时按ID和路径建立索引，
+    增删操作按批进行，并只把变更部分(delta)通知给订阅者。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # ID -> 条目，字典保持插入顺序即列表顺序
+        self._entries = {}
+        # 路径 -> ID
+        self._path_index = {}
+        self._next_id = 1
+        self._version = 0
+        self._snapshot = None
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """订阅变更，listener(delta) 在锁外被调用"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """取消订阅"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    @property
+    def version(self):
+        """每次变更递增的版本号"""
+        return self._version
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_id):
+        return file_id in self._entries
+
+    def get(self, file_id):
+        """按ID获取条目"""
+        return self._entries.get(file_id)
+
+    def get_by_path(self, path):
+        """按路径获取条目"""
+        file_id = self._path_index.get(os.path.normpath(path))
+        if file_id is None:
+            return None
+        return self._entries.get(file_id)
+
+    def snapshot(self):
+        """返回当前条目列表，变更前重复调用会复用同一列表"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = list(self._entries.values())
+            return self._snapshot
+
+    def add_paths(self, paths):
+        """批量添加文件路径，返回新增的条目"""
+        items = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            items.append((path, st.st_size, st.st_mtime))
+        return self.add_stats(items)
+
+    def add_stats(self, items):
+        """批量添加 (路径, 字节数, 修改时间) 记录，已存在的路径会被跳过"""
+        added = []
+        with self._lock:
+            for path, size, mtime in items:
+                path = os.path.normpath(path)
+                if path in self._path_index:
+                    continue
+                entry = self._make_entry(self._next_id, path, size, mtime)
+                self._next_id += 1
+                self._entries[entry["id"]] = entry
+                self._path_index[path] = entry["id"]
+                added.append(entry)
+            if added:
+                self._changed()
+        if added:
+            self._notify(RegistryDelta(added, [], []))
+        return added
+
+    def restore(self, records):
+        """从持久化的 (ID, 路径, 字节数, 修改时间, 摘要) 记录恢复条目
+
+        保留原有ID且不访问文件系统，文件是否仍然存在由调用方随后校验。
+        """
+        added = []
+        with self._lock:
+            for file_id, path, size, mtime, digest in records:
+                path = os.path.normpath(path)
+                if file_id in self._entries or path in self._path_index:
+                    continue
+                entry = self._make_entry(file_id, path, size, mtime)
+                entry["hash"] = digest
+                self._entries[file_id] = entry
+                self._path_index[path] = file_id
+                self._next_id = max(self._next_id, file_id + 1)
+                added.append(entry)
+            if added:
+                self._changed()
+        if added:
+            self._notify(RegistryDelta(added, [], []))
+        return added
+
+    def update(self, changes):
+        """批量修改条目字段，changes 为 {ID: {字段: 值}}，返回修改后的条目
+
+        条目按写时复制替换，已取出的快照不会被修改。
+        """
+        updated = []
+        with self._lock:
+            for file_id, fields in changes.items():
+                entry = self._entries.get(file_id)
+                if entry is None:
+                    continue
+                if all(entry.get(k) == v for k, v in fields.items()):
+                    continue
+                entry = dict(entry)
+                entry.update(fields)
+                self._entries[file_id] = entry
+                updated.append(entry)
+            if updated:
+                self._changed()
+        if updated:
+            self._notify(RegistryDelta([], [], updated))
+        return updated
+
+    def remove(self, file_ids):
+        """按ID批量移除，返回被移除的条目"""
+        removed = []
+        with self._lock:
+            for file_id in file_ids:
+                entry = self._entries.pop(file_id, None)
+                if entry is None:
+                    continue
+                self._path_index.pop(entry["path"], None)
+                removed.append(entry)
+            if removed:
+                self._changed()
+        if removed:
+            self._notify(RegistryDelta([], removed, []))
+        return removed
+
+    def remove_paths(self, paths):
+        """按路径批量移除"""
+        with self._lock:
+            file_ids = [self._path_index.get(os.path.normpath(p)) for p in paths]
+        return self.remove([i for i in file_ids if i is not None])
+
+    def clear(self):
+        """移除所有条目"""
+        with self._lock:
+            file_ids = list(self._entries)
+        return self.remove(file_ids)
+
+    def _make_entry(self, file_id, path, size, mtime):
+        return {
+            "id": file_id,
+            "name": os.path.basename(path),
+            "size": format_size(size),
+            "size_bytes": size,
+            "mtime": mtime,
+            "path": path,
+            # 内容摘要及重复文件指向的条目ID，由后台哈希填写
+            "hash": None,
+            "duplicate_of": None
+        }
+
+    def _changed(self):
+        """在锁内调用：使快照失效并递增版本"""
+        self._snapshot = None
+        self._version += 1
+
+    def _notify(self, delta):
+        """通知所有订阅者"""
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(delta)
+            except Exception as e:
+                print(f"注册表回调错误: {e}")
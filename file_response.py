@@ -0,0 +1,586 @@
+import base64
+import mmap
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import http_date
+
+from bandwidth import TransferCancelled
+
+# 读取文件时的缓冲区大小
+READ_BUFFER_SIZE = 256 * 1024
+
+# 单个请求允许的最大区间数，超过则按整文件返回
+MAX_RANGES = 16
+
+# 传输方式
+TRANSFER_SENDFILE = "sendfile"
+TRANSFER_MMAP = "mmap"
+TRANSFER_READ = "read"
+TRANSFER_ENCRYPTED = "aes-gcm"
+TRANSFER_COMPRESSED = "compressed"
+
+
+class FileChanged(Exception):
+    """响应过程中文件被修改，已发送的部分与剩余部分不属于同一版本"""
+
+
+class TransferSettings:
+    """文件传输参数"""
+
+    def __init__(self, buffer_size=READ_BUFFER_SIZE, use_sendfile=True, use_mmap=True,
+                 zero_copy_min_size=1024 * 1024, sendfile_block_size=8 * 1024 * 1024):
+        # 普通读取和mmap写出时每块的大小
+        self.buffer_size = buffer_size
+        # 服务器暴露原始socket时(werkzeug引擎)使用 os.sendfile
+        self.use_sendfile = use_sendfile
+        # 无法sendfile时使用内存映射写出
+        self.use_mmap = use_mmap
+        # 小于该大小的区间直接读取，零拷贝的准备开销不划算
+        self.zero_copy_min_size = zero_copy_min_size
+        # 每次sendfile调用发送的最大字节数
+        self.sendfile_block_size = sendfile_block_size
+
+
+class TransferStats:
+    """单次传输的统计：字节数、耗时、首字节时间和CPU时间"""
+
+    def __init__(self, file_path, method, expected_bytes, client=None, requested_at=None):
+        self.file_path = file_path
+        self.method = method
+        self.expected_bytes = expected_bytes
+        self.client = client
+        self.bytes_sent = 0
+        self.started_at = time.monotonic()
+        # 响应创建的时间，首字节时间从这里算起（包括在调度器中排队的时间）
+        self.requested_at = requested_at if requested_at is not None else self.started_at
+        self.first_byte_at = None
+        self.cpu_started = time.thread_time()
+        self.duration = None
+        self.cpu_time = None
+
+    @property
+    def ttfb(self):
+        if self.first_byte_at is None:
+            return None
+        return self.first_byte_at - self.requested_at
+
+    @property
+    def completed(self):
+        return self.bytes_sent >= self.expected_bytes
+
+    def finish(self):
+        """结束计时"""
+        if self.duration is None:
+            self.duration = time.monotonic() - self.started_at
+            self.cpu_time = time.thread_time() - self.cpu_started
+
+    @property
+    def bytes_per_second(self):
+        duration = self.duration if self.duration is not None else time.monotonic() - self.started_at
+        return self.bytes_sent / duration if duration > 0 else 0.0
+
+    @property
+    def cpu_percent(self):
+        """传输线程CPU占用（相对单核）"""
+        if not self.duration:
+            return 0.0
+        return self.cpu_time / self.duration * 100
+
+    def as_dict(self):
+        return {
+            "path": self.file_path,
+            "client": self.client,
+            "method": self.method,
+            "bytes_sent": self.bytes_sent,
+            "completed": self.completed,
+            "duration": self.duration,
+            "ttfb": self.ttfb,
+            "bytes_per_second": self.bytes_per_second,
+            "cpu_time": self.cpu_time,
+            "cpu_percent": self.cpu_percent,
+        }
+
+
+def parse_byte_ranges(header, file_size):
+    """解析 Range 请求头
+
+    返回 (start, end) 闭区间列表；语法错误或非 bytes 单位返回 None（忽略该头），
+    所有区间都无法满足时返回空列表（应答 416）。
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # 后缀区间 "-N"：最后N个字节
+            if not last:
+                return None
+            length = int(last)
+            if length == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - length), file_size - 1))
+            continue
+
+        start = int(first)
+        end = int(last) if last else file_size - 1
+        if last and end < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, min(end, file_size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def make_etag(stat_result):
+    """由文件大小和修改时间生成强校验器"""
+    return f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+
+def content_disposition(file_name):
+    """生成兼容非ASCII文件名的 Content-Disposition"""
+    ascii_name = file_name.encode("ascii", "replace").decode("ascii").replace('"', "_")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(file_name)}"
+
+
+class TransferStream:
+    """按调度器限速并记录传输统计的响应体，子类实现 _generate_body() 和 content_length()
+
+    transfer 为带宽调度器中的传输，开始输出前排队，之后按分配的速率发送。
+    on_start(stats) 和 on_finish(stats) 在开始输出和结束时调用。
+    """
+
+    def __init__(self, file_path, environ, on_finish=None, transfer=None, on_start=None):
+        self.file_path = file_path
+        self.environ = environ
+        self.on_finish = on_finish
+        self.on_start = on_start
+        self.transfer = transfer
+        self.created_at = time.monotonic()
+        self.stats = None
+        self._generator = None
+
+    def content_length(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        if self._generator is None:
+            self._generator = self._generate()
+        return self._generator
+
+    def close(self):
+        """由WSGI服务器在响应结束（或客户端断开）时调用"""
+        if self._generator is not None:
+            self._generator.close()
+        if self.transfer is not None:
+            self.transfer.finish()
+        if self.stats is not None and self.stats.duration is None:
+            self.stats.finish()
+            if self.on_finish:
+                self.on_finish(self.stats)
+
+    def begin(self, method):
+        """开始输出：创建传输统计并通知 on_start（异步服务器直接发送响应体时也会调用）"""
+        client = self.transfer.client if self.transfer is not None else None
+        self.stats = TransferStats(self.file_path, method, self.content_length(), client=client,
+                                   requested_at=self.created_at)
+        if self.on_start:
+            self.on_start(self.stats)
+        return self.stats
+
+    def _generate(self):
+        try:
+            yield from self._generate_body()
+        except (TransferCancelled, FileChanged):
+            # 服务器关闭时排空超时或文件被修改，提前结束响应；响应体不足
+            # Content-Length，必须断开连接，客户端才不会一直等待剩余数据
+            sock = self.environ.get("werkzeug.socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _generate_body(self):
+        raise NotImplementedError
+
+    def _chunk_size(self, default):
+        if self.transfer is None:
+            return default
+        return self.transfer.chunk_size(default)
+
+    def record_sent(self, amount):
+        """记录已发送的字节"""
+        if self.stats.first_byte_at is None:
+            self.stats.first_byte_at = time.monotonic()
+        self.stats.bytes_sent += amount
+
+    def _sent(self, amount):
+        """记录已发送的字节，并按调度器分配的速率限速"""
+        self.record_sent(amount)
+        if self.transfer is not None:
+            self.transfer.throttle(amount)
+
+
+class FileStream(TransferStream):
+    """文件响应体
+
+    segments 为 (前置字节, 起始偏移, 长度) 列表，依次输出，最后输出 trailer。
+    在 werkzeug 服务器上用 socket.sendfile 零拷贝发送，否则用 mmap 或普通读取。
+    """
+
+    def __init__(self, file_path, segments, environ, settings, trailer=b"", on_finish=None, transfer=None,
+                 on_start=None):
+        super().__init__(file_path, environ, on_finish=on_finish, transfer=transfer, on_start=on_start)
+        self.segments = segments
+        self.settings = settings
+        self.trailer = trailer
+        # 需要经Python处理输出数据（如压缩）时关闭sendfile
+        self.allow_sendfile = True
+
+    def content_length(self):
+        return sum(len(head) + length for head, _, length in self.segments) + len(self.trailer)
+
+    def is_whole_file(self):
+        """是否为从头开始、不分段的整文件响应"""
+        if len(self.segments) != 1 or self.trailer:
+            return False
+        head, start, _ = self.segments[0]
+        return not head and start == 0
+
+    def choose_method(self):
+        """根据服务器能力和区间大小选择传输方式"""
+        largest = max((length for _, _, length in self.segments), default=0)
+        if largest < self.settings.zero_copy_min_size:
+            return TRANSFER_READ
+        if (self.allow_sendfile and self.settings.use_sendfile and hasattr(os, "sendfile")
+                and self.environ.get("werkzeug.socket") is not None):
+            return TRANSFER_SENDFILE
+        if self.settings.use_mmap:
+            return TRANSFER_MMAP
+        return TRANSFER_READ
+
+    def _generate_body(self):
+        if self.transfer is not None:
+            self.transfer.start()
+        method = self.choose_method()
+        self.begin(method)
+
+        with open(self.file_path, "rb") as f:
+            mapped = None
+            if method == TRANSFER_MMAP:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+            try:
+                for head, start, length in self.segments:
+                    if head:
+                        self._sent(len(head))
+                        yield head
+                    if method == TRANSFER_SENDFILE:
+                        yield from self._sendfile(f, start, length)
+                    elif method == TRANSFER_MMAP:
+                        yield from self._iter_mmap(mapped, start, length)
+                    else:
+                        yield from self._iter_read(f, start, length)
+                if self.trailer:
+                    self._sent(len(self.trailer))
+                    yield self.trailer
+            finally:
+                if mapped is not None:
+                    mapped.close()
+
+    def _iter_read(self, f, start, length):
+        f.seek(start)
+        remaining = length
+        buffer_size = self._chunk_size(self.settings.buffer_size)
+        while remaining > 0:
+            chunk = f.read(min(buffer_size, remaining))
+            if not chunk:
+                # 文件在发送过程中被截断，响应体不足 Content-Length
+                raise FileChanged(self.file_path)
+            remaining -= len(chunk)
+            self._sent(len(chunk))
+            yield chunk
+
+    def _iter_mmap(self, mapped, start, length):
+        end = start + length
+        buffer_size = self._chunk_size(self.settings.buffer_size)
+        for offset in range(start, end, buffer_size):
+            chunk = mapped[offset:min(offset + buffer_size, end)]
+            self._sent(len(chunk))
+            yield chunk
+
+    def _sendfile(self, f, start, length):
+        # 先让服务器写出（并刷新）响应头和之前的数据，再直接写socket
+        yield b""
+        sock = self.environ["werkzeug.socket"]
+        offset = start
+        end = start + length
+        while offset < end:
+            block_size = self._chunk_size(self.settings.sendfile_block_size)
+            sent = sock.sendfile(f, offset, min(block_size, end - offset))
+            if sent == 0:
+                raise FileChanged(self.file_path)
+            offset += sent
+            self._sent(sent)
+
+
+class EncryptedStream(TransferStream):
+    """加密下载的响应体：输出密文中 [start, start + length) 的部分
+
+    只加密与区间重叠的块；明文按顺序读取，加密交给线程池并行执行，
+    最多预先加密 window 块，内存占用与文件大小无关。
+
+    盐由文件版本决定，同一块序号的 nonce 只能用于同一份明文：每读一块前
+    检查文件是否仍是 stat_result 对应的版本，变化时中止响应。
+    """
+
+    def __init__(self, file_path, cipher, start, length, environ, executor, window, stat_result, on_finish=None,
+                 transfer=None, on_start=None):
+        super().__init__(file_path, environ, on_finish=on_finish, transfer=transfer, on_start=on_start)
+        self.cipher = cipher
+        self.start = start
+        self.length = length
+        self.executor = executor
+        self.window = max(1, window)
+        self.version = file_version(stat_result)
+
+    def content_length(self):
+        return self.length
+
+    def _generate_body(self):
+        if self.transfer is not None:
+            self.transfer.start()
+        self.begin(TRANSFER_ENCRYPTED)
+
+        header = self.cipher.header
+        start = self.start
+        end = start + self.length
+        if start < len(header):
+            part = header[start:min(end, len(header))]
+            self._sent(len(part))
+            yield part
+        if end <= len(header):
+            return
+
+        from encryption import TAG_SIZE
+
+        chunk_size = self.cipher.chunk_size
+        plain_size = self.cipher.plain_size
+        stride = chunk_size + TAG_SIZE
+        index = max(0, start - len(header)) // stride
+        last = (end - 1 - len(header)) // stride
+        pending = deque()
+        try:
+            with open(self.file_path, "rb") as f:
+                f.seek(index * chunk_size)
+                while index <= last or pending:
+                    while index <= last and len(pending) < self.window:
+                        # 只读到密文头记录的明文大小，文件变长时也不会多读
+                        size = max(0, min(chunk_size, plain_size - index * chunk_size))
+                        if file_version(os.fstat(f.fileno())) != self.version:
+                            raise FileChanged(self.file_path)
+                        data = f.read(size)
+                        if len(data) != size:
+                            raise FileChanged(self.file_path)
+                        pending.append((index, self.executor.submit(self.cipher.encrypt, index, data)))
+                        index += 1
+                    chunk_index, future = pending.popleft()
+                    chunk_start = len(header) + chunk_index * stride
+                    piece = future.result()[max(0, start - chunk_start):end - chunk_start]
+                    # 限速时按调度器的块大小分段输出，保证速率平滑；不限速时整块输出
+                    step = max(1, self._chunk_size(len(piece)))
+                    for offset in range(0, len(piece), step):
+                        part = piece[offset:offset + step]
+                        self._sent(len(part))
+                        yield part
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def range_is_fresh(request, etag, mtime):
+    """判断 If-Range 条件是否成立（成立才按区间应答）"""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # If-Range 只能使用强比较
+        return if_range.strip('"') == etag
+    if if_range.startswith("W/"):
+        return False
+    # 日期只能与发出的 Last-Modified（精确到秒）完全相同
+    date = request.if_range.date
+    return date is not None and date.timestamp() == int(mtime)
+
+
+def make_file_response(request, file_path, download_name=None, settings=None, on_finish=None, digest_lookup=None,
+                       cache_control=None, transfer=None, on_start=None):
+    """构造支持断点续传和多区间请求的文件下载响应
+
+    digest_lookup(file_path, stat_result) 返回 (算法, 十六进制摘要) 时，
+    ETag 使用内容摘要，并附带 Digest 响应头。cache_control 会原样
+    加在包括 304 在内的所有响应上。transfer 为带宽调度器中的传输，
+    只对有响应体的应答生效。
+    """
+    settings = settings or TransferSettings()
+    st = os.stat(file_path)
+    file_size = st.st_size
+    etag = make_etag(st)
+    download_name = download_name or os.path.basename(file_path)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Last-Modified": http_date(st.st_mtime),
+        "Content-Disposition": content_disposition(download_name),
+    }
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+
+    digest = digest_lookup(file_path, st) if digest_lookup else None
+    if digest is not None:
+        algorithm, hex_digest = digest
+        etag = f"{algorithm}-{hex_digest}"
+        headers["Digest"] = f"{algorithm}={base64.b64encode(bytes.fromhex(hex_digest)).decode('ascii')}"
+    headers["ETag"] = f'"{etag}"'
+
+    # 条件请求：If-None-Match 优先于 If-Modified-Since
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since is not None:
+        if int(st.st_mtime) <= request.if_modified_since.timestamp():
+            return Response(status=304, headers=headers)
+
+    ranges = None
+    if range_is_fresh(request, etag, st.st_mtime):
+        ranges = parse_byte_ranges(request.headers.get("Range"), file_size)
+
+    if ranges is None:
+        headers["Content-Length"] = str(file_size)
+        return Response(
+            FileStream(file_path, [(b"", 0, file_size)], request.environ, settings,
+                       on_start=on_start, on_finish=on_finish, transfer=transfer),
+            status=200,
+            headers=headers,
+            mimetype="application/octet-stream",
+            direct_passthrough=True
+        )
+
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return Response(
+            FileStream(file_path, [(b"", start, end - start + 1)], request.environ, settings,
+                       on_start=on_start, on_finish=on_finish, transfer=transfer),
+            status=206,
+            headers=headers,
+            mimetype="application/octet-stream",
+            direct_passthrough=True
+        )
+
+    # 多区间：multipart/byteranges，预先生成各段头以计算总长度
+    boundary = uuid.uuid4().hex
+    segments = [
+        ((f"\r\n--{boundary}\r\n"
+          f"Content-Type: application/octet-stream\r\n"
+          f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode("ascii"),
+         start, end - start + 1)
+        for start, end in ranges
+    ]
+    trailer = f"\r\n--{boundary}--\r\n".encode("ascii")
+    content_length = sum(len(head) + length for head, _, length in segments) + len(trailer)
+    headers["Content-Length"] = str(content_length)
+    return Response(
+        FileStream(file_path, segments, request.environ, settings, trailer=trailer,
+                   on_start=on_start, on_finish=on_finish, transfer=transfer),
+        status=206,
+        headers=headers,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+        direct_passthrough=True
+    )
+
+
+def file_version(stat_result):
+    """确定文件版本的属性，与加密下载的盐使用的相同"""
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+def make_encrypted_response(request, file_path, encryption, download_name=None, on_finish=None, cache_control=None,
+                            transfer=None, on_start=None):
+    """构造分块加密的文件下载响应，支持条件请求和单区间请求
+
+    ETag 由文件版本的盐生成，同一版本的密文不变，客户端可以用
+    If-Range 续传或并行下载多个区间。
+    """
+    from encryption import CHUNKS_IN_FLIGHT_PER_WORKER, encrypted_size
+
+    st = os.stat(file_path)
+    cipher = encryption.cipher_for(file_path, st)
+    total = encrypted_size(st.st_size, cipher.chunk_size)
+    etag = "enc-" + cipher.salt.hex()
+    download_name = (download_name or os.path.basename(file_path)) + ".cfxenc"
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Last-Modified": http_date(st.st_mtime),
+        "Content-Disposition": content_disposition(download_name),
+        "ETag": f'"{etag}"',
+    }
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    if range_is_fresh(request, etag, st.st_mtime):
+        ranges = parse_byte_ranges(request.headers.get("Range"), total)
+    if ranges is not None and not ranges:
+        headers["Content-Range"] = f"bytes */{total}"
+        return Response(status=416, headers=headers)
+
+    # 多区间请求按整个文件应答
+    status = 200
+    start, length = 0, total
+    if ranges is not None and len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    headers["Content-Length"] = str(length)
+    return Response(
+        EncryptedStream(file_path, cipher, start, length, request.environ, encryption.executor,
+                        encryption.workers * CHUNKS_IN_FLIGHT_PER_WORKER, st,
+                        on_start=on_start, on_finish=on_finish, transfer=transfer),
+        status=status,
+        headers=headers,
+        mimetype="application/octet-stream",
+        direct_passthrough=True
+    )
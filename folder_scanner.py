@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+
+class FolderScanner:
+    """在后台线程中扫描文件夹
+
+    使用 os.scandir 遍历目录，文件大小和修改时间直接取自目录项的
+    stat 信息；结果按批交给 on_batch 回调。符号链接循环和无权限的
+    目录会被跳过，不会中断扫描。
+    """
+
+    def __init__(self, folder_path, on_batch, on_done=None, batch_size=500, flush_interval=0.25):
+        self.folder_path = folder_path
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # 进度统计
+        self.files_found = 0
+        self.dirs_scanned = 0
+        self.errors = 0
+        self.started_at = None
+        self.finished_at = None
+
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台扫描线程"""
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """请求取消扫描，已扫描的批次保留"""
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def elapsed(self):
+        """已用时间（秒）"""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed
+        return self.files_found / elapsed if elapsed > 0 else 0.0
+
+    def run(self):
+        """扫描主循环"""
+        batch = []
+        last_flush = time.monotonic()
+        # 已访问目录的 (设备号, inode)，用于识别符号链接循环
+        visited = set()
+        stack = [self.folder_path]
+
+        try:
+            while stack and not self.cancelled:
+                dir_path = stack.pop()
+                try:
+                    st = os.stat(dir_path)
+                except OSError:
+                    self.errors += 1
+                    continue
+
+                key = (st.st_dev, st.st_ino)
+                if key in visited:
+                    continue
+                visited.add(key)
+
+                try:
+                    with os.scandir(dir_path) as it:
+                        for entry in it:
+                            if self.cancelled:
+                                break
+                            try:
+                                if entry.is_dir():
+                                    stack.append(entry.path)
+                                    continue
+                                if not entry.is_file():
+                                    continue
+                                entry_stat = entry.stat()
+                            except OSError:
+                                self.errors += 1
+                                continue
+
+                            batch.append((entry.path, entry_stat.st_size, entry_stat.st_mtime))
+                            self.files_found += 1
+
+                            now = time.monotonic()
+                            if len(batch) >= self.batch_size or now - last_flush >= self.flush_interval:
+                                self.on_batch(batch)
+                                batch = []
+                                last_flush = now
+                except OSError:
+                    self.errors += 1
+                    continue
+
+                self.dirs_scanned += 1
+
+            if batch:
+                self.on_batch(batch)
+        finally:
+            self.finished_at = time.monotonic()
+            if self.on_done:
+                self.on_done(self)
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+
+from file_registry import format_size
+from folder_scanner import FolderScanner
+
+# watchdog 未安装时只能做一次性扫描
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# 待处理的操作
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+OP_DELETE_TREE = "delete_tree"
+OP_SCAN_TREE = "scan_tree"
+
+
+def is_under(path, root):
+    """path 是否位于 root 目录之内（或就是 root）"""
+    return path == root or path.startswith(os.path.join(root, ""))
+
+
+class _EventHandler(FileSystemEventHandler):
+    """把 watchdog 事件转交给 FolderWatcher"""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.queue(OP_SCAN_TREE if event.is_directory else OP_UPSERT, event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.queue(OP_UPSERT, event.src_path)
+
+    def on_deleted(self, event):
+        self.watcher.queue(OP_DELETE_TREE if event.is_directory else OP_DELETE, event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.watcher.queue(OP_DELETE_TREE, event.src_path)
+            self.watcher.queue(OP_SCAN_TREE, event.dest_path)
+        else:
+            self.watcher.queue(OP_DELETE, event.src_path)
+            self.watcher.queue(OP_UPSERT, event.dest_path)
+
+
+class FolderWatcher:
+    """把共享文件夹注册为实时根目录
+
+    文件系统事件先按路径合并（同一路径只保留最后一次操作），在
+    debounce 秒内没有新事件或距第一次事件超过 max_delay 秒后，
+    作为一个批次应用到注册表。
+    """
+
+    def __init__(self, registry, debounce=0.5, max_delay=2.0):
+        self.registry = registry
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self._roots = {}
+        self._observer = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._first_event_at = None
+        self._last_event_at = None
+        self._wakeup = threading.Event()
+        self._flush_thread = None
+        # 根目录列表变化时的回调 listener(roots)，用于持久化
+        self.roots_listener = None
+
+    @property
+    def available(self):
+        """是否可以实时监控（已安装 watchdog）"""
+        return Observer is not None
+
+    @property
+    def roots(self):
+        return list(self._roots)
+
+    def find_root(self, path):
+        """返回包含 path 的已注册根目录"""
+        path = os.path.normpath(path)
+        for root in self._roots:
+            if is_under(path, root):
+                return root
+        return None
+
+    def add_root(self, path):
+        """注册实时根目录，已被某个根目录覆盖时返回 False"""
+        path = os.path.normpath(path)
+        if not self.available:
+            return False
+        with self._lock:
+            if self.find_root(path) is not None:
+                return False
+
+            self._ensure_started()
+            # 新根目录包含已有根目录时，合并为一个监控
+            for root in [r for r in self._roots if is_under(r, path)]:
+                self._observer.unschedule(self._roots.pop(root))
+            self._roots[path] = self._observer.schedule(_EventHandler(self), path, recursive=True)
+        self._roots_changed()
+        return True
+
+    def remove_root(self, path, remove_files=True):
+        """取消监控，并可选地移除该目录下的共享条目"""
+        path = os.path.normpath(path)
+        with self._lock:
+            watch = self._roots.pop(path, None)
+            if watch is not None:
+                self._observer.unschedule(watch)
+        if watch is not None:
+            self._roots_changed()
+        if remove_files:
+            self.remove_tree(path)
+
+    def _roots_changed(self):
+        if self.roots_listener is not None:
+            try:
+                self.roots_listener(self.roots)
+            except Exception as e:
+                print(f"根目录回调错误: {e}")
+
+    def _ensure_started(self):
+        """在锁内调用：启动观察者和批处理线程"""
+        if self._observer is None:
+            self._observer = Observer()
+            self._observer.daemon = True
+            self._observer.start()
+        if self._flush_thread is None:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def queue(self, op, path):
+        """记录一个事件（由 watchdog 线程调用）"""
+        path = os.path.normpath(path)
+        now = time.monotonic()
+        with self._lock:
+            if op == OP_DELETE_TREE:
+                # 目录被删除，其中尚未处理的事件都已无意义
+                for pending in [p for p in self._pending if is_under(p, path)]:
+                    del self._pending[pending]
+            self._pending[path] = op
+            if self._first_event_at is None:
+                self._first_event_at = now
+            self._last_event_at = now
+        self._wakeup.set()
+
+    def stop(self):
+        """停止监控"""
+        with self._lock:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer = None
+            self._roots.clear()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if not self._pending:
+                    self._wakeup.clear()
+                    continue
+                now = time.monotonic()
+                quiet = now - self._last_event_at >= self.debounce
+                overdue = now - self._first_event_at >= self.max_delay
+                if quiet or overdue:
+                    batch, self._pending = self._pending, {}
+                    self._first_event_at = self._last_event_at = None
+                else:
+                    batch = None
+                    delay = min(self._last_event_at + self.debounce, self._first_event_at + self.max_delay) - now
+
+            if batch is None:
+                time.sleep(max(delay, 0.01))
+                continue
+            try:
+                self.apply(batch)
+            except Exception as e:
+                print(f"应用文件夹变更失败: {e}")
+
+    def apply(self, batch):
+        """把一批合并后的事件应用到注册表"""
+        deletes = []
+        upserts = []
+        for path, op in batch.items():
+            if op == OP_DELETE:
+                deletes.append(path)
+            elif op == OP_DELETE_TREE:
+                self.remove_tree(path)
+            elif op == OP_SCAN_TREE:
+                FolderScanner(path, on_batch=self.registry.add_stats).run()
+            else:
+                upserts.append(path)
+
+        added = []
+        changes = {}
+        for path in upserts:
+            try:
+                st = os.stat(path)
+            except OSError:
+                # 创建后又被删除
+                deletes.append(path)
+                continue
+            if not os.path.isfile(path):
+                continue
+            entry = self.registry.get_by_path(path)
+            if entry is None:
+                added.append((path, st.st_size, st.st_mtime))
+            elif entry["size_bytes"] != st.st_size or entry["mtime"] != st.st_mtime:
+                changes[entry["id"]] = {
+                    "size": format_size(st.st_size),
+                    "size_bytes": st.st_size,
+                    "mtime": st.st_mtime,
+                    # 内容已变化，摘要需要重新计算
+                    "hash": None,
+                    "duplicate_of": None,
+                }
+
+        self.registry.remove_paths(deletes)
+        self.registry.add_stats(added)
+        self.registry.update(changes)
+
+    def remove_tree(self, path):
+        """移除某个目录下的全部共享条目"""
+        self.registry.remove([e["id"] for e in self.registry.snapshot() if is_under(e["path"], path)])
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 优先使用更快的可选哈希库，未安装时退回标准库的 blake2b
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 应用数据目录
+APP_DATA_FOLDER = os.path.join(os.path.expanduser("~"), ".cpolarfilexfer")
+DEFAULT_HASH_CACHE_PATH = os.path.join(APP_DATA_FOLDER, "hashes.sqlite3")
+
+# 计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def select_algorithm():
+    """返回 (算法名, 哈希对象工厂)"""
+    if blake3 is not None:
+        return "blake3", lambda: blake3.blake3(max_threads=1)
+    if xxhash is not None:
+        return "xxh3-128", xxhash.xxh3_128
+    return "blake2b", lambda: hashlib.blake2b(digest_size=32)
+
+
+def hash_file(file_path, factory):
+    """计算文件摘要（十六进制）"""
+    digest = factory()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """(路径, 大小, 修改时间) -> 摘要 的持久缓存，保存在 SQLite 中
+
+    db_path 为 None 时缓存只在内存中，不写磁盘。
+    """
+
+    def __init__(self, db_path):
+        if db_path is None:
+            db_path = ":memory:"
+        else:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "algorithm TEXT, digest TEXT)"
+            )
+
+    def get(self, path, size, mtime_ns, algorithm):
+        """文件大小、修改时间和算法都匹配时返回缓存的摘要"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                (path, size, mtime_ns, algorithm)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, rows):
+        """批量写入 (路径, 大小, 修改时间, 算法, 摘要)"""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FileHasher:
+    """后台哈希共享文件
+
+    订阅注册表，新增（或内容变化后 hash 被置空）的条目交给线程池计算摘要，
+    结果按批写回注册表和持久缓存；相同摘要的条目通过 duplicate_of 指向
+    ID 最小的那一个。从共享列表恢复的条目已带有摘要，直接采用而不重新
+    读取文件；内容在离线期间变化的条目由共享列表的校验把摘要置空后重算。
+    """
+
+    def __init__(self, registry, cache_path=DEFAULT_HASH_CACHE_PATH, workers=None, flush_interval=0.5):
+        self.registry = registry
+        self.algorithm, self._factory = select_algorithm()
+        # 十六进制摘要的长度，用于校验下载地址中的摘要
+        self.digest_length = len(self._factory().hexdigest())
+        self.cache = HashCache(cache_path)
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or min(8, os.cpu_count() or 2),
+            thread_name_prefix="hasher"
+        )
+
+        self._lock = threading.Lock()
+        # 已完成但尚未写回注册表的结果
+        self._pending = []
+        # 路径 -> (大小, 修改时间, 摘要)，供下载时查询；修改时间为 ns 整数，
+        # 从共享列表恢复的摘要只有与注册表一致的秒（浮点数）
+        self._known = {}
+        # 摘要 -> 条目ID集合，用于识别重复文件
+        self._by_digest = {}
+        self._digest_of = {}
+        self._wakeup = threading.Event()
+
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        registry.subscribe(self.on_registry_change)
+
+    def on_registry_change(self, delta):
+        """注册表变更回调"""
+        restored = []
+        for entry in delta.added:
+            algorithm, _, digest = (entry["hash"] or "").partition(":")
+            if algorithm == self.algorithm and digest:
+                restored.append((entry["id"], entry["path"], entry["size_bytes"], entry["mtime"], digest, False))
+            else:
+                self._executor.submit(self._hash_entry, entry["id"], entry["path"])
+        for entry in delta.updated:
+            if entry["hash"] is None:
+                self._executor.submit(self._hash_entry, entry["id"], entry["path"])
+        if restored or delta.removed:
+            with self._lock:
+                self._pending.extend(("hashed", payload) for payload in restored)
+                if delta.removed:
+                    self._pending.append(("removed", [(e["id"], e["path"]) for e in delta.removed]))
+            self._wakeup.set()
+
+    def lookup(self, file_path, stat_result):
+        """返回与文件当前状态一致的 (算法, 十六进制摘要)，未计算时返回 None"""
+        known = self._known.get(os.path.normpath(file_path))
+        if known is None:
+            return None
+        size, mtime, digest = known
+        current = stat_result.st_mtime if isinstance(mtime, float) else stat_result.st_mtime_ns
+        if size != stat_result.st_size or mtime != current:
+            return None
+        return self.algorithm, digest
+
+    def find(self, algorithm, digest):
+        """按内容摘要查找内容仍与之一致的共享条目，找不到时返回 None"""
+        if algorithm != self.algorithm:
+            return None
+        with self._lock:
+            ids = sorted(self._by_digest.get(digest, ()))
+        for file_id in ids:
+            entry = self.registry.get(file_id)
+            if entry is None:
+                continue
+            try:
+                st = os.stat(entry["path"])
+            except OSError:
+                continue
+            if self.lookup(entry["path"], st) == (algorithm, digest):
+                return entry
+        return None
+
+    def _hash_entry(self, file_id, file_path):
+        """在线程池中执行：查缓存或计算摘要"""
+        try:
+            st = os.stat(file_path)
+            digest = self.cache.get(file_path, st.st_size, st.st_mtime_ns, self.algorithm)
+            fresh = digest is None
+            if fresh:
+                digest = hash_file(file_path, self._factory)
+                # 计算期间文件被修改，结果作废
+                after = os.stat(file_path)
+                if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    return
+        except OSError:
+            return
+
+        with self._lock:
+            self._pending.append(("hashed", (file_id, file_path, st.st_size, st.st_mtime_ns, digest, fresh)))
+        self._wakeup.set()
+
+    def _flush_loop(self):
+        """定期把结果批量写回注册表"""
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"哈希结果写回失败: {e}")
+            # 合并一段时间内的结果，避免每个文件都触发一次列表更新
+            time.sleep(self.flush_interval)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        rows = []
+        touched = set()
+        changes = {}
+        with self._lock:
+            for kind, payload in pending:
+                if kind == "removed":
+                    for file_id, file_path in payload:
+                        touched.update(self._forget(file_id))
+                        self._known.pop(file_path, None)
+                    continue
+                file_id, file_path, size, mtime, digest, fresh = payload
+                if file_id not in self.registry:
+                    continue
+                touched.update(self._forget(file_id))
+                self._known[file_path] = (size, mtime, digest)
+                self._digest_of[file_id] = digest
+                self._by_digest.setdefault(digest, set()).add(file_id)
+                touched.add(digest)
+                changes[file_id] = {"hash": f"{self.algorithm}:{digest}"}
+                if fresh:
+                    rows.append((file_path, size, mtime, self.algorithm, digest))
+
+            # 重新计算受影响摘要组的重复关系
+            for digest in touched:
+                ids = self._by_digest.get(digest)
+                if not ids:
+                    continue
+                canonical = min(ids)
+                for file_id in ids:
+                    fields = changes.setdefault(file_id, {})
+                    fields["duplicate_of"] = None if file_id == canonical else canonical
+
+        self.cache.put_many(rows)
+        self.registry.update(changes)
+
+    def _forget(self, file_id):
+        """在锁内调用：移除条目的摘要记录，返回其所在的摘要组"""
+        digest = self._digest_of.pop(file_id, None)
+        if digest is None:
+            return ()
+        ids = self._by_digest.get(digest)
+        if ids is not None:
+            ids.discard(file_id)
+            if not ids:
+                del self._by_digest[digest]
+        return (digest,)
+
+    def shutdown(self):
+        """停止线程池"""
+        self._executor.shutdown(wait=False)
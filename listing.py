@@ -0,0 +1,148 @@
+import base64
+import bisect
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# 支持的排序字段
+SORT_KEYS = {
+    "name": lambda e: (e["name"].lower(), e["id"]),
+    "size": lambda e: (e["size_bytes"], e["id"]),
+    "mtime": lambda e: (e["mtime"], e["id"]),
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key):
+    """把排序键编码为不透明的游标"""
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标，非法时返回 None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, file_id = json.loads(raw.decode("utf-8"))
+        return (value, int(file_id))
+    except (ValueError, TypeError):
+        return None
+
+
+class ListingPage:
+    """一页列表结果"""
+
+    def __init__(self, items, offset, total, next_cursor):
+        self.items = items
+        self.offset = offset
+        self.total = total
+        self.next_cursor = next_cursor
+
+
+class FileListing:
+    """基于注册表的分页列表
+
+    排序和过滤结果按 (搜索词, 排序字段, 方向, 是否去重) 缓存，序列化结果按请求参数缓存，
+    两者都在注册表版本变化时失效。
+    """
+
+    def __init__(self, registry, max_views=32, max_cached_pages=256):
+        self.registry = registry
+        self.max_views = max_views
+        self.max_cached_pages = max_cached_pages
+        self._lock = threading.Lock()
+        self._version = None
+        self._views = OrderedDict()
+        self._pages = OrderedDict()
+
+    def _check_version(self):
+        """在锁内调用：注册表变化后清空所有缓存"""
+        version = self.registry.version
+        if version != self._version:
+            self._version = version
+            self._views.clear()
+            self._pages.clear()
+
+    def _view(self, query, sort, order, dedupe):
+        """在锁内调用：获取排好序的条目及其排序键"""
+        key = (query, sort, order, dedupe)
+        view = self._views.get(key)
+        if view is not None:
+            self._views.move_to_end(key)
+            return view
+
+        entries = self.registry.snapshot()
+        if dedupe:
+            entries = [e for e in entries if e["duplicate_of"] is None]
+        if query:
+            needle = query.lower()
+            entries = [e for e in entries if needle in e["name"].lower()]
+        sort_key = SORT_KEYS[sort]
+        entries = sorted(entries, key=sort_key)
+        view = (entries, [sort_key(e) for e in entries])
+
+        self._views[key] = view
+        if len(self._views) > self.max_views:
+            self._views.popitem(last=False)
+        return view
+
+    def page(self, query="", sort="name", order="asc", cursor=None, limit=DEFAULT_PAGE_SIZE, dedupe=True):
+        """获取一页条目，游标为上一页最后一项的排序键"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after = decode_cursor(cursor) if cursor else None
+        if cursor and after is None:
+            raise ValueError("无效的游标")
+
+        with self._lock:
+            self._check_version()
+            entries, keys = self._view(query, sort, order, dedupe)
+
+        total = len(entries)
+        try:
+            if order == "desc":
+                end = bisect.bisect_left(keys, after) if after is not None else total
+                start = max(0, end - limit)
+                items = entries[start:end][::-1]
+                offset = total - end
+                has_more = start > 0
+            else:
+                start = bisect.bisect_right(keys, after) if after is not None else 0
+                items = entries[start:start + limit]
+                offset = start
+                has_more = start + limit < total
+        except TypeError:
+            # 游标与排序字段的类型不匹配
+            raise ValueError("无效的游标")
+
+        next_cursor = None
+        if has_more and items:
+            next_cursor = encode_cursor(SORT_KEYS[sort](items[-1]))
+        return ListingPage(items, offset, total, next_cursor)
+
+    def cached(self, key, builder):
+        """按参数缓存序列化结果，返回 (数据, 强ETag)"""
+        with self._lock:
+            self._check_version()
+            cached = self._pages.get(key)
+            if cached is not None:
+                self._pages.move_to_end(key)
+                return cached
+            version = self._version
+
+        data = builder()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        etag = hashlib.blake2b(data, digest_size=12).hexdigest()
+
+        with self._lock:
+            # 构建期间注册表发生变化时不缓存
+            if self._version == version:
+                self._pages[key] = (data, etag)
+                if len(self._pages) > self.max_cached_pages:
+                    self._pages.popitem(last=False)
+        return data, etag
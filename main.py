@@ -1,24 +1,98 @@
-from client import FileTransferGUI
-from server import ServerManager
+import argparse
+import os
+import sys
 
-def main():
-    # 创建服务器管理器
-    server_manager = ServerManager()
-    
-    # 创建Tkinter根窗口
-    root = None
+
+def build_parser():
+    """命令行参数；未指定的参数为 None，由配置文件或默认值补充"""
+    parser = argparse.ArgumentParser(
+        description="CpolarFileXfer 文件互传。不带参数时打开图形界面；指定共享路径、配置文件或 "
+                    "--headless 时以无界面模式运行，没有图形显示环境时也会自动使用无界面模式。"
+    )
+    parser.add_argument("shares", nargs="*", default=None, help="要共享的文件或文件夹")
+    parser.add_argument("--headless", action="store_true", help="无界面运行，直到收到 Ctrl+C 或 SIGTERM")
+    parser.add_argument("-c", "--config", help="JSON 配置文件，字段与长参数名相同（如 port、shares、tunnels）")
+    parser.add_argument("-p", "--port", type=int, help="监听端口（默认 5000）")
+    parser.add_argument("--engine", help="服务引擎：waitress、werkzeug 或 asyncio")
+    parser.add_argument("--threads", type=int, help="工作线程数")
+    parser.add_argument("--upload-folder", dest="upload_folder", help="接收远端上传文件的目录")
+    parser.add_argument("--uploads", action="store_const", const=True, help="允许远端上传（默认关闭）")
+    parser.add_argument("--max-upload-size", dest="max_upload_size", type=int,
+                        help="单个上传的大小上限 (MB，默认 4096，0 为不限)")
+    parser.add_argument("--state", help="共享列表的保存位置")
+    parser.add_argument("--no-state", dest="state", action="store_const", const="", help="不保存共享列表")
+    parser.add_argument("--global-rate", dest="global_rate", type=int, help="全局限速 (KB/s)")
+    parser.add_argument("--client-rate", dest="client_rate", type=int, help="单客户端限速 (KB/s)")
+    parser.add_argument("--max-concurrent", dest="max_concurrent", type=int, help="最大并发下载数")
+    parser.add_argument("--tunnels", type=int, help="启动的 cpolar 隧道数（默认 0，不启动）")
+    parser.add_argument("--tunnel-protocol", dest="tunnel_protocol", help="cpolar 隧道协议（默认 http）")
+    parser.add_argument("--authtoken", help="cpolar 认证令牌，也可以通过 CPOLAR_AUTHTOKEN 环境变量提供")
+    parser.add_argument("--encryption", choices=("off", "on", "required"),
+                        help="加密下载：on 为可选加密，required 为只允许加密下载（默认 off）")
+    parser.add_argument("--encryption-key", dest="encryption_key",
+                        help="加密下载的密钥（URL 安全的 base64），不指定时每次启动随机生成")
+    parser.add_argument("--public-stats", dest="public_stats", action="store_const", const=True,
+                        help="允许远端访问 /metrics 和 /api/transfers（默认只允许本机）")
+    parser.add_argument("--drain-timeout", dest="drain_timeout", type=float,
+                        help="停止时等待进行中的下载完成的秒数（默认 10）")
+    return parser
+
+
+def has_display():
+    """Linux 等系统上没有 X11/Wayland 显示时无法创建 Tk 窗口"""
+    if sys.platform in ("win32", "cygwin", "darwin"):
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def run_headless(args):
+    from daemon import Daemon, resolve_config
+
+    try:
+        config = resolve_config(args)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法读取配置文件: {e}")
+        return 2
+    try:
+        Daemon(config).run()
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"错误: {e}")
+        return 1
+    return 0
+
+
+def run_gui():
+    # 图形界面相关模块只在这里导入，无界面模式不加载 Tkinter
     try:
         import tkinter as tk
-        root = tk.Tk()
     except ImportError:
-        print("错误: 无法导入Tkinter。请确保您的Python环境支持GUI。")
-        return
-    
+        print("错误: 无法导入Tkinter。请确保您的Python环境支持GUI，或使用 --headless 无界面运行。")
+        return 1
+    from client import FileTransferGUI
+    from server import ServerManager
+
+    # 创建服务器管理器
+    server_manager = ServerManager()
+
+    # 创建Tkinter根窗口
+    root = tk.Tk()
+
     # 创建文件传输应用GUI
     app = FileTransferGUI(root, server_manager)
-    
+
     # 运行应用
     app.run()
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.headless or args.shares or args.config:
+        return run_headless(args)
+    if not has_display():
+        print("未检测到图形显示环境，以无界面模式运行（可用 --help 查看参数）")
+        return run_headless(args)
+    return run_gui()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
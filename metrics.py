@@ -0,0 +1,205 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# 下载时长跨度更大
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# 单文件字节计数最多保留的文件数，避免指标无限增长
+MAX_FILE_SERIES = 200
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Histogram:
+    """累积直方图，与 Prometheus 的 histogram 类型对应"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name):
+        """生成 (指标名, 标签, 值) 样本"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            yield f"{name}_bucket", (("le", _format_value(float(bound))),), cumulative
+        yield f"{name}_sum", (), total
+        yield f"{name}_count", (), count
+
+
+class TransferMetrics:
+    """下载路径上的指标：请求延迟、首字节时间、下载时长、字节数和活动连接
+
+    文件响应体开始输出时调用 transfer_started，结束（或客户端断开）时调用
+    transfer_finished；HTTP 请求的处理时长和状态码由 Flask 钩子记录。
+    describe_file(path) 返回按文件统计时的 (共享ID, 显示名)，指标中不出现本机路径。
+    """
+
+    def __init__(self, describe_file=None):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+        self.ttfb = Histogram(LATENCY_BUCKETS)
+        self.download_duration = Histogram(DURATION_BUCKETS)
+        # 状态码 -> 响应数
+        self.responses = {}
+        self.downloads_completed = 0
+        self.downloads_aborted = 0
+        # 已结束传输的字节数，进行中的传输实时累加
+        self.finished_bytes = 0
+        # (共享ID, 显示名) -> 已发送字节数（含进行中的传输）
+        self.file_bytes = OrderedDict()
+        self.describe_file = describe_file or (lambda path: ("", os.path.basename(path)))
+        self._active = {}
+        # 其他来源的瞬时值：名称 -> (说明, 取值函数)
+        self._gauges = OrderedDict()
+
+    def add_gauge(self, name, help_text, func):
+        """注册一个在导出时求值的指标"""
+        self._gauges[name] = (help_text, func)
+
+    def attach(self, flask_app):
+        """在 Flask 应用上记录请求处理时长和状态码"""
+        from flask import g
+
+        @flask_app.before_request
+        def _start_timer():
+            g.metrics_started = time.monotonic()
+
+        @flask_app.after_request
+        def _record(response):
+            started = g.pop("metrics_started", None)
+            if started is not None:
+                self.request_latency.observe(time.monotonic() - started)
+            with self._lock:
+                self.responses[response.status_code] = self.responses.get(response.status_code, 0) + 1
+            return response
+
+    def transfer_started(self, stats):
+        with self._lock:
+            self._active[id(stats)] = stats
+
+    def transfer_finished(self, stats):
+        with self._lock:
+            if self._active.pop(id(stats), None) is None:
+                return
+            self.finished_bytes += stats.bytes_sent
+            self._add_file_bytes(self.describe_file(stats.file_path), stats.bytes_sent)
+            if stats.completed:
+                self.downloads_completed += 1
+            else:
+                self.downloads_aborted += 1
+        if stats.ttfb is not None:
+            self.ttfb.observe(stats.ttfb)
+        if stats.duration is not None:
+            self.download_duration.observe(stats.duration)
+
+    def _add_file_bytes(self, label, amount):
+        """在锁内调用"""
+        self.file_bytes[label] = self.file_bytes.pop(label, 0) + amount
+        while len(self.file_bytes) > MAX_FILE_SERIES:
+            self.file_bytes.popitem(last=False)
+
+    def active_transfers(self):
+        """进行中的传输统计"""
+        with self._lock:
+            return list(self._active.values())
+
+    def snapshot(self):
+        """供界面显示的汇总数据"""
+        with self._lock:
+            active = list(self._active.values())
+            summary = {
+                "active": len(active),
+                "completed": self.downloads_completed,
+                "aborted": self.downloads_aborted,
+                "bytes_sent": self.finished_bytes + sum(s.bytes_sent for s in active),
+                "errors": sum(n for code, n in self.responses.items() if code >= 500),
+                "responses": sum(self.responses.values()),
+            }
+        summary["throughput"] = sum(s.bytes_per_second for s in active)
+        summary["ttfb_avg"] = self.ttfb.sum / self.ttfb.count if self.ttfb.count else None
+        return summary
+
+    def render(self):
+        """导出 Prometheus 文本格式"""
+        with self._lock:
+            active = list(self._active.values())
+            responses = sorted(self.responses.items())
+            completed, aborted = self.downloads_completed, self.downloads_aborted
+            bytes_sent = self.finished_bytes + sum(s.bytes_sent for s in active)
+            file_bytes = dict(self.file_bytes)
+        for stats in active:
+            label = self.describe_file(stats.file_path)
+            file_bytes[label] = file_bytes.get(label, 0) + stats.bytes_sent
+
+        families = [
+            ("cpolarfilexfer_http_request_duration_seconds", "histogram",
+             "请求处理时长（不含流式响应体）", list(self.request_latency.samples("cpolarfilexfer_http_request_duration_seconds"))),
+            ("cpolarfilexfer_http_responses_total", "counter", "按状态码统计的响应数",
+             [("cpolarfilexfer_http_responses_total", (("code", code),), n) for code, n in responses]),
+            ("cpolarfilexfer_download_ttfb_seconds", "histogram", "下载的首字节时间（含排队）",
+             list(self.ttfb.samples("cpolarfilexfer_download_ttfb_seconds"))),
+            ("cpolarfilexfer_download_duration_seconds", "histogram", "下载时长",
+             list(self.download_duration.samples("cpolarfilexfer_download_duration_seconds"))),
+            ("cpolarfilexfer_downloads_total", "counter", "已结束的下载数",
+             [("cpolarfilexfer_downloads_total", (("result", "completed"),), completed),
+              ("cpolarfilexfer_downloads_total", (("result", "aborted"),), aborted)]),
+            ("cpolarfilexfer_download_bytes_total", "counter", "已发送的字节数",
+             [("cpolarfilexfer_download_bytes_total", (), bytes_sent)]),
+            ("cpolarfilexfer_file_bytes_total", "counter", "按文件统计的已发送字节数",
+             [("cpolarfilexfer_file_bytes_total", (("id", file_id), ("name", name)), n)
+              for (file_id, name), n in file_bytes.items()]),
+            ("cpolarfilexfer_active_downloads", "gauge", "进行中的下载数",
+             [("cpolarfilexfer_active_downloads", (), len(active))]),
+            ("cpolarfilexfer_start_time_seconds", "gauge", "服务启动时间",
+             [("cpolarfilexfer_start_time_seconds", (), self.started_at)]),
+        ]
+        for name, (help_text, func) in self._gauges.items():
+            try:
+                value = func()
+            except Exception:
+                continue
+            families.append((name, "gauge", help_text, [(name, (), value)]))
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
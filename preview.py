@@ -0,0 +1,319 @@
+import codecs
+import hashlib
+import importlib.util
+import os
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from io import BytesIO
+
+from hashing import APP_DATA_FOLDER
+
+DEFAULT_PREVIEW_FOLDER = os.path.join(APP_DATA_FOLDER, "previews")
+# 磁盘缓存的容量上限，超出时删除最久未使用的预览
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# 缩略图的最大边长和 JPEG 质量
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_QUALITY = 80
+# 像素数超过该值的图片不生成缩略图，避免解压炸弹占满内存
+MAX_IMAGE_PIXELS = 100 * 1000 * 1000
+
+# 文本摘要：读取的字节数、保留的行数和字符数
+TEXT_SNIPPET_BYTES = 4096
+TEXT_SNIPPET_LINES = 12
+TEXT_SNIPPET_CHARS = 600
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff", ".ico"}
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".log", ".csv", ".tsv", ".json", ".xml", ".yaml", ".yml", ".ini", ".cfg", ".conf",
+    ".py", ".js", ".ts", ".html", ".htm", ".css", ".sh", ".bat", ".c", ".h", ".cpp", ".java", ".go",
+    ".rs", ".sql",
+}
+
+# 预览类型 -> (缓存文件扩展名, 应答的媒体类型)
+PREVIEW_FORMATS = {
+    "image": (".jpg", "image/jpeg"),
+    "text": (".txt", "text/plain"),
+    "pdf": (".txt", "text/plain"),
+}
+
+# 生成失败的文件版本只记录这么多个，超出时忘记最早的
+MAX_FAILED_ENTRIES = 1024
+
+# 请求等待预览生成的最长秒数，超过时应答 202，客户端按 Retry-After 秒后重试
+PREVIEW_WAIT = 0.5
+PREVIEW_RETRY_AFTER = 1
+
+# 可选依赖是否已安装：模块名 -> bool
+_available_modules = {}
+
+Preview = namedtuple("Preview", ["mimetype", "data", "etag"])
+
+
+class PreviewError(Exception):
+    """无法提供预览，带有应答的HTTP状态码"""
+
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+
+class PreviewPending(PreviewError):
+    """预览仍在生成，稍后重试"""
+
+    def __init__(self, retry_after=PREVIEW_RETRY_AFTER):
+        super().__init__("预览正在生成", 202)
+        self.retry_after = retry_after
+
+
+def module_available(name):
+    """可选依赖是否已安装；只查找不导入
+
+    图片缩略图使用 Pillow，PDF 摘要使用 pypdf，在第一次生成预览时才导入，不增加启动时间。
+    """
+    if name not in _available_modules:
+        _available_modules[name] = importlib.util.find_spec(name) is not None
+    return _available_modules[name]
+
+
+def preview_kind(file_name):
+    """文件的预览类型：image、text、pdf，不支持时返回 None"""
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in IMAGE_EXTENSIONS and module_available("PIL"):
+        return "image"
+    if ext in TEXT_EXTENSIONS:
+        return "text"
+    if ext == ".pdf" and module_available("pypdf"):
+        return "pdf"
+    return None
+
+
+def preview_name(file_path, stat_result, kind):
+    """缓存文件名（也用作 ETag），由路径、大小和修改时间决定，文件变化后自然失效"""
+    identity = "\0".join(str(v) for v in (os.path.normpath(file_path), stat_result.st_size, stat_result.st_mtime_ns))
+    digest = hashlib.sha256(identity.encode("utf-8", "surrogateescape")).hexdigest()[:32]
+    return f"{kind}-{digest}{PREVIEW_FORMATS[kind][0]}"
+
+
+def render_thumbnail(file_path, size=THUMBNAIL_SIZE):
+    """生成 JPEG 缩略图，透明部分铺白色背景"""
+    from PIL import Image, ImageOps
+
+    with Image.open(file_path) as image:
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise PreviewError("图片过大，不生成预览")
+        # JPEG 在解码时直接按 1/2、1/4、1/8 缩小，大照片快得多
+        image.draft("RGB", size)
+        thumbnail = ImageOps.exif_transpose(image)
+        thumbnail.thumbnail(size)
+        if thumbnail.mode not in ("RGB", "L"):
+            rgba = thumbnail.convert("RGBA")
+            thumbnail = Image.new("RGB", rgba.size, "white")
+            thumbnail.paste(rgba, mask=rgba.getchannel("A"))
+        output = BytesIO()
+        thumbnail.save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def clip_text(text):
+    """保留开头的若干非空行"""
+    lines = [line.rstrip() for line in text.replace("\r\n", "\n").split("\n")]
+    text = "\n".join(line for line in lines if line.strip())
+    text = "\n".join(text.split("\n")[:TEXT_SNIPPET_LINES])
+    return text[:TEXT_SNIPPET_CHARS]
+
+
+def text_snippet(file_path):
+    """文本文件开头的内容；不是 UTF-8 时按 GB18030 解码"""
+    with open(file_path, "rb") as f:
+        data = f.read(TEXT_SNIPPET_BYTES)
+    try:
+        # 增量解码器会忽略截断在末尾的多字节字符
+        text = codecs.getincrementaldecoder("utf-8-sig")().decode(data)
+    except UnicodeDecodeError:
+        text = data.decode("gb18030", "replace")
+    if "\0" in text:
+        raise PreviewError("不是文本文件")
+    return clip_text(text)
+
+
+def pdf_snippet(file_path):
+    """PDF 的页数和第一页的文字"""
+    from pypdf import PdfReader
+
+    # 传入文件对象，pypdf 按需读取；传入路径时会把整个文件读进内存
+    with open(file_path, "rb") as f:
+        reader = PdfReader(f)
+        if reader.is_encrypted:
+            raise PreviewError("PDF 已加密，不生成预览")
+        pages = len(reader.pages)
+        text = reader.pages[0].extract_text() if pages else ""
+    return clip_text(f"共 {pages} 页\n{text}")
+
+
+def render_preview(kind, file_path):
+    """按类型生成预览内容（bytes）"""
+    if kind == "image":
+        return render_thumbnail(file_path)
+    if kind == "pdf":
+        return pdf_snippet(file_path).encode("utf-8")
+    return text_snippet(file_path).encode("utf-8")
+
+
+class PreviewCache:
+    """容量有上限的磁盘 LRU 缓存
+
+    每个预览是目录中的一个文件，访问时更新修改时间，重启后按修改时间
+    恢复使用顺序。写入先落到临时文件再改名，中断不会留下不完整的预览。
+    """
+
+    def __init__(self, folder=DEFAULT_PREVIEW_FOLDER, max_bytes=DEFAULT_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        with os.scandir(self.folder) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                if item.name.endswith(".tmp"):
+                    self._remove(item.name)
+                    continue
+                st = item.stat()
+                found.append((st.st_mtime_ns, item.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def get(self, name):
+        """返回缓存的内容，没有时返回 None"""
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # 缓存目录被外部清理
+            with self._lock:
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self.total_bytes -= size
+            return None
+        return data
+
+    def put(self, name, data):
+        temp_path = os.path.join(self.folder, f"{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.folder, name))
+        except OSError:
+            self._remove(os.path.basename(temp_path))
+            return
+        with self._lock:
+            self.total_bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # 调用方持有锁；至少保留刚写入的一项
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except OSError:
+            pass
+
+
+class PreviewService:
+    """按需生成预览：先查磁盘缓存，未命中时交给线程池生成
+
+    线程池限制同时生成的预览数，其余请求排队；同一文件版本同时被请求
+    时只生成一次。生成失败的文件版本会被记住，不会反复尝试。请求最多
+    等待 wait 秒，未生成完时抛出 PreviewPending，不长时间占用服务器的工作线程。
+    """
+
+    def __init__(self, folder=DEFAULT_PREVIEW_FOLDER, max_bytes=DEFAULT_CACHE_BYTES, workers=None, wait=PREVIEW_WAIT):
+        self.cache = PreviewCache(folder, max_bytes)
+        self.wait = wait
+        self._pending = {}
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 2),
+            thread_name_prefix="preview"
+        )
+
+    def etag(self, file_path, stat_result):
+        """文件当前版本的预览 ETag，不支持预览时抛出 PreviewError"""
+        return preview_name(file_path, stat_result, self._kind(file_path))
+
+    def _kind(self, file_path):
+        kind = preview_kind(file_path)
+        if kind is None:
+            raise PreviewError("该类型的文件不支持预览", 404)
+        return kind
+
+    def get(self, file_path, stat_result=None):
+        """返回文件当前版本的 Preview，仍在生成时抛出 PreviewPending"""
+        st = stat_result or os.stat(file_path)
+        kind = self._kind(file_path)
+        name = preview_name(file_path, st, kind)
+        mimetype = PREVIEW_FORMATS[kind][1]
+        data = self.cache.get(name)
+        if data is not None:
+            return Preview(mimetype, data, name)
+
+        with self._lock:
+            if name in self._failed:
+                raise PreviewError(self._failed[name])
+            future = self._pending.get(name)
+            if future is None:
+                future = self._pending[name] = self._executor.submit(self._render, kind, file_path, st, name)
+        try:
+            data = future.result(timeout=self.wait)
+        except FutureTimeoutError:
+            raise PreviewPending()
+        return Preview(mimetype, data, name)
+
+    def _render(self, kind, file_path, stat_result, name):
+        try:
+            data = render_preview(kind, file_path)
+            st = os.stat(file_path)
+            # 生成期间文件发生变化时不写入缓存，下次请求按新版本重新生成
+            if (st.st_size, st.st_mtime_ns) == (stat_result.st_size, stat_result.st_mtime_ns):
+                self.cache.put(name, data)
+            return data
+        except Exception as e:
+            # 损坏或特殊的文件可能让图片和 PDF 解析库抛出任意异常
+            message = str(e) if isinstance(e, PreviewError) else "无法生成预览"
+            with self._lock:
+                self._failed[name] = message
+                while len(self._failed) > MAX_FAILED_ENTRIES:
+                    self._failed.popitem(last=False)
+            raise PreviewError(message)
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def shutdown(self):
+        """停止线程池"""
+        self._executor.shutdown(wait=False)
@@ -1,12 +1,137 @@
 import os
-import threading
-from flask import Flask, render_template, send_file, jsonify
+import json
 import socket
-import time
-import requests
+import threading
+from flask import Flask, render_template, jsonify, request, Response, redirect
+from collections import deque
+from datetime import datetime
+from urllib.parse import quote
+from werkzeug.serving import make_server
+
+from file_registry import FileRegistry
+from file_response import (TransferSettings, FileStream, make_file_response, make_encrypted_response, make_etag,
+                           content_disposition)
+from archive_stream import ARCHIVE_FORMATS, iter_archive, archive_file_name
+from compression import ResponseCompressor
+from listing import FileListing, DEFAULT_PAGE_SIZE
+from uploads import UploadManager, UploadError, parse_metadata
+from hashing import FileHasher, DEFAULT_HASH_CACHE_PATH
+from folder_watcher import FolderWatcher
+from bandwidth import TransferScheduler
+from metrics import TransferMetrics, METRICS_CONTENT_TYPE
+from share_store import ShareStore, DEFAULT_STATE_PATH
+from encryption import DownloadEncryption
+from preview import PreviewService, PreviewError, PreviewPending, preview_kind, DEFAULT_PREVIEW_FOLDER
+from delta_sync import (SignatureCache, DeltaError, choose_block_size, block_count, parse_runs, run_segments,
+                        signature_as_dict)
+
+# 默认的接收目录
+DEFAULT_UPLOAD_FOLDER = os.path.join(os.path.expanduser("~"), "Downloads", "CpolarFileXfer")
+
+# 扩展名到 Font Awesome 图标的映射
+FILE_ICONS = {
+    "fa-file-alt": ("txt", "doc", "docx", "pdf", "rtf"),
+    "fa-file-image": ("jpg", "jpeg", "png", "gif", "bmp", "svg"),
+    "fa-file-video": ("mp4", "avi", "mkv", "mov", "wmv"),
+    "fa-file-audio": ("mp3", "wav", "ogg", "aac", "m4a"),
+    "fa-file-archive": ("zip", "rar", "7z", "tar", "gz"),
+}
+
+
+def get_file_icon(file_name):
+    """根据扩展名返回文件图标类名"""
+    ext = get_file_extension(file_name).lower()
+    for icon, extensions in FILE_ICONS.items():
+        if ext in extensions:
+            return icon
+    return ""
+
+
+def get_file_extension(file_name):
+    """获取文件扩展名"""
+    _, ext = os.path.splitext(file_name)
+    return ext[1:].upper() or "未知文件"
+
+
+def get_formatted_date(timestamp):
+    """格式化文件修改时间"""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# 按内容寻址的地址内容永不改变，可以长期缓存；按ID寻址的地址每次都需要用 ETag 验证
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_CONTROL_REVALIDATE = "public, no-cache"
+
+
+def get_local_ip():
+    """本机的局域网IP（不发送数据，只查询路由），失败时返回 127.0.0.1"""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+        finally:
+            s.close()
+    except OSError as e:
+        print(f"获取IP失败: {e}")
+        return "127.0.0.1"
+
+
+def client_address(request):
+    """客户端地址；经本机隧道（cpolar）转发的请求取 X-Forwarded-For 中的原始地址"""
+    remote = request.remote_addr or ""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded and remote in ("127.0.0.1", "::1"):
+        return forwarded.split(",")[0].strip() or remote
+    return remote
+
+
+def is_local_request(request):
+    """请求是否直接来自本机；经 cpolar HTTP 隧道转发的请求虽然来自回环地址，但带有转发头
+
+    TCP 隧道不添加转发头，经它的请求与本机请求无法区分。
+    """
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return False
+    return not any(name in request.headers for name in ("X-Forwarded-For", "Forwarded", "X-Real-IP"))
+
+
+def download_url(entry):
+    """条目的下载地址：摘要已知时按内容寻址，否则按稳定ID寻址"""
+    name = quote(entry["name"])
+    if entry.get("hash"):
+        algorithm, _, digest = entry["hash"].partition(":")
+        return f"/blob/{algorithm}-{digest}/{name}"
+    return f"/files/{entry['id']}/{name}"
+
+
+def public_entry(entry):
+    """列表接口中的条目：去掉本机路径，加上下载地址"""
+    data = {key: value for key, value in entry.items() if key != "path"}
+    data["url"] = download_url(entry)
+    return data
+
+
+# 只允许加密下载时，明文请求的应答
+PLAINTEXT_FORBIDDEN = "只允许加密下载，请使用分享者提供的带密钥的链接"
+
+# 未开启远端上传时上传请求的应答
+UPLOADS_DISABLED = "共享者没有开启远端上传"
+
+# 未开放传输统计时远端请求的应答
+STATS_FORBIDDEN = "传输统计只允许本机访问"
+
+# 停止服务器时等待进行中的传输完成的默认秒数
+DEFAULT_DRAIN_TIMEOUT = 10
+
+# 可选的服务引擎：waitress 为多线程生产服务器，werkzeug 为开发服务器，
+# asyncio 在事件循环中发送文件，适合大量慢速的长连接
+SERVER_ENGINES = ("waitress", "werkzeug", "asyncio")
 
 class ServerManager:
-    def __init__(self):
+    def __init__(self, registry=None, engine="waitress", threads=8, connection_limit=100,
+                 upload_folder=DEFAULT_UPLOAD_FOLDER, state_path=DEFAULT_STATE_PATH,
+                 hash_cache_path=DEFAULT_HASH_CACHE_PATH, preview_folder=DEFAULT_PREVIEW_FOLDER):
         # 创建Flask应用
         self.flask_app = Flask(__name__, template_folder='templates')
         self.setup_flask_routes()
@@ -14,95 +139,649 @@ class ServerManager:
         # 服务器状态
         self.server_running = False
         self.server_thread = None
+        self.http_server = None
+        self.socket_map = {}
+        # 端口绑定完成、可以接受连接时设置
+        self.ready = threading.Event()
         self.port = 5000
         self.local_ip = "127.0.0.1"
         
-        # 文件列表
-        self.shared_files = []
+        # 服务引擎配置
+        self.engine = engine
+        self.threads = threads
+        self.connection_limit = connection_limit
+        
+        # 共享文件注册表，GUI与服务器共用同一实例
+        self.registry = registry if registry is not None else FileRegistry()
+        self.listing = FileListing(self.registry)
+        
+        # 后台计算内容摘要，用于校验和去重；不保存状态时摘要缓存也只在内存中
+        self.hasher = FileHasher(self.registry, cache_path=hash_cache_path if state_path is not None else None)
+        
+        # 增量同步的块签名
+        self.signatures = SignatureCache()
+        
+        # 列表中的缩略图和文本摘要，按需生成并缓存在磁盘上
+        self.previews = PreviewService(preview_folder)
+        
+        # 加密下载（默认关闭，见 enable_encryption）
+        self.encryption = None
         
-        # 回调函数
-        self.file_list_callback = None
+        # 实时监控共享文件夹的变化
+        self.watcher = FolderWatcher(self.registry)
+        
+        # 持久化共享列表：启动时直接恢复上次的列表，再在后台校验（state_path 为 None 时不保存）
+        self.share_store = None
+        if state_path is not None:
+            self.share_store = ShareStore(self.registry, state_path)
+            self.share_store.load(self.watcher)
+        
+        # 文件传输参数和最近的传输统计
+        self.transfer_settings = TransferSettings()
+        self.transfer_log = deque(maxlen=200)
+        # /metrics 和 /api/transfers 默认只允许本机访问，其中有接收方的地址
+        self.public_stats = False
+        
+        # 下载带宽调度：全局/单客户端限速、并发上限和优先级
+        self.scheduler = TransferScheduler()
+        
+        # 传输指标，通过 /metrics 导出并在界面中显示
+        self.metrics = TransferMetrics(describe_file=self.describe_file)
+        self.metrics.attach(self.flask_app)
+        self.metrics.add_gauge("cpolarfilexfer_queued_downloads", "在调度器中排队的下载数",
+                               lambda: self.scheduler.status()["queued"])
+        self.metrics.add_gauge("cpolarfilexfer_shared_files", "共享文件数", lambda: len(self.registry))
+        
+        # 接收远端上传的文件
+        self.upload_callback = None
+        self.uploads = UploadManager(upload_folder, on_complete=self.on_upload_complete)
+        
+        # 按 Accept-Encoding 压缩页面、JSON和文本类下载
+        self.compressor = ResponseCompressor()
+        self.flask_app.after_request(self.compressor)
+    
+    @property
+    def shared_files(self):
+        """当前共享文件列表（注册表快照）"""
+        return self.registry.snapshot()
     
     def setup_flask_routes(self):
         """设置Flask路由"""
+        # 模板中使用的辅助函数
+        self.flask_app.jinja_env.globals.update(
+            get_file_icon=get_file_icon,
+            get_file_extension=get_file_extension,
+            get_formatted_date=get_formatted_date,
+            download_url=download_url,
+            preview_kind=preview_kind,
+            current_year=datetime.now().year
+        )
+        
         @self.flask_app.route('/')
         def index():
-            """主页，显示可下载的文件列表"""
-            return render_template('index.html', files=self.shared_files, ip=self.local_ip)
+            """主页，分页显示可下载的文件列表"""
+            params = self.listing_params()
+            if params is None:
+                return "参数错误", 400
+            
+            def render():
+                page = self.listing.page(**params)
+                return render_template(
+                    'index.html',
+                    files=page.items,
+                    page=page,
+                    params=params,
+                    ip=self.local_ip,
+                    encryption=encryption,
+                    uploads_enabled=uploads_enabled
+                )
+            
+            encryption = self.encryption_state()
+            uploads_enabled = self.uploads.enabled
+            return self.cached_listing_response(
+                ("html", self.local_ip, encryption, uploads_enabled) + tuple(params.values()), render, "text/html"
+            )
+        
+        @self.flask_app.route('/files/<int:file_id>')
+        @self.flask_app.route('/files/<int:file_id>/<path:name>')
+        def download(file_id, name=None):
+            """按稳定ID下载文件，列表增删和重启都不影响地址"""
+            entry = self.registry.get(file_id)
+            if entry is None or not os.path.isfile(entry["path"]):
+                return "文件不存在", 404
+            return self.file_response(entry, CACHE_CONTROL_REVALIDATE)
+        
+        @self.flask_app.route('/blob/<digest>')
+        @self.flask_app.route('/blob/<digest>/<path:name>')
+        def download_blob(digest, name=None):
+            """按内容摘要下载文件，内容不变时地址不变，可被代理长期缓存"""
+            algorithm, _, hex_digest = digest.rpartition("-")
+            if algorithm != self.hasher.algorithm:
+                return "不支持的摘要算法", 400
+            if len(hex_digest) != self.hasher.digest_length or hex_digest.strip("0123456789abcdef"):
+                return "摘要格式错误", 400
+            entry = self.hasher.find(algorithm, hex_digest)
+            if entry is None:
+                return "文件不存在", 404
+            return self.file_response(entry, CACHE_CONTROL_IMMUTABLE)
         
         @self.flask_app.route('/download/<int:file_index>')
-        def download(file_index):
-            """下载文件"""
-            if 0 <= file_index < len(self.shared_files):
-                file_path = self.shared_files[file_index]["path"]
-                if os.path.exists(file_path):
-                    return send_file(file_path, as_attachment=True)
+        def download_legacy(file_index):
+            """旧的按列表位置下载地址，重定向到稳定的下载地址"""
+            files = self.shared_files
+            if 0 <= file_index < len(files):
+                return redirect(download_url(files[file_index]))
             return "文件不存在", 404
         
+        @self.flask_app.route('/archive', methods=['GET', 'POST'])
+        def archive():
+            """把选中的文件或某个文件夹下的文件流式打包下载"""
+            if not self.plaintext_allowed():
+                return PLAINTEXT_FORBIDDEN, 403
+            archive_format = request.values.get('format', 'zip')
+            if archive_format not in ARCHIVE_FORMATS:
+                return "不支持的打包格式", 400
+            
+            entries = self.select_entries(
+                request.values.getlist('ids'),
+                request.values.get('folder')
+            )
+            if entries is None:
+                return "参数错误", 400
+            paths = [e["path"] for e in entries if os.path.isfile(e["path"])]
+            if not paths:
+                return "没有可打包的文件", 404
+            
+            transfer = self.scheduler.open(client_address(request))
+            return Response(
+                transfer.iter_throttled(iter_archive(archive_format, paths)),
+                mimetype=ARCHIVE_FORMATS[archive_format],
+                headers={"Content-Disposition": content_disposition(archive_file_name(paths, archive_format))},
+                direct_passthrough=True
+            )
+        
         @self.flask_app.route('/api/files')
         def get_files():
-            """获取文件列表API"""
-            return jsonify(self.shared_files)
+            """获取文件列表API，支持 q/sort/order/cursor/limit 参数"""
+            params = self.listing_params()
+            if params is None:
+                return jsonify({"error": "参数错误"}), 400
+            
+            def serialize():
+                page = self.listing.page(**params)
+                return json.dumps({
+                    "files": [public_entry(e) for e in page.items],
+                    "hash_algorithm": self.hasher.algorithm,
+                    "offset": page.offset,
+                    "total": page.total,
+                    "next_cursor": page.next_cursor
+                }, ensure_ascii=False)
+            
+            return self.cached_listing_response(("json",) + tuple(params.values()), serialize, "application/json")
+        
+        @self.flask_app.route('/api/files/<int:file_id>/signature')
+        def file_signature(file_id):
+            """文件的块签名，持有旧版本的客户端据此找出内容未变的块"""
+            if not self.plaintext_allowed():
+                return PLAINTEXT_FORBIDDEN, 403
+            entry = self.registry.get(file_id)
+            if entry is None or not os.path.isfile(entry["path"]):
+                return "文件不存在", 404
+            try:
+                signature = self.signatures.get(entry["path"])
+            except DeltaError as e:
+                return str(e), e.status
+            except OSError:
+                return "文件不存在", 404
+            
+            if request.if_none_match.contains_weak(signature.etag):
+                response = Response(status=304)
+            else:
+                response = Response(json.dumps(signature_as_dict(signature)), mimetype="application/json")
+            response.set_etag(signature.etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        
+        @self.flask_app.route('/api/files/<int:file_id>/preview')
+        def file_preview(file_id):
+            """文件的预览：图片返回缩略图，文本和PDF返回开头的文字"""
+            # 预览会经过隧道泄露文件内容，只允许加密下载时不提供
+            if not self.plaintext_allowed():
+                return PLAINTEXT_FORBIDDEN, 403
+            entry = self.registry.get(file_id)
+            if entry is None:
+                return "文件不存在", 404
+            try:
+                st = os.stat(entry["path"])
+                etag = self.previews.etag(entry["path"], st)
+                if request.if_none_match.contains_weak(etag):
+                    response = Response(status=304)
+                else:
+                    preview = self.previews.get(entry["path"], st)
+                    response = Response(preview.data, mimetype=preview.mimetype)
+            except PreviewPending as e:
+                return Response(str(e), status=e.status, mimetype="text/plain",
+                                headers={"Retry-After": str(e.retry_after), "Cache-Control": "no-store"})
+            except PreviewError as e:
+                return str(e), e.status
+            except OSError:
+                return "文件不存在", 404
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        
+        @self.flask_app.route('/api/files/<int:file_id>/delta', methods=['POST'])
+        def file_delta(file_id):
+            """按块区间返回文件内容，请求体为 {"block_size": 块大小, "blocks": [[起始块, 块数], ...]}"""
+            if not self.plaintext_allowed():
+                return PLAINTEXT_FORBIDDEN, 403
+            entry = self.registry.get(file_id)
+            if entry is None or not os.path.isfile(entry["path"]):
+                return "文件不存在", 404
+            if not request.if_match:
+                return "需要 If-Match（签名中的 etag）", 428
+            try:
+                st = os.stat(entry["path"])
+            except OSError:
+                return "文件不存在", 404
+            etag = make_etag(st)
+            if not request.if_match.contains(etag):
+                return "文件已变化，请重新获取签名", 412
+            
+            block_size = choose_block_size(st.st_size)
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict) or body.get("block_size") != block_size:
+                return "块大小与签名不符", 400
+            try:
+                runs = parse_runs(body.get("blocks"), block_count(st.st_size, block_size))
+            except DeltaError as e:
+                return str(e), e.status
+            
+            segments = run_segments(runs, block_size, st.st_size)
+            stream = FileStream(
+                entry["path"], segments, request.environ, self.transfer_settings,
+                on_start=self.metrics.transfer_started,
+                on_finish=self.transfer_finished,
+                transfer=self.scheduler.open(client_address(request))
+            )
+            response = Response(stream, mimetype="application/octet-stream", direct_passthrough=True)
+            response.headers["Content-Length"] = str(sum(length for _, _, length in segments))
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-store"
+            return response
+        
+        @self.flask_app.route('/api/uploads', methods=['POST'])
+        def create_upload():
+            """创建分块上传（与 tus 协议的创建扩展相同的请求头）"""
+            if not self.uploads.enabled:
+                return UPLOADS_DISABLED, 403
+            try:
+                length = int(request.headers.get('Upload-Length', ''))
+                chunk_size = int(request.headers.get('Upload-Chunk-Size', 0)) or None
+            except ValueError:
+                return "Upload-Length 无效", 400
+            try:
+                metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+                upload = self.uploads.create(length, metadata.get('filename'), chunk_size)
+            except UploadError as e:
+                return str(e), e.status
+            
+            response = Response(status=201)
+            response.headers['Location'] = f"/api/uploads/{upload.id}"
+            response.headers.update(self.upload_headers(upload))
+            return response
+        
+        @self.flask_app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD', 'PATCH', 'DELETE'])
+        def upload_chunk(upload_id):
+            """查询上传进度、上传一个分块或终止上传"""
+            if not self.uploads.enabled:
+                return UPLOADS_DISABLED, 403
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return "上传不存在", 404
+            
+            if request.method == 'DELETE':
+                self.uploads.cancel(upload_id)
+                return Response(status=204)
+            
+            if request.method == 'PATCH':
+                if request.content_length is None:
+                    return "需要 Content-Length", 411
+                try:
+                    offset = int(request.headers.get('Upload-Offset', ''))
+                    self.uploads.write_chunk(
+                        upload, offset, request.stream, request.content_length,
+                        checksum=request.headers.get('Upload-Checksum')
+                    )
+                except ValueError:
+                    return "Upload-Offset 无效", 400
+                except UploadError as e:
+                    return str(e), e.status
+                response = Response(status=204)
+            else:
+                response = jsonify({
+                    "file_name": upload.file_name,
+                    "length": upload.length,
+                    "chunk_size": upload.chunk_size,
+                    "received": sorted(upload.received),
+                    "complete": upload.complete
+                })
+            
+            response.headers.update(self.upload_headers(upload))
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        
+        @self.flask_app.route('/api/transfers')
+        def get_transfers():
+            """最近的传输统计（速率、CPU占用、传输方式），文件以共享ID和显示名表示"""
+            if not self.stats_allowed():
+                return STATS_FORBIDDEN, 403
+            transfers = []
+            for stats in list(self.transfer_log):
+                info = stats.as_dict()
+                info["id"], info["name"] = self.describe_file(info.pop("path"))
+                transfers.append(info)
+            return jsonify(transfers)
+        
+        @self.flask_app.route('/healthz')
+        def healthz():
+            """存活检查，隧道监督通过公网地址请求它"""
+            return Response("ok", content_type="text/plain", headers={"Cache-Control": "no-store"})
+        
+        @self.flask_app.route('/metrics')
+        def metrics():
+            """Prometheus 文本格式的传输指标"""
+            if not self.stats_allowed():
+                return STATS_FORBIDDEN, 403
+            return Response(self.metrics.render(), content_type=METRICS_CONTENT_TYPE,
+                            headers={"Cache-Control": "no-store"})
+    
+    def file_response(self, entry, cache_control):
+        """构造共享条目的下载响应，encrypted=1 时返回分块加密的密文"""
+        if request.args.get('encrypted') == '1':
+            encryption = self.encryption
+            if encryption is None:
+                return "未启用加密下载", 404
+            return make_encrypted_response(
+                request, entry["path"], encryption,
+                download_name=entry["name"],
+                on_start=self.metrics.transfer_started,
+                on_finish=self.transfer_finished,
+                cache_control=cache_control,
+                transfer=self.scheduler.open(client_address(request))
+            )
+        if not self.plaintext_allowed():
+            return PLAINTEXT_FORBIDDEN, 403
+        return make_file_response(
+            request, entry["path"],
+            download_name=entry["name"],
+            settings=self.transfer_settings,
+            on_start=self.metrics.transfer_started,
+            on_finish=self.transfer_finished,
+            digest_lookup=self.hasher.lookup,
+            cache_control=cache_control,
+            transfer=self.scheduler.open(client_address(request))
+        )
+    
+    def enable_encryption(self, key=None, required=False):
+        """开启加密下载，返回密钥文本；未安装加密库时抛出 RuntimeError
+
+        接收方通过 <地址>/#key=<密钥> 打开页面，密钥不会发送到服务器。
+        required 为 True 时拒绝明文下载、打包和增量同步。
+        """
+        previous = self.encryption
+        if previous is not None and key in (None, previous.key):
+            # 只切换是否强制加密：沿用原来的密钥，已发出的链接和进行中的续传不受影响
+            previous.required = required
+            return previous.key_text
+        self.encryption = DownloadEncryption(key, required=required)
+        if previous is not None:
+            previous.shutdown()
+        return self.encryption.key_text
+    
+    def disable_encryption(self):
+        """关闭加密下载"""
+        encryption, self.encryption = self.encryption, None
+        if encryption is not None:
+            encryption.shutdown()
+    
+    def encryption_state(self):
+        """加密下载的状态：off、on 或 required"""
+        encryption = self.encryption
+        if encryption is None:
+            return "off"
+        return "required" if encryption.required else "on"
+    
+    def encryption_key_text(self):
+        """加密下载的密钥文本，未开启时返回 None"""
+        encryption = self.encryption
+        return None if encryption is None else encryption.key_text
+    
+    def plaintext_allowed(self):
+        encryption = self.encryption
+        return encryption is None or not encryption.required
+    
+    def stats_allowed(self):
+        return self.public_stats or is_local_request(request)
+    
+    def describe_file(self, file_path):
+        """统计中表示文件的 (共享ID, 显示名)，不暴露本机路径；已移除的文件只保留文件名"""
+        entry = self.registry.get_by_path(file_path)
+        if entry is None:
+            return "", os.path.basename(file_path)
+        return str(entry["id"]), entry["name"]
     
-    def set_file_list_callback(self, callback):
-        """设置文件列表更新回调函数"""
-        self.file_list_callback = callback
+    def transfer_finished(self, stats):
+        """一次文件传输结束（完成或客户端断开）"""
+        self.transfer_log.append(stats)
+        self.metrics.transfer_finished(stats)
+    
+    def upload_headers(self, upload):
+        """上传状态的响应头"""
+        return {
+            'Tus-Resumable': '1.0.0',
+            'Upload-Offset': str(upload.offset),
+            'Upload-Length': str(upload.length),
+            'Upload-Chunk-Size': str(upload.chunk_size),
+        }
+    
+    def on_upload_complete(self, file_path):
+        """上传完成回调（在服务器线程中调用）"""
+        if self.upload_callback:
+            self.upload_callback(file_path)
+    
+    def listing_params(self):
+        """从查询参数解析列表参数，非法时返回 None"""
+        params = {
+            "query": request.args.get('q', '').strip(),
+            "sort": request.args.get('sort', 'name'),
+            "order": request.args.get('order', 'asc'),
+            "cursor": request.args.get('cursor') or None,
+            "limit": request.args.get('limit', DEFAULT_PAGE_SIZE),
+            # 默认隐藏内容重复的文件，dedupe=0 时全部列出
+            "dedupe": request.args.get('dedupe', '1') != '0',
+        }
+        if params["order"] not in ("asc", "desc"):
+            return None
+        try:
+            params["limit"] = int(params["limit"])
+        except ValueError:
+            return None
+        return params
+    
+    def cached_listing_response(self, key, builder, mimetype):
+        """返回缓存的列表响应，支持 ETag/304"""
+        try:
+            data, etag = self.listing.cached(key, builder)
+        except ValueError as e:
+            return str(e), 400
+        
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    
+    def select_entries(self, id_values, folder=None):
+        """按ID列表（逗号分隔）或文件夹选择共享条目，都未指定时返回全部"""
+        if id_values:
+            try:
+                file_ids = [int(v) for value in id_values for v in value.split(',') if v.strip()]
+            except ValueError:
+                return None
+            entries = (self.registry.get(file_id) for file_id in file_ids)
+            return [e for e in entries if e is not None]
+        
+        if folder:
+            prefix = os.path.join(os.path.normpath(folder), "")
+            return [e for e in self.shared_files if e["path"].startswith(prefix)]
+        
+        return list(self.shared_files)
     
     def update_files(self, files):
-        """更新共享文件列表"""
-        self.shared_files = files
-        if self.file_list_callback:
-            self.file_list_callback(files)
+        """用给定的文件列表替换共享文件（只产生增删的差异部分）"""
+        paths = {os.path.normpath(f["path"]) for f in files}
+        stale = [e["id"] for e in self.registry.snapshot() if e["path"] not in paths]
+        self.registry.remove(stale)
+        self.registry.add_paths(paths)
+    
+    def close(self):
+        """停止服务和后台任务，并保存共享列表"""
+        self.stop(drain_timeout=0)
+        self.watcher.stop()
+        self.hasher.shutdown()
+        self.signatures.shutdown()
+        self.previews.shutdown()
+        self.disable_encryption()
+        if self.share_store is not None:
+            self.share_store.close()
+            self.share_store = None
     
     def is_running(self):
         """检查服务器是否正在运行"""
         return self.server_running
     
-    def start(self, port, files, local_ip):
-        """启动Flask服务器"""
+    def configure_engine(self, engine=None, threads=None, connection_limit=None):
+        """设置服务引擎及线程数，下次启动时生效"""
+        if engine is not None:
+            if engine not in SERVER_ENGINES:
+                raise ValueError(f"未知的服务引擎: {engine}")
+            self.engine = engine
+        if threads is not None:
+            self.threads = max(1, int(threads))
+        if connection_limit is not None:
+            self.connection_limit = max(1, int(connection_limit))
+    
+    def start(self, port, files=None, local_ip="127.0.0.1"):
+        """启动服务器
+
+        在调用线程中创建服务器并绑定端口（端口被占用等错误直接抛出），
+        绑定后即可接受连接，随后在后台线程运行服务循环并设置 ready。
+        """
         if self.server_running:
             return
         
         self.port = port
         self.local_ip = local_ip
-        self.shared_files = files
+        if files is not None:
+            self.update_files(files)
         
-        # 启动Flask服务器线程
+        self.http_server = self.create_http_server()
         self.server_running = True
         self.server_thread = threading.Thread(
             target=self.run_flask_server,
+            args=(self.http_server,),
             daemon=True
         )
         self.server_thread.start()
+        self.ready.set()
+    
+    def create_http_server(self):
+        """按所选引擎创建HTTP服务器"""
+        if self.engine == "asyncio":
+            from aio_server import AsyncHTTPServer
+            return AsyncHTTPServer(self.flask_app, '0.0.0.0', self.port, threads=self.threads)
         
-        # 等待服务器启动
-        max_attempts = 10
-        for attempt in range(max_attempts):
+        if self.engine == "waitress":
             try:
-                requests.get(f"http://{local_ip}:{port}", timeout=1)
-                break
-            except:
-                if attempt == max_attempts - 1:
-                    raise Exception("服务器启动超时")
-                time.sleep(0.5)
-    
-    def run_flask_server(self):
-        """运行Flask服务器"""
+                from waitress.server import create_server
+            except ImportError:
+                print("未安装waitress，改用werkzeug多线程服务器")
+            else:
+                self.socket_map = {}
+                return create_server(
+                    self.flask_app,
+                    map=self.socket_map,
+                    host='0.0.0.0',
+                    port=self.port,
+                    threads=self.threads,
+                    connection_limit=self.connection_limit,
+                    ident="CpolarFileXfer"
+                )
+        
+        return make_server('0.0.0.0', self.port, self.flask_app, threaded=True)
+    
+    def run_flask_server(self, server):
+        """运行服务循环，直到 stop() 关闭服务器"""
         try:
-            self.flask_app.run(host='0.0.0.0', port=self.port, debug=False)
+            if hasattr(server, "serve_forever"):
+                server.serve_forever()
+            else:
+                server.run()
         except Exception as e:
-            print(f"服务器错误: {e}")
-            self.server_running = False
+            if server is self.http_server:
+                print(f"服务器错误: {e}")
+                self.server_running = False
+                self.ready.clear()
     
-    def stop(self):
-        """停止Flask服务器"""
+    def stop(self, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """停止服务器
+
+        先停止接受新连接，再等待进行中的传输完成，最多等待 drain_timeout 秒，
+        超时后取消剩余传输，最后关闭所有连接并释放端口。
+        """
         if not self.server_running:
             return
         
         self.server_running = False
+        self.ready.clear()
         
-        # 发送关闭请求到Flask服务器
-        try:
-            requests.get(f"http://{self.local_ip}:{self.port}/shutdown", timeout=1)
-        except:
-            pass
+        server = self.http_server
+        self.http_server = None
+        if server is None:
+            return
+        
+        self.stop_accepting(server)
+        if not self.scheduler.wait_idle(drain_timeout):
+            self.scheduler.cancel_all()
+            self.scheduler.wait_idle(1)
+        
+        if hasattr(server, "serve_forever"):
+            # werkzeug / asyncio: 结束serve_forever循环并释放端口
+            server.shutdown()
+            server.server_close()
+        else:
+            # waitress: 停止工作线程并关闭所有连接，事件循环随后退出
+            from waitress import wasyncore
+            server.task_dispatcher.shutdown()
+            wasyncore.close_all(self.socket_map)
+        
+        if self.server_thread is not None:
+            self.server_thread.join(timeout=5)
+            self.server_thread = None
+    
+    def stop_accepting(self, server):
+        """关闭监听端口，已建立的连接继续传输"""
+        if hasattr(server, "stop_accepting"):
+            server.stop_accepting()
+        elif hasattr(server, "serve_forever"):
+            # werkzeug: 处理请求的线程独立于serve_forever循环，结束循环不影响进行中的传输
+            server.shutdown()
+            server.server_close()
+        else:
+            # waitress: 只关闭监听socket，保留唤醒事件循环用的trigger；
+            # 关闭操作需在waitress的事件循环线程中执行
+            from waitress import wasyncore
+            server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
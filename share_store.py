@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+
+from file_registry import format_size
+from folder_scanner import FolderScanner
+from hashing import APP_DATA_FOLDER
+
+DEFAULT_STATE_PATH = os.path.join(APP_DATA_FOLDER, "shares.sqlite3")
+
+# 后台校验时每批处理的条目数
+REVALIDATE_BATCH_SIZE = 1000
+
+
+class ShareStore:
+    """把共享列表和实时根目录保存在 SQLite 中
+
+    启动时直接从数据库恢复上次的列表（保留条目ID，不访问文件系统），
+    随后在后台线程中校验文件是否仍然存在、是否被修改。
+    注册表的变更由写线程合并后在一个事务中写入。
+    """
+
+    def __init__(self, registry, db_path=DEFAULT_STATE_PATH, flush_interval=1.0):
+        self.registry = registry
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL, hash TEXT)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY)")
+
+        self._lock = threading.Lock()
+        # 有变更、待写入的条目ID
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._writer = None
+        self._closed = False
+        self.revalidating = False
+
+    def load(self, watcher=None):
+        """恢复上次的共享列表和根目录，然后开始记录变更并在后台校验"""
+        with self._db_lock:
+            records = self._conn.execute(
+                "SELECT id, path, size, mtime, hash FROM files ORDER BY id"
+            ).fetchall()
+            roots = [row[0] for row in self._conn.execute("SELECT path FROM roots")]
+
+        restored = self.registry.restore(records)
+        self.registry.subscribe(self.on_registry_change)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+        if watcher is not None:
+            for root in roots:
+                if os.path.isdir(root):
+                    watcher.add_root(root)
+            watcher.roots_listener = self.save_roots
+
+        self.revalidating = True
+        threading.Thread(target=self.revalidate, args=(restored, roots), daemon=True).start()
+        return restored
+
+    def revalidate(self, entries, roots):
+        """后台校验恢复的条目，并重新扫描根目录以发现离线期间新增的文件"""
+        try:
+            for start in range(0, len(entries), REVALIDATE_BATCH_SIZE):
+                missing = []
+                changes = {}
+                for entry in entries[start:start + REVALIDATE_BATCH_SIZE]:
+                    try:
+                        st = os.stat(entry["path"])
+                    except OSError:
+                        missing.append(entry["id"])
+                        continue
+                    if st.st_size != entry["size_bytes"] or st.st_mtime != entry["mtime"]:
+                        changes[entry["id"]] = {
+                            "size": format_size(st.st_size),
+                            "size_bytes": st.st_size,
+                            "mtime": st.st_mtime,
+                            # 离线期间内容已变化，摘要需要重新计算
+                            "hash": None,
+                            "duplicate_of": None,
+                        }
+                self.registry.remove(missing)
+                self.registry.update(changes)
+
+            for root in roots:
+                if os.path.isdir(root):
+                    FolderScanner(root, on_batch=self.registry.add_stats).run()
+        finally:
+            self.revalidating = False
+
+    def on_registry_change(self, delta):
+        """注册表变更回调：记录有变更的条目ID
+
+        不同线程发出的通知可能乱序到达（如后台哈希的更新先于添加），
+        写入时按ID读取注册表中的当前条目，而不是使用通知中的旧副本。
+        """
+        with self._lock:
+            for entries in delta:
+                self._pending.update(entry["id"] for entry in entries)
+        self._wakeup.set()
+
+    def save_roots(self, roots):
+        """保存实时根目录列表"""
+        with self._db_lock:
+            if self._closed:
+                return
+            with self._conn:
+                self._conn.execute("DELETE FROM roots")
+                self._conn.executemany("INSERT INTO roots VALUES (?)", [(root,) for root in roots])
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait()
+            # 合并一段时间内的变更后再写入
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"保存共享列表失败: {e}")
+
+    def flush(self):
+        """把待写入的变更写入数据库"""
+        # 取出和写入都在数据库锁内：写线程已取出的变更不会因 close() 先关闭数据库而丢失
+        with self._db_lock:
+            if self._closed:
+                return
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            if not pending:
+                return
+
+            deletes = []
+            upserts = []
+            for file_id in pending:
+                entry = self.registry.get(file_id)
+                if entry is None:
+                    deletes.append((file_id,))
+                else:
+                    upserts.append((entry["id"], entry["path"], entry["size_bytes"], entry["mtime"], entry["hash"]))
+            with self._conn:
+                self._conn.executemany("DELETE FROM files WHERE id = ?", deletes)
+                # 路径可能在删除后以新ID重新加入，先按路径清理旧记录
+                self._conn.executemany("DELETE FROM files WHERE path = ? AND id != ?",
+                                       [(row[1], row[0]) for row in upserts])
+                self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", upserts)
+
+    def close(self):
+        """写入剩余变更并关闭数据库"""
+        self.flush()
+        with self._db_lock:
+            self._closed = True
+            self._conn.close()
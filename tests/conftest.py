@@ -0,0 +1,29 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# 模块都在仓库根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """不保存状态、上传和预览目录都在临时目录中的 ServerManager"""
+    from server import ServerManager
+
+    server_manager = ServerManager(
+        state_path=None,
+        upload_folder=str(tmp_path / "received"),
+        preview_folder=str(tmp_path / "previews")
+    )
+    yield server_manager
+    server_manager.close()
@@ -0,0 +1,72 @@
+import os
+import socket
+import time
+
+import pytest
+
+
+@pytest.fixture
+def aio_manager(manager, free_port):
+    manager.engine = "asyncio"
+    manager.start(free_port)
+    assert manager.ready.wait(5)
+    yield manager
+    manager.stop(drain_timeout=1)
+
+
+def share(manager, path, size):
+    path.write_bytes(os.urandom(size))
+    manager.registry.add_paths([str(path)])
+    entry = manager.registry.get_by_path(str(path))
+    return f"/files/{entry['id']}/{path.name}"
+
+
+def request(port, url):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    sock.sendall(f"GET {url} HTTP/1.1\r\nHost: test\r\nAccept-Encoding: identity\r\n\r\n".encode())
+    return sock
+
+
+def read_head(sock):
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(65536)
+        assert chunk, "连接在响应头之前关闭"
+        data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    headers = dict(line.split(": ", 1) for line in head.decode("latin-1").split("\r\n")[1:])
+    return headers, body
+
+
+def test_keep_alive_after_complete_file(aio_manager, tmp_path):
+    url = share(aio_manager, tmp_path / "a.bin", 300 * 1024)
+    sock = request(aio_manager.port, url)
+    for _ in range(2):
+        headers, body = read_head(sock)
+        while len(body) < int(headers["Content-Length"]):
+            body += sock.recv(65536)
+        assert headers["Connection"] == "keep-alive"
+        assert len(body) == 300 * 1024
+        sock.sendall(f"GET {url} HTTP/1.1\r\nHost: test\r\nAccept-Encoding: identity\r\n\r\n".encode())
+    sock.close()
+
+
+def test_truncated_file_closes_connection(aio_manager, tmp_path):
+    path = tmp_path / "b.bin"
+    url = share(aio_manager, path, 8 * 1024 * 1024)
+    aio_manager.scheduler.configure(global_rate=2 * 1024 * 1024)
+    sock = request(aio_manager.port, url)
+    headers, body = read_head(sock)
+    received = len(body)
+    with open(path, "r+b") as f:
+        f.truncate(1024 * 1024)
+    started = time.monotonic()
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+    sock.close()
+    # 响应体不足 Content-Length 时服务器断开连接，而不是让客户端等到超时
+    assert received < int(headers["Content-Length"])
+    assert time.monotonic() - started < 5
@@ -0,0 +1,118 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+FILES = {
+    "notes.txt": b"plain text line\n" * 4000,
+    "photo.jpg": os.urandom(50000),
+    "sub/data.csv": b"a,b,c\n" * 3000,
+    "sub/archive.zip": os.urandom(20000),
+}
+
+
+@pytest.fixture
+def shared(manager, tmp_path):
+    """共享 FILES 中的文件，返回 {包内路径: 条目}"""
+    root = tmp_path / "share"
+    entries = {}
+    for name, data in FILES.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        manager.registry.add_paths([str(path)])
+        entries[name] = manager.registry.get_by_path(str(path))
+    return entries
+
+
+def fetch(manager, query):
+    response = manager.flask_app.test_client().get("/archive" + query)
+    assert response.status_code == 200
+    return response
+
+
+def read_zip(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        return {info.filename: (zf.read(info), info.compress_type) for info in zf.infolist()}
+
+
+def read_tar(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        return {member.name: tf.extractfile(member).read() for member in tf.getmembers()}
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_archive_all_files(manager, shared, archive_format):
+    response = fetch(manager, f"?format={archive_format}")
+    assert f"share.{archive_format}" in response.headers["Content-Disposition"]
+    if archive_format == "zip":
+        members = {name: data for name, (data, _) in read_zip(response.data).items()}
+    else:
+        members = read_tar(response.data)
+    assert members == FILES
+
+
+def test_zip_stores_compressed_files(manager, shared):
+    members = read_zip(fetch(manager, "").data)
+    # 已压缩的格式只存储，其他文件 deflate
+    assert {name: compress_type for name, (_, compress_type) in members.items()} == {
+        "notes.txt": zipfile.ZIP_DEFLATED,
+        "photo.jpg": zipfile.ZIP_STORED,
+        "sub/data.csv": zipfile.ZIP_DEFLATED,
+        "sub/archive.zip": zipfile.ZIP_STORED,
+    }
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_archive_selected_ids(manager, shared, archive_format):
+    ids = f"{shared['notes.txt']['id']},{shared['sub/data.csv']['id']}"
+    response = fetch(manager, f"?format={archive_format}&ids={ids}")
+    if archive_format == "zip":
+        members = {name: data for name, (data, _) in read_zip(response.data).items()}
+    else:
+        members = read_tar(response.data)
+    # 包内路径相对于所选文件的公共父目录
+    assert members == {"notes.txt": FILES["notes.txt"], "sub/data.csv": FILES["sub/data.csv"]}
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_archive_folder(manager, shared, archive_format):
+    folder = os.path.dirname(shared["sub/data.csv"]["path"])
+    response = manager.flask_app.test_client().get(
+        "/archive", query_string={"format": archive_format, "folder": folder})
+    assert response.status_code == 200
+    if archive_format == "zip":
+        members = {name: data for name, (data, _) in read_zip(response.data).items()}
+    else:
+        members = read_tar(response.data)
+    assert members == {"data.csv": FILES["sub/data.csv"], "archive.zip": FILES["sub/archive.zip"]}
+
+
+def test_archive_errors(manager, shared):
+    client = manager.flask_app.test_client()
+    assert client.get("/archive?format=rar").status_code == 400
+    assert client.get("/archive?ids=abc").status_code == 400
+    assert client.get("/archive?ids=9999").status_code == 404
+
+
+def test_tar_zero_pads_file_that_shrinks(manager, tmp_path):
+    from archive_stream import ARCHIVE_CHUNK_SIZE
+
+    path = tmp_path / "shrinking.log"
+    data = os.urandom(2 * ARCHIVE_CHUNK_SIZE + 1000)
+    path.write_bytes(data)
+    manager.registry.add_paths([str(path)])
+    response = manager.flask_app.test_client().get("/archive?format=tar", buffered=False)
+    body = iter(response.response)
+    received = [next(body), next(body)]
+    assert received[1] == data[:ARCHIVE_CHUNK_SIZE]
+    # 打包过程中文件变短，剩余部分用零填充，包结构仍然完整
+    with open(path, "r+b") as f:
+        f.truncate(100)
+    received.extend(body)
+    response.close()
+    member = read_tar(b"".join(received))["shrinking.log"]
+    assert member == data[:ARCHIVE_CHUNK_SIZE] + bytes(len(data) - ARCHIVE_CHUNK_SIZE)
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bandwidth import PRIORITY_HIGH, PRIORITY_LOW, TransferCancelled, TransferScheduler
+
+
+def start_all(scheduler, clients, priorities=None):
+    transfers = [scheduler.open(client, (priorities or {}).get(client)) for client in clients]
+    for transfer in transfers:
+        transfer.start()
+    return transfers
+
+
+def test_water_filling_shares():
+    # 权重 normal=2、high=4：c 的份额 600 超过单客户端上限 500，剩余 700 由 a、b 平分，
+    # a 的两个连接再平分 a 的份额
+    scheduler = TransferScheduler(global_rate=1200, client_rate=500)
+    a1, a2, b, c = start_all(scheduler, ["a", "a", "b", "c"], {"c": PRIORITY_HIGH})
+    assert c.rate == pytest.approx(500)
+    assert b.rate == pytest.approx(350)
+    assert a1.rate == a2.rate == pytest.approx(175)
+
+    # 上限取消后按权重分配，结束的传输让出份额
+    scheduler.configure(client_rate=0)
+    assert c.rate == pytest.approx(600)
+    c.finish()
+    assert b.rate == pytest.approx(600)
+    assert a1.rate == pytest.approx(300)
+
+
+def test_client_rate_without_global_rate():
+    scheduler = TransferScheduler(client_rate=800)
+    a1, a2, b = start_all(scheduler, ["a", "a", "b"])
+    assert (a1.rate, a2.rate, b.rate) == (400, 400, 800)
+    scheduler.configure(client_rate=0)
+    assert (a1.rate, a2.rate, b.rate) == (0, 0, 0)
+
+
+def test_simulated_transfers_follow_their_shares():
+    # 3 个模拟传输各自按分配的速率发送，实际字节数应与份额成比例
+    scheduler = TransferScheduler(global_rate=800 * 1024)
+    transfers = start_all(scheduler, ["a", "b", "c"], {"a": PRIORITY_HIGH, "c": PRIORITY_LOW})
+    duration = 1.5
+
+    def run(transfer):
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            transfer.throttle(transfer.chunk_size(64 * 1024))
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in transfers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for transfer in transfers:
+        transfer.finish()
+
+    a, b, c = (t.bytes_sent / duration for t in transfers)
+    # 权重 4:2:1
+    assert a == pytest.approx(800 * 1024 * 4 / 7, rel=0.25)
+    assert b == pytest.approx(800 * 1024 * 2 / 7, rel=0.25)
+    assert c == pytest.approx(800 * 1024 / 7, rel=0.25)
+
+
+def test_queue_admits_by_priority():
+    scheduler = TransferScheduler(max_concurrent=1)
+    first, = start_all(scheduler, ["a"])
+    order = []
+
+    def wait_for_slot(transfer):
+        transfer.start()
+        order.append(transfer.client)
+        transfer.finish()
+
+    low = threading.Thread(target=wait_for_slot, args=(scheduler.open("low", PRIORITY_LOW),))
+    high = threading.Thread(target=wait_for_slot, args=(scheduler.open("high", PRIORITY_HIGH),))
+    low.start()
+    high.start()
+    deadline = time.monotonic() + 5
+    while scheduler.status()["queued"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.status()["queued"] == 2
+
+    first.finish()
+    low.join(5)
+    high.join(5)
+    assert order == ["high", "low"]
+    assert scheduler.wait_idle(1)
+
+
+def test_wait_idle():
+    scheduler = TransferScheduler()
+    assert scheduler.wait_idle(0)
+    transfer, = start_all(scheduler, ["a"])
+    assert not scheduler.wait_idle(0.05)
+    threading.Timer(0.1, transfer.finish).start()
+    assert scheduler.wait_idle(5)
+    # 重复结束不影响计数
+    transfer.finish()
+    assert scheduler.status()["active"] == []
+
+
+def test_cancel_all_stops_active_and_queued_transfers():
+    scheduler = TransferScheduler(max_concurrent=1)
+    active, = start_all(scheduler, ["a"])
+    queued = scheduler.open("b")
+    errors = []
+
+    def wait_for_slot():
+        try:
+            queued.start()
+        except TransferCancelled:
+            errors.append("queued")
+
+    thread = threading.Thread(target=wait_for_slot)
+    thread.start()
+    while scheduler.status()["queued"] < 1:
+        time.sleep(0.01)
+
+    scheduler.cancel_all()
+    thread.join(5)
+    assert errors == ["queued"]
+    with pytest.raises(TransferCancelled):
+        active.throttle(1024)
+    assert not scheduler.wait_idle(0.05)
+    active.finish()
+    assert scheduler.wait_idle(1)
+
+
+def test_iter_throttled_ends_early_when_cancelled():
+    scheduler = TransferScheduler()
+    transfer = scheduler.open("a")
+    sent = []
+    for chunk in transfer.iter_throttled(b"x" * 10 for _ in range(100)):
+        sent.append(chunk)
+        if len(sent) == 3:
+            scheduler.cancel_all()
+    assert len(sent) == 3
+    assert scheduler.wait_idle(0)
+
+
+def test_cancel_all_wakes_async_waiters():
+    scheduler = TransferScheduler(max_concurrent=1)
+    active, = start_all(scheduler, ["a"])
+
+    async def main():
+        queued = scheduler.open("b")
+        task = asyncio.ensure_future(queued.start_async())
+        while scheduler.status()["queued"] < 1:
+            await asyncio.sleep(0.01)
+        # 从其他线程取消，与服务器关闭时一样
+        threading.Thread(target=scheduler.cancel_all).start()
+        with pytest.raises(TransferCancelled):
+            await asyncio.wait_for(task, 5)
+
+    asyncio.run(main())
+    active.finish()
+    assert scheduler.wait_idle(1)
+
+
+def test_cancel_all_interrupts_throttle_sleep():
+    # 1 KB/s 时 16 KB 的一块要休眠十几秒
+    scheduler = TransferScheduler(client_rate=1024)
+    transfer, = start_all(scheduler, ["a"])
+    errors = []
+
+    def send():
+        try:
+            transfer.throttle(16 * 1024)
+        except TransferCancelled:
+            errors.append("cancelled")
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    scheduler.cancel_all()
+    thread.join(5)
+    assert errors == ["cancelled"]
+    assert time.monotonic() - started < 1
+
+
+def test_cancel_all_interrupts_async_throttle_sleep():
+    scheduler = TransferScheduler(client_rate=1024)
+    transfer, = start_all(scheduler, ["a"])
+
+    async def main():
+        task = asyncio.ensure_future(transfer.throttle_async(16 * 1024))
+        await asyncio.sleep(0.1)
+        started = time.monotonic()
+        threading.Thread(target=scheduler.cancel_all).start()
+        with pytest.raises(TransferCancelled):
+            await asyncio.wait_for(task, 5)
+        assert time.monotonic() - started < 1
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import gzip
+
+
+def download(client, url):
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    data = response.get_data()
+    response.close()
+    return response, data
+
+
+def test_compressed_download_is_counted_and_cached(manager, tmp_path):
+    path = tmp_path / "notes.txt"
+    text = b"compressible line of text\n" * 20000
+    path.write_bytes(text)
+    manager.registry.add_paths([str(path)])
+    url = f"/files/{manager.registry.snapshot()[0]['id']}/notes.txt"
+    client = manager.flask_app.test_client()
+
+    # 第一次边读边压缩，不带 Content-Length；完成后写入缓存
+    first, data = download(client, url)
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in first.headers
+    assert gzip.decompress(data) == text
+
+    second, data = download(client, url)
+    assert second.headers["Content-Length"] == str(len(data))
+    assert gzip.decompress(data) == text
+
+    summary = manager.metrics.snapshot()
+    assert summary["completed"] == 2
+    assert summary["active"] == 0
+
+
+def test_head_gets_the_same_headers_as_get(manager, tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"compressible line of text\n" * 20000)
+    manager.registry.add_paths([str(path)])
+    url = f"/files/{manager.registry.snapshot()[0]['id']}/notes.txt"
+    client = manager.flask_app.test_client()
+
+    head = client.head(url, headers={"Accept-Encoding": "gzip"})
+    assert head.data == b""
+    assert "Content-Length" not in head.headers
+    get, data = download(client, url)
+    for response in (head, get):
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.vary
+        assert "Accept-Ranges" not in response.headers
+        assert response.get_etag()[1]
+    assert head.headers["ETag"] == get.headers["ETag"]
+
+    # 缓存命中后 HEAD 也带上压缩后的长度
+    head = client.head(url, headers={"Accept-Encoding": "gzip"})
+    assert head.headers["Content-Length"] == str(len(data))
+
+
+def test_encoding_drops_content_digests():
+    from flask import Flask, Response
+
+    from compression import ResponseCompressor
+
+    response = Response(b"x" * 4096, mimetype="text/plain")
+    response.headers["Digest"] = "sha-256=abc"
+    response.headers["Repr-Digest"] = "sha-256=:abc:"
+    response.headers["Content-MD5"] = "abc"
+    response.set_etag("v1")
+    with Flask(__name__).test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = ResponseCompressor()(response)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert not {"Digest", "Repr-Digest", "Content-MD5"} & set(response.headers.keys())
+    assert response.headers["ETag"] == 'W/"v1"'
@@ -0,0 +1,102 @@
+import json
+import os
+import random
+
+import pytest
+
+from delta_client import DeltaDownload
+from delta_sync import MAX_DELTA_RUNS, DeltaError, choose_block_size, parse_runs
+
+
+@pytest.fixture
+def server(manager, free_port):
+    manager.start(free_port)
+    assert manager.ready.wait(5)
+    yield manager
+    manager.stop(drain_timeout=1)
+
+
+def share(manager, path):
+    manager.registry.add_paths([str(path)])
+    return manager.registry.get_by_path(str(path))
+
+
+def test_round_trip_downloads_only_changed_blocks(server, tmp_path):
+    old = os.urandom(1024 * 1024 + 123)
+    block_size = choose_block_size(len(old))
+    basis = tmp_path / "basis.bin"
+    basis.write_bytes(old)
+
+    # 原地改写三块中的一部分，其余内容不变
+    new = bytearray(old)
+    changed = [3, 4, 100]
+    for index in changed:
+        offset = index * block_size + 17
+        new[offset:offset + 100] = os.urandom(100)
+    path = tmp_path / "shared" / "data.bin"
+    path.parent.mkdir()
+    path.write_bytes(bytes(new))
+    entry = share(server, path)
+
+    output = tmp_path / "output.bin"
+    download = DeltaDownload(f"http://127.0.0.1:{server.port}", entry["id"], str(basis), str(output))
+    download.run()
+    assert output.read_bytes() == bytes(new)
+    assert download.matcher.missing_runs() == [[3, 2], [100, 1]]
+    assert download.downloaded == len(changed) * block_size
+    assert not os.path.exists(str(output) + ".delta-part")
+
+
+def test_round_trip_with_inserted_data(server, tmp_path):
+    rng = random.Random(1)
+    old = bytes(rng.getrandbits(8) for _ in range(256 * 1024))
+    basis = tmp_path / "basis.bin"
+    basis.write_bytes(old)
+    # 中间插入数据后，后面的块整体偏移，仍能通过滚动校验和找到
+    path = tmp_path / "data.bin"
+    path.write_bytes(old[:50000] + b"inserted" + old[50000:])
+    entry = share(server, path)
+
+    download = DeltaDownload(f"http://127.0.0.1:{server.port}", entry["id"], str(basis))
+    download.run()
+    assert basis.read_bytes() == path.read_bytes()
+    assert download.downloaded <= 2 * download.signature.block_size
+
+
+def test_parse_runs():
+    assert parse_runs([[0, 2], [2, 3], [7, 1]], 10) == [[0, 5], [7, 1]]
+    for runs in ([], [[0, 0]], [[3, 1], [2, 1]], [[0, 2], [1, 1]], [[9, 2]], [[True, 1]], [[0, 1, 2]],
+                 [(0, 1)], "0-1", [[-1, 1]]):
+        with pytest.raises(DeltaError):
+            parse_runs(runs, 10)
+    # 区间数有上限
+    too_many = [[i, 1] for i in range(0, 2 * MAX_DELTA_RUNS + 2, 2)]
+    with pytest.raises(DeltaError):
+        parse_runs(too_many, 2 * MAX_DELTA_RUNS + 2)
+    assert len(parse_runs(too_many[:MAX_DELTA_RUNS], 2 * MAX_DELTA_RUNS + 2)) == MAX_DELTA_RUNS
+
+
+def test_delta_preconditions(manager, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(64 * 1024))
+    entry = share(manager, path)
+    client = manager.flask_app.test_client()
+    etag = client.get(f"/api/files/{entry['id']}/signature").get_json()["etag"]
+    url = f"/api/files/{entry['id']}/delta"
+    body = json.dumps({"block_size": choose_block_size(64 * 1024), "blocks": [[1, 2]]})
+
+    def post(headers):
+        return client.post(url, data=body, headers=dict(headers, **{"Content-Type": "application/json"}))
+
+    assert post({}).status_code == 428
+    assert post({"If-Match": '"stale"'}).status_code == 412
+    # 带签名的 etag 时返回请求的块
+    response = post({"If-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    block_size = choose_block_size(64 * 1024)
+    assert response.data == path.read_bytes()[block_size:3 * block_size]
+
+    # 文件在获取签名后变化
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert post({"If-Match": f'"{etag}"'}).status_code == 412
@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+from server import CACHE_CONTROL_IMMUTABLE, CACHE_CONTROL_REVALIDATE
+
+
+@pytest.fixture
+def shared(manager, tmp_path):
+    """共享一个文件并等摘要算出，返回条目"""
+    path = tmp_path / "report.txt"
+    path.write_bytes(b"quarterly numbers\n" * 100)
+    manager.registry.add_paths([str(path)])
+    deadline = time.monotonic() + 10
+    while not manager.registry.get_by_path(str(path))["hash"]:
+        assert time.monotonic() < deadline, "哈希超时"
+        time.sleep(0.01)
+    return manager.registry.get_by_path(str(path))
+
+
+def blob_url(entry):
+    algorithm, _, digest = entry["hash"].partition(":")
+    return f"/blob/{algorithm}-{digest}"
+
+
+def test_files_route_revalidates(manager, shared):
+    client = manager.flask_app.test_client()
+    response = client.get(f"/files/{shared['id']}/{shared['name']}")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == CACHE_CONTROL_REVALIDATE
+    assert response.data == b"quarterly numbers\n" * 100
+
+    # 304 也带相同的缓存策略
+    response = client.get(f"/files/{shared['id']}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["Cache-Control"] == CACHE_CONTROL_REVALIDATE
+
+    assert client.get("/files/9999").status_code == 404
+
+
+def test_blob_route_is_immutable(manager, shared):
+    client = manager.flask_app.test_client()
+    for url in (blob_url(shared), blob_url(shared) + "/" + shared["name"]):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == CACHE_CONTROL_IMMUTABLE
+        assert response.data == b"quarterly numbers\n" * 100
+    response = client.get(blob_url(shared), headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["Cache-Control"] == CACHE_CONTROL_IMMUTABLE
+
+
+def test_blob_route_errors(manager, shared):
+    client = manager.flask_app.test_client()
+    algorithm, _, digest = shared["hash"].partition(":")
+
+    assert client.get(f"/blob/md5-{digest}").status_code == 400
+    assert client.get(f"/blob/{digest}").status_code == 400
+    for malformed in (digest[:-2], digest + "00", digest.upper(), "g" + digest[1:]):
+        assert client.get(f"/blob/{algorithm}-{malformed}").status_code == 400
+    # 格式正确但没有这个内容的文件
+    assert client.get(f"/blob/{algorithm}-{'0' * len(digest)}").status_code == 404
+
+
+def test_blob_route_forgets_changed_content(manager, shared):
+    url = blob_url(shared)
+    with open(shared["path"], "ab") as f:
+        f.write(b"revised\n")
+    os.utime(shared["path"], ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    # 内容与地址中的摘要不再一致，不能再按旧地址提供新内容
+    assert manager.flask_app.test_client().get(url).status_code == 404
@@ -0,0 +1,62 @@
+import io
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from encryption import CHUNK_SIZE, HEADER, TAG_SIZE, ChunkCipher, encryption_backend
+
+pytestmark = pytest.mark.skipif(encryption_backend() is None, reason="未安装加密库")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def share(manager, tmp_path, size):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(size))
+    manager.registry.add_paths([str(path)])
+    entry = manager.registry.snapshot()[0]
+    return str(path), f"/files/{entry['id']}/data.bin?encrypted=1"
+
+
+def decrypt(key, data):
+    stream = io.BytesIO(data)
+    cipher = ChunkCipher(key, stream.read(HEADER.size))
+    plain = []
+    for index in range(cipher.chunk_count):
+        length = min(cipher.chunk_size, cipher.plain_size - index * cipher.chunk_size) + TAG_SIZE
+        plain.append(cipher.decrypt(index, stream.read(length)))
+    return b"".join(plain)
+
+
+def test_encryption_backend_is_imported_on_first_use():
+    # 在新进程中检查，本进程已经导入过加密库
+    code = "import sys, encryption, file_response; print(sorted(m for m in sys.modules if m.startswith(('cryptography', 'Crypto'))))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_encrypted_download_round_trip(manager, tmp_path):
+    path, url = share(manager, tmp_path, 3 * CHUNK_SIZE + 1234)
+    manager.enable_encryption()
+    response = manager.flask_app.test_client().get(url)
+    assert response.status_code == 200
+    with open(path, "rb") as f:
+        assert decrypt(manager.encryption.key, response.data) == f.read()
+
+
+def test_encrypted_download_aborts_when_file_changes(manager, tmp_path):
+    path, url = share(manager, tmp_path, 8 * CHUNK_SIZE)
+    manager.enable_encryption()
+    response = manager.flask_app.test_client().get(url, buffered=False)
+    body = iter(response.response)
+    received = len(next(body))
+    # 同一个盐下改写内容会让相同的 nonce 加密不同的明文，必须中止而不是继续发送
+    with open(path, "r+b") as f:
+        f.write(b"changed")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    received += sum(len(chunk) for chunk in body)
+    response.close()
+    assert received < int(response.headers["Content-Length"])
@@ -0,0 +1,73 @@
+import os
+
+from file_registry import FileRegistry
+
+
+def make_registry(tmp_path, *names):
+    registry = FileRegistry()
+    registry.add_stats([(str(tmp_path / name), len(name), 1.0) for name in names])
+    return registry
+
+
+def test_ids_are_stable_across_remove_and_re_add(tmp_path):
+    registry = make_registry(tmp_path, "a.txt", "b.txt", "c.txt")
+    ids = {e["name"]: e["id"] for e in registry.snapshot()}
+    assert list(ids.values()) == [1, 2, 3]
+
+    registry.remove_paths([str(tmp_path / "b.txt")])
+    # 已存在的路径不会重复添加，其他条目的ID不变
+    assert registry.add_stats([(str(tmp_path / "a.txt"), 1, 1.0)]) == []
+    assert {e["name"]: e["id"] for e in registry.snapshot()} == {"a.txt": 1, "c.txt": 3}
+
+    # 移除的ID不会分配给其他文件，旧链接不会指向别的内容
+    re_added, new = registry.add_stats([(str(tmp_path / "b.txt"), 1, 1.0), (str(tmp_path / "d.txt"), 1, 1.0)])
+    assert (re_added["id"], new["id"]) == (4, 5)
+    assert registry.get(2) is None
+    assert registry.get_by_path(str(tmp_path / "b.txt"))["id"] == 4
+
+
+def test_deltas_and_versions(tmp_path):
+    registry = FileRegistry()
+    deltas = []
+    registry.subscribe(deltas.append)
+    version = registry.version
+
+    added = registry.add_stats([(str(tmp_path / "a.txt"), 1, 1.0), (str(tmp_path / "b.txt"), 2, 1.0)])
+    assert registry.version == version + 1
+    snapshot = registry.snapshot()
+    assert registry.snapshot() is snapshot
+
+    updated = registry.update({added[0]["id"]: {"hash": "blake2b:abc"}, 999: {"hash": "x"}})
+    assert [e["hash"] for e in updated] == ["blake2b:abc"]
+    # 写时复制：已取出的快照不受影响
+    assert snapshot[0]["hash"] is None
+    assert registry.snapshot() is not snapshot
+
+    # 没有实际变化的操作不递增版本，也不通知
+    version = registry.version
+    registry.update({added[0]["id"]: {"hash": "blake2b:abc"}})
+    registry.add_stats([(str(tmp_path / "a.txt"), 1, 1.0)])
+    registry.remove([999])
+    assert registry.version == version
+
+    removed = registry.remove([added[1]["id"]])
+    assert registry.version == version + 1
+    assert [(len(d.added), len(d.removed), len(d.updated)) for d in deltas] == [(2, 0, 0), (0, 0, 1), (0, 1, 0)]
+    assert deltas[1].updated == updated
+    assert deltas[2].removed == removed
+
+
+def test_restore_normalizes_paths(tmp_path):
+    registry = FileRegistry()
+    path = os.path.join(str(tmp_path), "sub", "..", "a.txt")
+    restored = registry.restore([(7, path, 1, 1.0, "blake2b:abc"), (8, str(tmp_path / "a.txt"), 1, 1.0, None)])
+
+    # 同一文件的不同写法只恢复一次，按规范化的路径索引
+    assert [e["id"] for e in restored] == [7]
+    assert restored[0]["path"] == str(tmp_path / "a.txt")
+    assert registry.get_by_path(str(tmp_path / "a.txt"))["id"] == 7
+    assert registry.add_stats([(str(tmp_path / "a.txt"), 1, 1.0)]) == []
+    # 新条目的ID接在恢复的ID之后
+    assert registry.add_stats([(str(tmp_path / "b.txt"), 1, 1.0)])[0]["id"] == 8
+    registry.remove_paths([path])
+    assert registry.get(7) is None
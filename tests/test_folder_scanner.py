@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from folder_scanner import FolderScanner
+
+
+def make_tree(root, folders=5, files_per_folder=20):
+    paths = set()
+    for i in range(folders):
+        folder = root / f"dir{i}" / "nested"
+        folder.mkdir(parents=True)
+        for j in range(files_per_folder):
+            path = folder / f"{j}.txt"
+            path.write_bytes(b"x" * j)
+            paths.add(str(path))
+    return paths
+
+
+def test_scan_reports_all_files_in_batches(tmp_path):
+    paths = make_tree(tmp_path)
+    batches = []
+    done = threading.Event()
+    scanner = FolderScanner(str(tmp_path), on_batch=lambda b: batches.append(list(b)),
+                            on_done=lambda s: done.set(), batch_size=7)
+    scanner.start()
+    assert done.wait(10)
+
+    found = [item for batch in batches for item in batch]
+    assert {path for path, _, _ in found} == paths
+    assert all(size == os.path.getsize(path) for path, size, _ in found)
+    assert all(len(batch) <= 7 for batch in batches)
+    assert scanner.files_found == len(paths)
+    assert scanner.dirs_scanned == 11
+    assert not scanner.running and not scanner.cancelled
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="需要创建符号链接的权限")
+def test_scan_skips_symlink_loops(tmp_path):
+    paths = make_tree(tmp_path, folders=1, files_per_folder=3)
+    os.symlink(str(tmp_path), str(tmp_path / "dir0" / "loop"))
+    found = []
+    FolderScanner(str(tmp_path), on_batch=found.extend).run()
+    # 通过链接再次到达的目录不重复扫描
+    assert sorted(path for path, _, _ in found) == sorted(paths)
+
+
+def test_cancel_stops_background_scan(tmp_path):
+    make_tree(tmp_path, folders=10, files_per_folder=50)
+    first_batch = threading.Event()
+    resume = threading.Event()
+    done = threading.Event()
+    batches = []
+
+    def on_batch(batch):
+        batches.append(list(batch))
+        first_batch.set()
+        resume.wait(10)
+
+    scanner = FolderScanner(str(tmp_path), on_batch=on_batch, on_done=lambda s: done.set(), batch_size=10)
+    scanner.start()
+    assert first_batch.wait(10)
+    scanner.cancel()
+    resume.set()
+    assert done.wait(10)
+
+    # 已交出的批次保留，取消后不再继续扫描
+    assert scanner.cancelled and not scanner.running
+    assert len(batches) <= 2
+    assert scanner.files_found < 500
+    assert scanner.finished_at is not None
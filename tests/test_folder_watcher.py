@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("watchdog")
+
+from file_registry import FileRegistry
+from folder_watcher import FolderWatcher
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_registry_converges_with_debounced_batches(tmp_path):
+    registry = FileRegistry()
+    watcher = FolderWatcher(registry, debounce=1.0, max_delay=5)
+    events = []
+    batches = []
+    queue, apply = watcher.queue, watcher.apply
+
+    def record_event(op, path):
+        events.append((op, path))
+        queue(op, path)
+
+    def record_batch(batch):
+        batches.append(dict(batch))
+        apply(batch)
+
+    watcher.queue, watcher.apply = record_event, record_batch
+    assert watcher.add_root(str(tmp_path))
+    try:
+        # 一连串写入、改名、删除和重复修改，间隔都小于 debounce
+        for i in range(20):
+            (tmp_path / f"{i:02d}.txt").write_bytes(b"x" * i)
+        os.rename(tmp_path / "00.txt", tmp_path / "renamed.txt")
+        os.remove(tmp_path / "01.txt")
+        for _ in range(5):
+            with open(tmp_path / "02.txt", "ab") as f:
+                f.write(b"more")
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "sub" / "nested.txt").write_bytes(b"nested")
+
+        expected = {str(tmp_path / f"{i:02d}.txt"): i for i in range(2, 20)}
+        expected[str(tmp_path / "02.txt")] = 2 + 5 * 4
+        expected[str(tmp_path / "renamed.txt")] = 0
+        expected[str(tmp_path / "sub" / "nested.txt")] = 6
+
+        def converged():
+            return {e["path"]: e["size_bytes"] for e in registry.snapshot()} == expected
+
+        assert wait_until(converged)
+        # 同一路径的多次事件合并，整串操作在一两个批次内应用
+        assert len(events) > len(expected)
+        assert 1 <= len(batches) <= 2
+        assert sum(len(batch) for batch in batches) < len(events)
+
+        # 删除后条目随之移除
+        os.remove(tmp_path / "renamed.txt")
+        del expected[str(tmp_path / "renamed.txt")]
+        assert wait_until(converged)
+    finally:
+        watcher.stop()
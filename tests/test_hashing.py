@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+from file_registry import FileRegistry
+from hashing import FileHasher
+
+
+@pytest.fixture
+def hasher_factory(tmp_path):
+    hashers = []
+
+    def create(registry):
+        hasher = FileHasher(registry, cache_path=str(tmp_path / "hashes.sqlite3"), flush_interval=0.01)
+        hashers.append(hasher)
+        return hasher
+
+    yield create
+    for hasher in hashers:
+        hasher.shutdown()
+        hasher.cache.close()
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def make_files(tmp_path):
+    paths = []
+    for name, content in (("a.txt", b"same"), ("b.txt", b"other"), ("c.txt", b"same")):
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def test_warm_start_reuses_restored_digests(tmp_path, hasher_factory, monkeypatch):
+    paths = make_files(tmp_path)
+    registry = FileRegistry()
+    hasher = hasher_factory(registry)
+    registry.add_paths(paths)
+    assert wait_until(lambda: all(e["hash"] for e in registry.snapshot()))
+    records = [(e["id"], e["path"], e["size_bytes"], e["mtime"], e["hash"]) for e in registry.snapshot()]
+
+    # 模拟下次启动：先订阅再恢复，与 ServerManager 的顺序相同
+    hashed = []
+    monkeypatch.setattr(FileHasher, "_hash_entry", lambda self, *args: hashed.append(args))
+    registry = FileRegistry()
+    hasher = hasher_factory(registry)
+    registry.restore(records)
+    assert wait_until(lambda: hasher.lookup(paths[0], os.stat(paths[0])) is not None)
+    assert hashed == []
+    first, second, third = registry.snapshot()
+    assert (first["duplicate_of"], second["duplicate_of"], third["duplicate_of"]) == (None, None, first["id"])
+    assert hasher.find(hasher.algorithm, first["hash"].partition(":")[2])["id"] == first["id"]
+
+    # 离线期间内容变化的文件与恢复的摘要不一致
+    with open(paths[1], "ab") as f:
+        f.write(b"changed")
+    assert hasher.lookup(paths[1], os.stat(paths[1])) is None
+
+
+def test_removed_entries_are_forgotten(tmp_path, hasher_factory):
+    paths = make_files(tmp_path)
+    registry = FileRegistry()
+    hasher = hasher_factory(registry)
+    registry.add_paths(paths)
+    assert wait_until(lambda: all(e["hash"] for e in registry.snapshot()))
+    registry.remove_paths(paths[:1])
+    assert wait_until(lambda: paths[0] not in hasher._known)
+    assert len(hasher._known) == 2
+    # 剩下的重复文件成为自己那一组的第一个
+    assert wait_until(lambda: registry.get_by_path(paths[2])["duplicate_of"] is None)
+
+
+def database_file(hasher):
+    return hasher.cache._conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def test_manager_hash_cache_follows_state_persistence(tmp_path, manager):
+    from server import ServerManager
+
+    # 不保存状态时摘要缓存也不写磁盘
+    assert database_file(manager.hasher) == ""
+
+    cache_path = tmp_path / "state" / "hashes.sqlite3"
+    persistent = ServerManager(state_path=str(tmp_path / "state" / "shares.sqlite3"), hash_cache_path=str(cache_path),
+                               upload_folder=str(tmp_path / "received"), preview_folder=str(tmp_path / "previews"))
+    try:
+        assert database_file(persistent.hasher) == str(cache_path)
+    finally:
+        persistent.close()
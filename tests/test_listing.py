@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+
+def wait_hashed(manager, timeout=10):
+    """等后台哈希写回摘要，之后注册表版本只随测试中的增删变化"""
+    deadline = time.monotonic() + timeout
+    while not all(e["hash"] for e in manager.registry.snapshot()):
+        assert time.monotonic() < deadline, "哈希超时"
+        time.sleep(0.01)
+
+
+def add(manager, folder, *names):
+    paths = []
+    for name in names:
+        path = folder / name
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    manager.registry.add_paths(paths)
+    wait_hashed(manager)
+
+
+def names(payload):
+    return [f["name"] for f in payload["files"]]
+
+
+@pytest.fixture
+def client(manager, tmp_path):
+    add(manager, tmp_path, *(f"file{i:02d}.txt" for i in range(10)))
+    return manager.flask_app.test_client()
+
+
+def test_listing_hides_local_paths(client):
+    payload = client.get("/api/files?limit=2").get_json()
+    assert payload["files"]
+    for entry in payload["files"]:
+        assert "path" not in entry
+        assert entry["url"].endswith("/" + entry["name"])
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_pagination(client, order):
+    seen = []
+    cursor = None
+    while True:
+        query = f"/api/files?limit=3&order={order}" + (f"&cursor={cursor}" if cursor else "")
+        payload = client.get(query).get_json()
+        assert payload["total"] == 10
+        assert payload["offset"] == len(seen)
+        seen += names(payload)
+        cursor = payload["next_cursor"]
+        if cursor is None:
+            break
+    expected = [f"file{i:02d}.txt" for i in range(10)]
+    assert seen == (expected if order == "asc" else expected[::-1])
+
+
+def test_invalid_listing_parameters(client):
+    assert client.get("/api/files?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/files?sort=color").status_code == 400
+    assert client.get("/api/files?order=up").status_code == 400
+    assert client.get("/api/files?limit=many").status_code == 400
+
+
+def test_listing_etag(client, manager, tmp_path):
+    first = client.get("/api/files")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+    response = client.get("/api/files", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    # 列表变化后 ETag 随之变化
+    add(manager, tmp_path, "new.txt")
+    response = client.get("/api/files", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert "new.txt" in names(response.get_json())
+
+
+def test_cursor_is_stable_across_registry_changes(client, manager, tmp_path):
+    first = client.get("/api/files?limit=4").get_json()
+    assert names(first) == ["file00.txt", "file01.txt", "file02.txt", "file03.txt"]
+
+    # 翻页之间：已看过的部分增删条目，游标之后也增删条目
+    manager.registry.remove_paths([str(tmp_path / "file01.txt"), str(tmp_path / "file05.txt")])
+    add(manager, tmp_path, "a-first.txt", "file04b.txt")
+
+    second = client.get(f"/api/files?limit=4&cursor={first['next_cursor']}").get_json()
+    # 从上一页最后一项之后继续，不重复也不跳过
+    assert names(second) == ["file04.txt", "file04b.txt", "file06.txt", "file07.txt"]
+    assert second["total"] == 10
@@ -0,0 +1,30 @@
+def share(manager, tmp_path):
+    path = tmp_path / "report.txt"
+    path.write_bytes(b"x" * 5000)
+    manager.registry.add_paths([str(path)])
+    entry = manager.registry.snapshot()[0]
+    client = manager.flask_app.test_client()
+    client.get(f"/files/{entry['id']}/report.txt", headers={"Accept-Encoding": "identity"}).close()
+    return str(path), entry, client
+
+
+def test_stats_do_not_expose_local_paths(manager, tmp_path):
+    path, entry, client = share(manager, tmp_path)
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert f'cpolarfilexfer_file_bytes_total{{id="{entry["id"]}",name="report.txt"}} 5000' in metrics
+    transfers = client.get("/api/transfers").get_json()
+    assert transfers[0]["id"] == str(entry["id"]) and transfers[0]["name"] == "report.txt"
+    assert path not in metrics and path not in str(transfers)
+
+
+def test_stats_are_local_only_by_default(manager, tmp_path):
+    _, _, client = share(manager, tmp_path)
+    tunnelled = {"X-Forwarded-For": "203.0.113.7"}
+    remote = {"REMOTE_ADDR": "192.168.1.20"}
+    for url in ("/metrics", "/api/transfers"):
+        assert client.get(url, headers=tunnelled).status_code == 403
+        assert client.get(url, environ_base=remote).status_code == 403
+    manager.public_stats = True
+    for url in ("/metrics", "/api/transfers"):
+        assert client.get(url, headers=tunnelled).status_code == 200
+        assert client.get(url, environ_base=remote).status_code == 200
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import threading
+
+import preview
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_preview_libraries_are_imported_on_first_use():
+    # 在新进程中检查，本进程可能已经导入过
+    code = "import sys, server; print(sorted({m.split('.')[0] for m in sys.modules} & {'PIL', 'pypdf'}))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_slow_preview_answers_202_then_content(manager, tmp_path, monkeypatch):
+    path = tmp_path / "notes.txt"
+    path.write_text("first line\nsecond line\n")
+    manager.registry.add_paths([str(path)])
+    url = f"/api/files/{manager.registry.snapshot()[0]['id']}/preview"
+    client = manager.flask_app.test_client()
+
+    release = threading.Event()
+    render = preview.render_preview
+
+    def slow_render(kind, file_path):
+        release.wait(5)
+        return render(kind, file_path)
+
+    monkeypatch.setattr(preview, "render_preview", slow_render)
+    manager.previews.wait = 0.05
+    pending = client.get(url)
+    assert pending.status_code == 202
+    assert pending.headers["Retry-After"] == str(preview.PREVIEW_RETRY_AFTER)
+    assert "ETag" not in pending.headers
+
+    release.set()
+    manager.previews.wait = 5
+    done = client.get(url)
+    assert done.status_code == 200
+    assert done.get_data(as_text=True) == "first line\nsecond line"
+
+    # 压缩后的响应带弱 ETag，浏览器用弱校验器重新验证时同样得到 304
+    etag = done.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": "W/" + etag}).status_code == 304
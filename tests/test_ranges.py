@@ -0,0 +1,172 @@
+import email.utils
+import os
+import socket
+import time
+
+import pytest
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def shared(manager, tmp_path):
+    """共享一个随机内容的文件，返回 (下载地址, 内容)"""
+    path = tmp_path / "data.bin"
+    data = os.urandom(3 * MB)
+    path.write_bytes(data)
+    manager.registry.add_paths([str(path)])
+    entry = manager.registry.get_by_path(str(path))
+    # 摘要算出后 ETag 会从文件属性变为内容摘要，等它稳定
+    deadline = time.monotonic() + 10
+    while manager.hasher.lookup(str(path), os.stat(path)) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return f"/files/{entry['id']}/{path.name}", data
+
+
+def parse_byteranges(content_type, body):
+    """解析 multipart/byteranges 响应体，返回 [(Content-Range, 数据)]"""
+    boundary = content_type.split("boundary=", 1)[1].encode("ascii")
+    parts = []
+    for part in body.split(b"\r\n--" + boundary)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, data = part.partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode("latin-1").split("\r\n") if ": " in line)
+        parts.append((headers["Content-Range"], data))
+    return parts
+
+
+def test_single_range(manager, shared):
+    url, data = shared
+    response = manager.flask_app.test_client().get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+    assert response.data == data[100:200]
+
+    # 后缀区间
+    response = manager.flask_app.test_client().get(url, headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.data == data[-10:]
+
+
+def test_multiple_ranges(manager, shared):
+    url, data = shared
+    response = manager.flask_app.test_client().get(url, headers={"Range": "bytes=0-9,1000-1099,-5"})
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    size = len(data)
+    assert parse_byteranges(response.headers["Content-Type"], response.data) == [
+        (f"bytes 0-9/{size}", data[:10]),
+        (f"bytes 1000-1099/{size}", data[1000:1100]),
+        (f"bytes {size - 5}-{size - 1}/{size}", data[-5:]),
+    ]
+
+
+def test_unsatisfiable_range(manager, shared):
+    url, data = shared
+    response = manager.flask_app.test_client().get(url, headers={"Range": f"bytes={len(data)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(data)}"
+    assert response.data == b""
+
+
+def test_invalid_range_is_ignored(manager, shared):
+    url, data = shared
+    response = manager.flask_app.test_client().get(url, headers={"Range": "lines=1-2"})
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def test_if_range(manager, shared):
+    url, data = shared
+    client = manager.flask_app.test_client()
+    head = client.head(url)
+    etag, last_modified = head.headers["ETag"], head.headers["Last-Modified"]
+
+    def fetch(if_range):
+        return client.get(url, headers={"Range": "bytes=0-9", "If-Range": if_range})
+
+    response = fetch(etag)
+    assert response.status_code == 206
+    assert response.data == data[:10]
+    assert fetch(last_modified).status_code == 206
+
+    # 版本不一致时返回整个文件
+    for stale in ('"other"', "W/" + etag):
+        response = fetch(stale)
+        assert response.status_code == 200
+        assert response.data == data
+    # 日期必须与 Last-Modified 完全相同，更晚的日期也不算
+    later = email.utils.parsedate_to_datetime(last_modified).timestamp() + 60
+    assert fetch(email.utils.formatdate(later, usegmt=True)).status_code == 200
+
+
+def test_not_modified(manager, shared):
+    url, _ = shared
+    client = manager.flask_app.test_client()
+    first = client.get(url)
+    etag = first.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    assert client.get(url, headers={"If-None-Match": "W/" + etag}).status_code == 304
+    response = client.get(url, headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 304
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def raw_get(port, url, headers):
+    """通过真实的 socket 发送请求，返回 (状态码, 响应头, 响应体)"""
+    lines = [f"GET {url} HTTP/1.1", "Host: test", "Accept-Encoding: identity", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        data = b""
+        while True:
+            chunk = sock.recv(MB)
+            if not chunk:
+                break
+            data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), response_headers, body
+
+
+@pytest.mark.parametrize("engine", ["waitress", "werkzeug", "asyncio"])
+def test_multiple_ranges_over_socket(manager, shared, free_port, engine):
+    # 区间大于 zero_copy_min_size，走各引擎自己的 mmap / sendfile 路径
+    url, data = shared
+    manager.engine = engine
+    manager.start(free_port)
+    try:
+        assert manager.ready.wait(5)
+        status, headers, body = raw_get(free_port, url, {"Range": f"bytes=0-{MB + 99},{2 * MB}-"})
+    finally:
+        manager.stop(drain_timeout=1)
+    size = len(data)
+    assert status == 206
+    assert int(headers["Content-Length"]) == len(body)
+    assert parse_byteranges(headers["Content-Type"], body) == [
+        (f"bytes 0-{MB + 99}/{size}", data[:MB + 100]),
+        (f"bytes {2 * MB}-{size - 1}/{size}", data[2 * MB:]),
+    ]
+
+
+def test_truncated_file_aborts_response(manager, shared):
+    from file_response import FileChanged, FileStream, TransferSettings
+
+    # 读取过程中文件变短时中止，不能静默地少发数据
+    url, data = shared
+    path = manager.registry.get(int(url.split("/")[2]))["path"]
+    stream = FileStream(path, [(b"", 0, len(data))], {}, TransferSettings(buffer_size=64 * 1024, use_mmap=False))
+    chunks = stream._generate_body()
+    next(chunks)
+    with open(path, "r+b") as f:
+        f.truncate(128 * 1024)
+    with pytest.raises(FileChanged):
+        for _ in chunks:
+            pass
@@ -0,0 +1,23 @@
+from file_registry import FileRegistry, RegistryDelta
+from share_store import ShareStore
+
+
+def test_stale_delta_does_not_overwrite_newer_entry(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"data")
+    db_path = str(tmp_path / "shares.sqlite3")
+    registry = FileRegistry()
+    store = ShareStore(registry, db_path=db_path, flush_interval=60)
+    store.load()
+
+    stale, = registry.add_paths([str(path)])
+    registry.update({stale["id"]: {"hash": "blake3:abc"}})
+    # 添加的通知在锁外发出，可能晚于后台哈希的更新到达
+    store.on_registry_change(RegistryDelta([stale], [], []))
+    store.close()
+
+    registry = FileRegistry()
+    store = ShareStore(registry, db_path=db_path, flush_interval=60)
+    restored, = store.load()
+    store.close()
+    assert (restored["id"], restored["hash"]) == (stale["id"], "blake3:abc")
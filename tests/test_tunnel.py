@@ -0,0 +1,174 @@
+import http.server
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+import tunnel
+from tunnel import TunnelSupervisor, cpolar_available, STATE_ONLINE, STATE_STOPPED
+from tunnel_log import TunnelLog
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="桩脚本依赖 shebang")
+
+# 模拟 cpolar：authtoken 子命令按环境变量延迟或失败；启动隧道时记录启动次数，
+# 输出公网地址后退出或一直运行
+STUB_CPOLAR = '''#!{python}
+import os, sys, time
+args = sys.argv[1:]
+if args[:1] == ["--version"]:
+    print("cpolar version stub")
+    sys.exit(0)
+if args[:1] == ["authtoken"]:
+    time.sleep(float(os.environ.get("STUB_AUTH_SLEEP", "0")))
+    sys.exit(int(os.environ.get("STUB_AUTH_EXIT", "0")))
+with open(os.environ["STUB_LAUNCHES"], "a") as f:
+    f.write("launch\\n")
+print("Tunnel Status  online", flush=True)
+print("Forwarding  " + os.environ["STUB_URL"] + " -> " + args[1], flush=True)
+if os.environ.get("STUB_EXIT"):
+    print("lvl=eror msg=\\"session closed\\"", flush=True)
+    sys.exit(1)
+while True:
+    time.sleep(1)
+'''
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    """把模拟的 cpolar 放到 PATH 最前面，返回读取启动次数的函数"""
+    folder = tmp_path / "bin"
+    folder.mkdir()
+    script = folder / "cpolar"
+    script.write_text(STUB_CPOLAR.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", str(folder) + os.pathsep + os.environ.get("PATH", ""))
+    launches = tmp_path / "launches"
+    monkeypatch.setenv("STUB_LAUNCHES", str(launches))
+    monkeypatch.setenv("STUB_URL", "http://127.0.0.1:9/")
+    monkeypatch.setattr(tunnel, "INITIAL_BACKOFF", 0.05)
+    monkeypatch.setattr(tunnel, "TERMINATE_TIMEOUT", 2.0)
+    return lambda: len(launches.read_text().splitlines()) if launches.exists() else 0
+
+
+@pytest.fixture
+def healthz_url():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == "/healthz" else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_cpolar_available(stub, tmp_path):
+    assert cpolar_available()
+    assert not cpolar_available(str(tmp_path / "missing"))
+
+
+def test_exited_tunnel_restarts_with_backoff(stub, monkeypatch):
+    monkeypatch.setenv("STUB_EXIT", "1")
+    supervisor = TunnelSupervisor(health_interval=60)
+    supervisor.start("127.0.0.1:5000")
+    try:
+        assert wait_until(lambda: stub() >= 4)
+        restarts = supervisor.tunnels[0].restarts
+        assert restarts >= 3
+    finally:
+        supervisor.stop()
+    # 退避时间逐次翻倍：0.05、0.1、0.2 ...
+    log = "\n".join(supervisor.log.lines())
+    delays = [float(line.split()[0]) for line in log.splitlines() if line.endswith("秒后重新启动")]
+    assert len(delays) >= 3 and delays[2] > delays[0]
+    assert supervisor.state == STATE_STOPPED and not supervisor.running
+
+
+def test_healthy_tunnel_stays_online(stub, monkeypatch, healthz_url):
+    monkeypatch.setenv("STUB_URL", healthz_url)
+    supervisor = TunnelSupervisor(health_interval=0.05)
+    supervisor.start("127.0.0.1:5000", count=2)
+    try:
+        assert wait_until(lambda: len(supervisor.urls()) == 2)
+        time.sleep(0.3)
+        assert stub() == 2
+        assert all(t.state == STATE_ONLINE and t.health_failures == 0 for t in supervisor.tunnels)
+        assert supervisor.next_url() == healthz_url
+    finally:
+        supervisor.stop()
+
+
+def test_failing_health_check_restarts_tunnel(stub):
+    # STUB_URL 指向没有服务的端口，健康检查连续失败后重启隧道
+    supervisor = TunnelSupervisor(health_interval=0.05)
+    supervisor.start("127.0.0.1:5000")
+    try:
+        assert wait_until(lambda: stub() >= 2)
+    finally:
+        supervisor.stop()
+    log = supervisor.log.lines()
+    assert any("健康检查失败（第 3 次）" in line for line in log)
+    assert any("公网地址不可用，重启隧道" in line for line in log)
+
+
+def test_restart_after_stop_times_out(stub, monkeypatch):
+    # 设置令牌一直没有返回，停止时等待超时；之后仍然可以重新启动
+    monkeypatch.setenv("STUB_AUTH_SLEEP", "1.5")
+    monkeypatch.setattr(tunnel, "TERMINATE_TIMEOUT", 0.1)
+    supervisor = TunnelSupervisor(health_interval=60)
+    supervisor.start("127.0.0.1:5000", authtoken="token")
+    time.sleep(0.2)
+    supervisor.stop()
+    assert not supervisor.running and supervisor.state == STATE_STOPPED
+
+    monkeypatch.setattr(tunnel, "TERMINATE_TIMEOUT", 2.0)
+    supervisor.start("127.0.0.1:5000")
+    try:
+        assert supervisor.running
+        assert wait_until(lambda: stub() == 1)
+        # 上一次启动的线程在令牌设置返回后不会再启动隧道
+        time.sleep(2)
+        assert stub() == 1
+    finally:
+        supervisor.stop()
+
+
+def test_log_cursor_pages_through_stub_output(stub, monkeypatch):
+    monkeypatch.setenv("STUB_EXIT", "1")
+    log = TunnelLog(max_lines=1000)
+    supervisor = TunnelSupervisor(log, health_interval=60)
+    cursor = None
+    seen = []
+    supervisor.start("127.0.0.1:5000")
+    try:
+        while len(seen) < 20 and wait_until(lambda: log.read_since(cursor)[0], 5):
+            lines, cursor, reset = log.read_since(cursor)
+            # 只有第一次读取需要整体重绘
+            assert reset == (not seen)
+            seen.extend(lines)
+    finally:
+        supervisor.stop()
+    lines, cursor, reset = log.read_since(cursor)
+    seen.extend(lines)
+    assert not reset
+    # 增量读取不重复也不遗漏
+    assert seen == log.lines()
+    assert any(line.startswith("Forwarding") for line in seen)
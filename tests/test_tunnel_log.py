@@ -0,0 +1,84 @@
+from tunnel_log import EVENT_CONNECTED, EVENT_ERROR, EVENT_URL, MAX_LINE_LENGTH, TunnelLog
+
+
+def test_read_since_returns_only_new_lines():
+    log = TunnelLog(max_lines=10)
+    lines, cursor, reset = log.read_since(None)
+    assert (lines, reset) == ([], True)
+
+    log.append("a\nb")
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["a", "b"], False)
+    # 没有新行时游标不变
+    assert log.read_since(cursor) == ([], cursor, False)
+
+    # 两次读取之间的多次写入按顺序一起返回
+    log.append("c")
+    log.append("d\ne")
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["c", "d", "e"], False)
+
+    # 旧游标可以重复使用，得到相同的结果
+    old = cursor
+    log.append("f")
+    assert log.read_since(old)[0] == ["f"]
+    assert log.read_since(old)[0] == ["f"]
+
+
+def test_cursor_falls_behind_after_eviction():
+    log = TunnelLog(max_lines=5)
+    log.append("a\nb")
+    lines, cursor, reset = log.read_since(None)
+    assert (lines, reset) == (["a", "b"], True)
+
+    # 新行恰好填满缓冲时仍能增量读取
+    log.append("\n".join(str(i) for i in range(5)))
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["0", "1", "2", "3", "4"], False)
+
+    # 多出一行时最早的新行已被覆盖，返回全部保留的行并要求重绘
+    log.append("\n".join(str(i) for i in range(5, 11)))
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["6", "7", "8", "9", "10"], True)
+    # 重绘后的游标继续增量读取
+    log.append("11")
+    assert log.read_since(cursor)[:1] == (["11"],)
+
+
+def test_shrinking_buffer_and_clear_reset_the_reader():
+    log = TunnelLog(max_lines=10)
+    _, cursor, _ = log.read_since(None)
+    log.append("\n".join("abcdef"))
+    log.set_max_lines(3)
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["d", "e", "f"], True)
+
+    log.clear()
+    assert log.lines() == []
+    log.append("x")
+    lines, cursor, reset = log.read_since(cursor)
+    assert (lines, reset) == (["x"], True)
+
+
+def test_lines_are_cleaned_and_parsed():
+    log = TunnelLog()
+    events = []
+    # 回调在锁外执行，可以读取日志
+    log.subscribe(lambda event: events.append((event, log.lines()[-1])))
+    log.append("\x1b[32mTunnel Status  online\x1b[0m\n\n   \n"
+               "Forwarding  https://demo.cpolar.top -> 127.0.0.1:5000\n"
+               "t=1 lvl=eror msg=\"session closed\"\n"
+               + "x" * (MAX_LINE_LENGTH + 10))
+
+    lines = log.lines()
+    assert lines[0] == "Tunnel Status  online"
+    assert len(lines) == 4
+    assert lines[-1] == "x" * MAX_LINE_LENGTH + " ..."
+    assert [event.kind for event, _ in events] == [EVENT_CONNECTED, EVENT_URL, EVENT_ERROR]
+    assert log.public_url == "https://demo.cpolar.top"
+    assert list(log.events) == [event for event, _ in events]
+    # 回调在整批写入之后才被调用
+    assert all(last == lines[-1] for _, last in events)
+
+    log.clear()
+    assert log.public_url == ""
@@ -0,0 +1,137 @@
+import base64
+import http.client
+import os
+import resource
+import shutil
+
+import pytest
+
+from uploads import UploadError
+
+
+def create(client, length, chunk_size=4, name="a.bin"):
+    return client.post("/api/uploads", headers={
+        "Upload-Length": str(length),
+        "Upload-Chunk-Size": str(chunk_size),
+        "Upload-Metadata": "filename " + base64.b64encode(name.encode()).decode(),
+    })
+
+
+def patch(client, location, offset, data):
+    return client.patch(location, data=data, headers={"Upload-Offset": str(offset)})
+
+
+def test_uploads_disabled_by_default(manager):
+    client = manager.flask_app.test_client()
+    assert create(client, 10).status_code == 403
+    assert b'id="uploadInput"' not in client.get("/").data
+
+
+def test_upload_size_limit(manager):
+    manager.uploads.enabled = True
+    client = manager.flask_app.test_client()
+    manager.uploads.max_upload_size = 100
+    assert create(client, 101).status_code == 413
+    assert create(client, 100).status_code == 201
+
+
+def test_upload_rejected_when_disk_is_too_small(manager):
+    manager.uploads.enabled = True
+    manager.uploads.max_upload_size = None
+    response = create(manager.flask_app.test_client(), 1 << 60)
+    assert response.status_code == 507
+
+
+def test_finished_upload_reports_full_offset(manager, tmp_path):
+    manager.uploads.enabled = True
+    client = manager.flask_app.test_client()
+    location = create(client, 10).headers["Location"]
+    for offset in (8, 0, 4):
+        assert patch(client, location, offset, b"0123456789"[offset:offset + 4]).status_code == 204
+    assert (tmp_path / "received" / "a.bin").read_bytes() == b"0123456789"
+
+    # 客户端不知道最后一个分块已成功时，续传查询到的是已完成
+    response = client.head(location)
+    assert response.status_code == 200
+    assert response.headers["Upload-Offset"] == response.headers["Upload-Length"] == "10"
+    assert client.get(location).get_json()["complete"] is True
+    assert patch(client, location, 8, b"89").status_code == 409
+
+
+def test_chunk_racing_cancel_is_not_a_server_error(manager):
+    manager.uploads.enabled = True
+    client = manager.flask_app.test_client()
+    location = create(client, 8).headers["Location"]
+    upload = manager.uploads.get(location.rsplit("/", 1)[1])
+    manager.uploads.cancel(upload.id)
+    with pytest.raises(UploadError) as error:
+        manager.uploads.write_chunk(upload, 0, None, 4)
+    assert error.value.status == 404
+    assert patch(client, location, 0, b"0123").status_code == 404
+
+
+def test_chunk_racing_finish_is_a_conflict(manager, monkeypatch):
+    manager.uploads.enabled = True
+    client = manager.flask_app.test_client()
+    location = create(client, 4).headers["Location"]
+    upload = manager.uploads.get(location.rsplit("/", 1)[1])
+    assert patch(client, location, 0, b"0123").status_code == 204
+
+    # 重现交错：请求通过了 finished 检查之后，另一个请求才完成上传并移走 .part
+    upload.finished = False
+    part_path = manager.uploads._part_path
+
+    def finish_then_locate(upload_id):
+        upload.finished = True
+        return part_path(upload_id)
+
+    monkeypatch.setattr(manager.uploads, "_part_path", finish_then_locate)
+    with pytest.raises(UploadError) as error:
+        manager.uploads.write_chunk(upload, 0, None, 4)
+    assert error.value.status == 409
+
+
+MEMORY_TEST_SIZE = 5 * 1024 * 1024 * 1024
+MEMORY_TEST_CHUNK = 64 * 1024 * 1024
+# 上传 5GB 期间进程峰值内存允许增长的上限
+MEMORY_CEILING = 128 * 1024 * 1024
+
+
+@pytest.mark.skipif(shutil.disk_usage(os.path.expanduser("~")).free < 3 * MEMORY_TEST_SIZE,
+                    reason="磁盘空间不足以做 5GB 上传测试")
+def test_5gb_upload_memory_ceiling(manager, free_port, tmp_path):
+    """通过真实的服务器上传 5GB，进程峰值内存不随文件大小增长"""
+    manager.uploads.enabled = True
+    manager.uploads.max_upload_size = None
+    manager.start(free_port)
+    assert manager.ready.wait(5)
+    block = os.urandom(1024 * 1024)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    conn = http.client.HTTPConnection("127.0.0.1", free_port, timeout=60)
+    conn.request("POST", "/api/uploads", headers={
+        "Upload-Length": str(MEMORY_TEST_SIZE),
+        "Upload-Chunk-Size": str(MEMORY_TEST_CHUNK),
+        "Upload-Metadata": "filename " + base64.b64encode(b"big.bin").decode(),
+    })
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 201
+    location = response.getheader("Location")
+
+    for offset in range(0, MEMORY_TEST_SIZE, MEMORY_TEST_CHUNK):
+        conn.putrequest("PATCH", location)
+        conn.putheader("Content-Length", str(MEMORY_TEST_CHUNK))
+        conn.putheader("Upload-Offset", str(offset))
+        conn.endheaders()
+        for _ in range(MEMORY_TEST_CHUNK // len(block)):
+            conn.send(block)
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 204
+    conn.close()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    received = tmp_path / "received" / "big.bin"
+    assert received.stat().st_size == MEMORY_TEST_SIZE
+    assert peak - baseline < MEMORY_CEILING
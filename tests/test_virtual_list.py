@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+pytest.importorskip("tkinter")
+
+import virtual_list
+from file_registry import FileRegistry, RegistryDelta
+from virtual_list import SORT_KEYS, VirtualFileList, sort_entries
+
+
+def test_chunked_sort_is_stable(monkeypatch):
+    monkeypatch.setattr(virtual_list, "SORT_CHUNK", 7)
+    rng = random.Random(1)
+    entries = [{"id": i, "size_bytes": rng.randrange(5)} for i in range(100)]
+    result = sort_entries(entries, SORT_KEYS["size"])
+    assert result == sorted(entries, key=SORT_KEYS["size"])
+    # 大小相同时保持原来的顺序
+    assert [e["id"] for e in result if e["size_bytes"] == 0] == sorted(e["id"] for e in result if e["size_bytes"] == 0)
+
+
+def test_merge_delta_tolerates_overlapping_and_stale_deltas(tmp_path):
+    registry = FileRegistry()
+    first, second = registry.add_stats([(str(tmp_path / "b.txt"), 2, 1.0), (str(tmp_path / "a.txt"), 1, 1.0)])
+    # 只用到注册表，不创建窗口
+    file_list = VirtualFileList.__new__(VirtualFileList)
+    file_list.registry = registry
+    sort_key = SORT_KEYS["name"]
+    view = sort_entries(registry.snapshot(), sort_key)
+
+    # 已包含在快照中的新增不会重复插入
+    view = file_list._merge_delta(view, RegistryDelta([first, second], [], []), sort_key)
+    assert [e["id"] for e in view] == [second["id"], first["id"]]
+
+    # 晚于哈希更新到达的旧通知使用注册表中的当前条目
+    updated, = registry.update({first["id"]: {"hash": "blake3:abc"}})
+    view = file_list._merge_delta(view, RegistryDelta([], [], [updated]), sort_key)
+    view = file_list._merge_delta(view, RegistryDelta([first], [], []), sort_key)
+    assert view[1]["hash"] == "blake3:abc"
+
+    # 已经移除的条目不会因迟到的新增通知重新出现
+    removed, = registry.add_stats([(str(tmp_path / "c.txt"), 3, 1.0)])
+    registry.remove([removed["id"]])
+    view = file_list._merge_delta(view, RegistryDelta([], [removed], []), sort_key)
+    view = file_list._merge_delta(view, RegistryDelta([removed], [], []), sort_key)
+    assert [e["id"] for e in view] == [second["id"], first["id"]]
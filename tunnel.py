@@ -0,0 +1,328 @@
+import itertools
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from tunnel_log import TunnelLog, parse_line, EVENT_URL, EVENT_CONNECTED, EVENT_RECONNECT
+
+# 隧道状态
+STATE_STOPPED = "stopped"
+STATE_STARTING = "starting"
+STATE_ONLINE = "online"
+STATE_RECONNECTING = "reconnecting"
+STATE_BACKOFF = "backoff"
+STATE_ERROR = "error"
+
+# 进程退出后重新启动的退避时间（秒），每次翻倍，带随机抖动
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+BACKOFF_JITTER = 0.2
+# 进程持续运行超过该秒数后，退避时间重置
+STABLE_RUN_SECONDS = 60.0
+
+# 公网地址的健康检查
+HEALTH_CHECK_PATH = "/healthz"
+HEALTH_CHECK_INTERVAL = 30.0
+HEALTH_CHECK_TIMEOUT = 10.0
+# 连续失败多少次后重启隧道
+HEALTH_FAILURES_BEFORE_RESTART = 3
+
+# 停止时等待进程退出的秒数，超时后强制结束
+TERMINATE_TIMEOUT = 5.0
+
+
+def cpolar_available(executable="cpolar"):
+    """检查 cpolar 是否已安装"""
+    try:
+        result = subprocess.run([executable, "--version"], capture_output=True, timeout=10)
+        return result.returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def decode_output(line):
+    """解码 cpolar 输出，非 UTF-8 时使用系统默认编码"""
+    try:
+        return line.decode("utf-8")
+    except UnicodeDecodeError:
+        return line.decode(sys.getdefaultencoding(), errors="replace")
+
+
+class Tunnel:
+    """受监督的一个 cpolar 进程，退出后按退避时间自动重新启动"""
+
+    def __init__(self, supervisor, index, command, stop_event):
+        self.supervisor = supervisor
+        self.index = index
+        self.command = command
+        self.stop_event = stop_event
+        self.state = STATE_STOPPED
+        self.public_url = ""
+        self.healthy = False
+        self.health_failures = 0
+        self.restarts = 0
+        self.process = None
+        self.thread = None
+
+    @property
+    def available(self):
+        """是否可以分发给接收方"""
+        return self.state == STATE_ONLINE and self.healthy and bool(self.public_url)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        stop_event = self.stop_event
+        backoff = INITIAL_BACKOFF
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.set_state(STATE_STARTING)
+            try:
+                self.process = subprocess.Popen(
+                    self.command,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT
+                )
+            except OSError as e:
+                self.write(f"启动cpolar失败: {e}")
+            else:
+                if stop_event.is_set():
+                    # 启动进程时恰好被停止
+                    self.terminate()
+                self.read_output(self.process)
+                code = self.process.wait()
+                self.write(f"cpolar进程已退出，返回码 {code}")
+
+            self.public_url = ""
+            self.healthy = False
+            if stop_event.is_set():
+                break
+            if time.monotonic() - started >= STABLE_RUN_SECONDS:
+                backoff = INITIAL_BACKOFF
+            delay = backoff * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            self.restarts += 1
+            self.set_state(STATE_BACKOFF)
+            self.write(f"{delay:.1f} 秒后重新启动")
+            if stop_event.wait(delay):
+                break
+        self.set_state(STATE_STOPPED)
+
+    def read_output(self, process):
+        """读取进程输出直到退出，解析公网地址和重连事件"""
+        for raw in iter(process.stdout.readline, b""):
+            line = decode_output(raw)
+            self.write(line)
+            event = parse_line(line)
+            if event is None:
+                continue
+            if event.kind == EVENT_URL:
+                self.public_url = event.url
+                self.healthy = True
+                self.health_failures = 0
+                self.set_state(STATE_ONLINE)
+            elif event.kind == EVENT_RECONNECT:
+                self.set_state(STATE_RECONNECTING)
+            elif event.kind == EVENT_CONNECTED and self.public_url:
+                self.set_state(STATE_ONLINE)
+        process.stdout.close()
+
+    def restart(self):
+        """结束当前进程，由监督线程重新启动"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def terminate(self):
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(TERMINATE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.supervisor.notify()
+
+    def write(self, text):
+        self.supervisor.write(self, text)
+
+    def status(self):
+        return {
+            "index": self.index,
+            "state": self.state,
+            "url": self.public_url,
+            "healthy": self.healthy,
+            "restarts": self.restarts,
+        }
+
+
+class TunnelSupervisor:
+    """管理一个或多个 cpolar 隧道
+
+    每个隧道一个监督线程：进程退出后按指数退避自动重启；健康检查线程定期
+    通过公网地址请求本服务的 /healthz，连续失败时重启对应的隧道。多个隧道
+    并行运行时，next_url() 在健康的公网地址间轮询分发，把接收方分散到不同
+    隧道上以叠加带宽。所有 cpolar 命令（包括设置认证令牌）都在后台线程中
+    执行，不阻塞界面。
+    """
+
+    def __init__(self, log=None, executable="cpolar", health_path=HEALTH_CHECK_PATH,
+                 health_interval=HEALTH_CHECK_INTERVAL):
+        self.log = log if log is not None else TunnelLog()
+        self.executable = executable
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.tunnels = []
+        self.state = STATE_STOPPED
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._round_robin = itertools.count()
+        self._listeners = []
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, listener):
+        """订阅状态变化，listener() 在后台线程中被调用"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """取消订阅"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def start(self, local_addr, protocol="http", count=1, authtoken=None):
+        """启动 count 个隧道（立即返回）"""
+        if self.running:
+            return
+        # 每次启动使用新的停止事件：上次停止时等待超时、仍未退出的线程只看到
+        # 自己的事件，不会因为重新启动而继续运行
+        stop_event = self.stop_event = threading.Event()
+        command = [self.executable, protocol, local_addr]
+        tunnels = [Tunnel(self, i, command, stop_event) for i in range(max(1, count))]
+        with self._lock:
+            self.tunnels = tunnels
+        self.state = STATE_STARTING
+        self._thread = threading.Thread(target=self._run, args=(authtoken, tunnels, stop_event), daemon=True)
+        self._thread.start()
+        self.notify()
+
+    def stop(self):
+        """停止所有隧道并等待进程退出
+
+        等待超时（如设置令牌或健康检查的请求还没返回）的线程已收到停止事件，
+        会自行结束；不再等待它们，停止后总可以重新启动。
+        """
+        self.stop_event.set()
+        with self._lock:
+            tunnels = list(self.tunnels)
+        for tunnel in tunnels:
+            tunnel.terminate()
+        for tunnel in tunnels:
+            if tunnel.thread is not None:
+                tunnel.thread.join(TERMINATE_TIMEOUT)
+        if self._thread is not None:
+            self._thread.join(TERMINATE_TIMEOUT)
+        with self._lock:
+            self._thread = None
+            self.tunnels = []
+        self.state = STATE_STOPPED
+        self.notify()
+
+    def _run(self, authtoken, tunnels, stop_event):
+        if authtoken and not self.configure_authtoken(authtoken):
+            if not stop_event.is_set():
+                self.state = STATE_ERROR
+                self.notify()
+            return
+        if stop_event.is_set():
+            return
+        for tunnel in tunnels:
+            tunnel.start()
+        self.state = STATE_ONLINE
+        self.notify()
+        while not stop_event.wait(self.health_interval):
+            self.check_health(tunnels)
+
+    def configure_authtoken(self, authtoken):
+        """设置 cpolar 认证令牌，失败时写入日志并返回 False"""
+        try:
+            subprocess.run([self.executable, "authtoken", authtoken], check=True,
+                           capture_output=True, timeout=30)
+            return True
+        except subprocess.CalledProcessError as e:
+            self.log.append(f"cpolar配置失败: {decode_output(e.stderr or b'')}")
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.log.append(f"cpolar配置失败: {e}")
+        return False
+
+    def check_health(self, tunnels=None):
+        """通过公网地址检查每个在线隧道，连续失败的隧道被重启"""
+        for tunnel in list(self.tunnels if tunnels is None else tunnels):
+            url = tunnel.public_url
+            if tunnel.state != STATE_ONLINE or not url.startswith(("http://", "https://")):
+                continue
+            healthy = self.probe(url.rstrip("/") + self.health_path)
+            if healthy:
+                tunnel.health_failures = 0
+            else:
+                tunnel.health_failures += 1
+                self.write(tunnel, f"健康检查失败（第 {tunnel.health_failures} 次）: {url}")
+            if healthy != tunnel.healthy:
+                tunnel.healthy = healthy
+                self.notify()
+            if tunnel.health_failures >= HEALTH_FAILURES_BEFORE_RESTART:
+                tunnel.health_failures = 0
+                self.write(tunnel, "公网地址不可用，重启隧道")
+                tunnel.restart()
+
+    def probe(self, url):
+        try:
+            with urllib.request.urlopen(url, timeout=HEALTH_CHECK_TIMEOUT) as response:
+                return 200 <= response.status < 300
+        except Exception:
+            return False
+
+    def urls(self):
+        """可用的公网地址"""
+        return [t.public_url for t in list(self.tunnels) if t.available]
+
+    def next_url(self):
+        """轮询分发一个可用的公网地址，没有时返回空字符串"""
+        urls = self.urls()
+        if not urls:
+            return ""
+        return urls[next(self._round_robin) % len(urls)]
+
+    def status(self):
+        return [t.status() for t in list(self.tunnels)]
+
+    def write(self, tunnel, text):
+        """写入共用的日志，多个隧道时加上编号前缀"""
+        if len(self.tunnels) > 1:
+            text = "\n".join(f"[{tunnel.index + 1}] {line}" for line in text.splitlines())
+        self.log.append(text)
+
+    def notify(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"隧道状态回调错误: {e}")
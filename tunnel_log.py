@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from itertools import islice
+
+# 默认保留的日志行数
+DEFAULT_MAX_LINES = 2000
+# 单行最大长度，超出部分截断，避免异常输出撑大缓冲
+MAX_LINE_LENGTH = 4096
+# 保留的最近事件数
+MAX_EVENTS = 200
+
+# 事件类型
+EVENT_URL = "url"
+EVENT_CONNECTED = "connected"
+EVENT_RECONNECT = "reconnect"
+EVENT_ERROR = "error"
+
+# 一条从日志中解析出的事件：类型、时间戳、原始行、公网地址（仅 url 事件）
+TunnelEvent = namedtuple("TunnelEvent", ["kind", "time", "line", "url"])
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+# 控制台界面的 "Forwarding  https://xxx -> ..." 和日志格式的 url=...
+_URL_PATTERN = re.compile(r"(?:Forwarding\s+|\burl=)\"?((?:https?|tcp|tls)://[^\s\"]+)")
+_CONNECTED_PATTERN = re.compile(r"Tunnel Status\s+online|session (?:started|established)|started tunnel", re.I)
+_RECONNECT_PATTERN = re.compile(r"reconnect", re.I)
+_ERROR_PATTERN = re.compile(r"lvl=(?:eror|crit)|\berror\b|\bfailed\b", re.I)
+
+
+def parse_line(line, now=None):
+    """把一行日志解析为事件，无关的行返回 None"""
+    now = time.time() if now is None else now
+    match = _URL_PATTERN.search(line)
+    if match:
+        return TunnelEvent(EVENT_URL, now, line, match.group(1))
+    if _RECONNECT_PATTERN.search(line):
+        return TunnelEvent(EVENT_RECONNECT, now, line, None)
+    if _CONNECTED_PATTERN.search(line):
+        return TunnelEvent(EVENT_CONNECTED, now, line, None)
+    if _ERROR_PATTERN.search(line):
+        return TunnelEvent(EVENT_ERROR, now, line, None)
+    return None
+
+
+class TunnelLog:
+    """cpolar 输出的环形缓冲
+
+    读取线程调用 append() 写入，只保留最近 max_lines 行；界面按固定频率调用
+    read_since() 批量取出新行，不再为每行调度一次界面回调。日志行同时被解析
+    为结构化事件，订阅者 listener(event) 在读取线程中、锁外被调用。
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=max_lines)
+        # 累计写入的行数和清空次数，组成读取游标
+        self._total = 0
+        self._generation = 0
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.public_url = ""
+        self._listeners = []
+
+    @property
+    def max_lines(self):
+        return self._lines.maxlen
+
+    def set_max_lines(self, max_lines):
+        """调整保留行数，缩小时丢弃最早的行"""
+        with self._lock:
+            self._lines = deque(self._lines, maxlen=max(1, max_lines))
+
+    def subscribe(self, listener):
+        """订阅事件"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """取消订阅"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def append(self, text):
+        """写入一行或多行输出"""
+        events = []
+        with self._lock:
+            for line in text.splitlines():
+                line = _ANSI_ESCAPE.sub("", line).rstrip()
+                if not line:
+                    continue
+                if len(line) > MAX_LINE_LENGTH:
+                    line = line[:MAX_LINE_LENGTH] + " ..."
+                self._lines.append(line)
+                self._total += 1
+                event = parse_line(line)
+                if event is not None:
+                    if event.kind == EVENT_URL:
+                        self.public_url = event.url
+                    self.events.append(event)
+                    events.append(event)
+            listeners = list(self._listeners) if events else []
+        for event in events:
+            for listener in listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    print(f"隧道事件回调错误: {e}")
+
+    def clear(self):
+        """清空日志（如重新启动隧道时）"""
+        with self._lock:
+            self._lines.clear()
+            self._generation += 1
+            self.public_url = ""
+
+    def lines(self):
+        """当前缓冲中的所有行"""
+        with self._lock:
+            return list(self._lines)
+
+    def read_since(self, cursor=None):
+        """取出游标之后的新行，返回 (新行, 新游标, 是否需要整体重绘)
+
+        读取方落后太多（新行已被环形缓冲覆盖）或日志被清空时返回缓冲中的
+        全部行并要求重绘。
+        """
+        with self._lock:
+            new_cursor = (self._generation, self._total)
+            if cursor is not None and cursor[0] == self._generation:
+                count = self._total - cursor[1]
+                if count <= len(self._lines):
+                    return list(islice(self._lines, len(self._lines) - count, None)), new_cursor, False
+            return list(self._lines), new_cursor, True
@@ -0,0 +1,300 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# 默认分块大小，客户端可在创建上传时协商
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 从请求体读取数据的块大小
+STREAM_BLOCK_SIZE = 64 * 1024
+# 单个上传的默认大小上限；接收方可以通过公网地址访问，不能不设上限
+DEFAULT_MAX_UPLOAD_SIZE = 4 * 1024 * 1024 * 1024
+# 创建上传后接收目录至少保留的剩余空间
+MIN_FREE_SPACE = 256 * 1024 * 1024
+# 已完成上传的状态保留的秒数，期间查询进度仍返回 Upload-Offset == Upload-Length
+FINISHED_STATE_TTL = 24 * 3600
+
+# Upload-Checksum 支持的算法（tus 约定的名称）
+CHECKSUM_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+}
+
+
+class UploadError(Exception):
+    """上传请求错误，带有应答的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def safe_file_name(name):
+    """去掉路径和控制字符，得到可以落盘的文件名"""
+    name = os.path.basename((name or "").replace("\\", "/"))
+    name = "".join(ch for ch in name if ch >= " " and ch not in '<>:"|?*')
+    name = name.strip(" .")
+    return name or "upload"
+
+
+def parse_metadata(header):
+    """解析 tus 格式的 Upload-Metadata：逗号分隔的 "键 base64值" """
+    metadata = {}
+    for item in (header or "").split(","):
+        key, _, value = item.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except (ValueError, UnicodeDecodeError):
+            raise UploadError("Upload-Metadata 格式错误")
+    return metadata
+
+
+class Upload:
+    """一次分块上传的状态，持久化为 JSON 以便重启后继续"""
+
+    def __init__(self, upload_id, file_name, length, chunk_size, received=None, finished=False):
+        self.id = upload_id
+        self.file_name = file_name
+        self.length = length
+        self.chunk_size = chunk_size
+        self.received = set(received or ())
+        # 已移动到接收目录 / 已被终止
+        self.finished = finished
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    @property
+    def chunk_count(self):
+        return max(1, (self.length + self.chunk_size - 1) // self.chunk_size)
+
+    @property
+    def complete(self):
+        return len(self.received) >= self.chunk_count
+
+    @property
+    def offset(self):
+        """从头开始连续收到的字节数"""
+        index = 0
+        while index in self.received:
+            index += 1
+        return min(index * self.chunk_size, self.length)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.length - index * self.chunk_size)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "file_name": self.file_name,
+            "length": self.length,
+            "chunk_size": self.chunk_size,
+            "received": sorted(self.received),
+            "finished": self.finished,
+        }
+
+
+class UploadManager:
+    """管理分块、可续传的上传
+
+    每个上传预先创建同长度的 .part 文件，各分块可以并行写入各自的位置；
+    请求体按块流式写盘并计算校验和，内存占用与文件大小无关。
+    默认不接收上传（enabled 为 False），单个上传不能超过 max_upload_size
+    （None 表示不限），也不能用完接收目录所在磁盘的剩余空间。
+    """
+
+    def __init__(self, upload_folder, max_upload_size=DEFAULT_MAX_UPLOAD_SIZE, on_complete=None, enabled=False):
+        self.upload_folder = upload_folder
+        self.max_upload_size = max_upload_size
+        self.on_complete = on_complete
+        self.enabled = enabled
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def state_folder(self):
+        return os.path.join(self.upload_folder, ".uploads")
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.state_folder, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.state_folder, f"{upload_id}.part")
+
+    def _save_state(self, upload):
+        tmp_path = self._state_path(upload.id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(upload.to_dict(), f)
+        os.replace(tmp_path, self._state_path(upload.id))
+
+    def create(self, length, file_name, chunk_size=None):
+        """创建上传，返回 Upload"""
+        if length < 0:
+            raise UploadError("Upload-Length 无效")
+        if self.max_upload_size is not None and length > self.max_upload_size:
+            raise UploadError("文件过大", 413)
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError("分块大小无效")
+
+        os.makedirs(self.state_folder, exist_ok=True)
+        self._prune_finished()
+        # .part 是稀疏文件，创建时不占空间，按已登记的长度预留
+        with self._lock:
+            reserved = sum(max(0, u.length - len(u.received) * u.chunk_size)
+                           for u in self._uploads.values() if not u.finished)
+        if length + reserved + MIN_FREE_SPACE > shutil.disk_usage(self.state_folder).free:
+            raise UploadError("接收目录所在磁盘空间不足", 507)
+        upload = Upload(uuid.uuid4().hex, safe_file_name(file_name), length, chunk_size)
+        with open(self._part_path(upload.id), "wb") as f:
+            f.truncate(length)
+        self._save_state(upload)
+        with self._lock:
+            self._uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id):
+        """获取上传状态，内存中没有时从磁盘恢复"""
+        if not upload_id.isalnum():
+            return None
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                return upload
+            try:
+                with open(self._state_path(upload_id), encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                return None
+            upload = Upload(state["id"], state["file_name"], state["length"],
+                            state["chunk_size"], state["received"], state.get("finished", False))
+            self._uploads[upload_id] = upload
+            return upload
+
+    def write_chunk(self, upload, offset, stream, content_length, checksum=None):
+        """把一个分块的请求体流式写入对应位置，返回上传是否已完成"""
+        if upload.finished:
+            raise UploadError("上传已完成", 409)
+        if offset % upload.chunk_size:
+            raise UploadError("Upload-Offset 必须是分块边界", 409)
+        index = offset // upload.chunk_size
+        if offset >= upload.length and upload.length > 0:
+            raise UploadError("Upload-Offset 超出文件长度", 409)
+        if content_length != upload.chunk_length(index):
+            raise UploadError("分块长度不正确")
+
+        digest = None
+        expected = None
+        if checksum:
+            algorithm, _, value = checksum.partition(" ")
+            factory = CHECKSUM_ALGORITHMS.get(algorithm.lower())
+            if factory is None:
+                raise UploadError("不支持的校验算法")
+            try:
+                expected = base64.b64decode(value)
+            except ValueError:
+                raise UploadError("Upload-Checksum 格式错误")
+            digest = factory()
+
+        written = 0
+        try:
+            f = open(self._part_path(upload.id), "r+b")
+        except FileNotFoundError:
+            # 与最后一个分块的完成或终止上传同时发生
+            if upload.finished:
+                raise UploadError("上传已完成", 409)
+            raise UploadError("上传不存在", 404)
+        with f:
+            f.seek(offset)
+            while written < content_length:
+                block = stream.read(min(STREAM_BLOCK_SIZE, content_length - written))
+                if not block:
+                    break
+                f.write(block)
+                if digest is not None:
+                    digest.update(block)
+                written += len(block)
+
+        if written != content_length:
+            raise UploadError("请求体不完整", 400)
+        if digest is not None and digest.digest() != expected:
+            # tus 约定的校验失败状态码
+            raise UploadError("分块校验失败", 460)
+
+        with upload.lock:
+            if upload.cancelled:
+                raise UploadError("上传不存在", 404)
+            if index in upload.received:
+                return upload.complete
+            upload.received.add(index)
+            if upload.complete:
+                self._finish(upload)
+                return True
+            self._save_state(upload)
+        return False
+
+    def _finish(self, upload):
+        """所有分块到齐：移动到接收目录并清理状态"""
+        stem, ext = os.path.splitext(upload.file_name)
+        target = os.path.join(self.upload_folder, upload.file_name)
+        counter = 1
+        while os.path.exists(target):
+            target = os.path.join(self.upload_folder, f"{stem} ({counter}){ext}")
+            counter += 1
+        os.replace(self._part_path(upload.id), target)
+        # 保留状态，客户端续传时查询到的是已完成
+        upload.finished = True
+        self._save_state(upload)
+        if self.on_complete:
+            self.on_complete(target)
+
+    def cancel(self, upload_id):
+        """终止上传并删除已接收的数据"""
+        upload = self.get(upload_id)
+        if upload is None:
+            return False
+        with upload.lock:
+            upload.cancelled = True
+            if not upload.finished:
+                try:
+                    os.remove(self._part_path(upload_id))
+                except OSError:
+                    pass
+            self._remove_state(upload_id)
+        return True
+
+    def _prune_finished(self):
+        """删除过期的已完成上传的状态"""
+        deadline = time.time() - FINISHED_STATE_TTL
+        try:
+            names = os.listdir(self.state_folder)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.state_folder, name)
+            try:
+                if os.path.getmtime(path) >= deadline:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    finished = json.load(f).get("finished", False)
+            except (OSError, ValueError):
+                continue
+            if finished:
+                self._remove_state(name[:-len(".json")])
+
+    def _remove_state(self, upload_id):
+        try:
+            os.remove(self._state_path(upload_id))
+        except OSError:
+            pass
+        with self._lock:
+            self._uploads.pop(upload_id, None)
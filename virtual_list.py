@@ -0,0 +1,501 @@
+import heapq
+import operator
+import re
+import threading
+import time
+import tkinter as tk
+from datetime import datetime
+from tkinter import ttk
+
+# 排序字段：大小和修改时间按数值排序，相同时保持注册表顺序（降序时相反）
+SORT_KEYS = {
+    "name": lambda e: e["name"].lower(),
+    "size": operator.itemgetter("size_bytes"),
+    "mtime": operator.itemgetter("mtime"),
+    "path": operator.itemgetter("path"),
+}
+
+# 列：(排序字段, 标题, 宽度)
+COLUMNS = (
+    ("name", "文件名", 200),
+    ("size", "大小", 90),
+    ("mtime", "修改时间", 130),
+    ("path", "路径", 250),
+)
+
+# 影响显示、排序和过滤的字段；只有其他字段（如内容摘要）变化时不必重建视图
+VIEW_FIELDS = ("name", "size_bytes", "mtime", "path")
+
+# 注册表变更合并后再刷新的间隔（毫秒），扫描大文件夹时避免反复重建
+REFRESH_DELAY_MS = 200
+
+# 合并后的增删条目数不超过该值时在有序列表中直接插入删除，否则在后台整体重建
+INCREMENTAL_LIMIT = 250
+
+# 后台排序时每块的条目数。list.sort 的比较阶段不释放 GIL，在后台线程中整体排序
+# 20 万条目仍会让 Tk 线程停顿约 100 ms；分块排序后再归并，每次只占用 GIL 几毫秒
+SORT_CHUNK = 4096
+
+# 控件尚未显示、无法测量行高时使用的行数
+DEFAULT_VISIBLE_ROWS = 30
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+              "g": 1024 ** 3, "gb": 1024 ** 3, "t": 1024 ** 4, "tb": 1024 ** 4}
+
+_COMPARISONS = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "=": operator.eq,
+}
+_FILTER_TERM = re.compile(r"^(size|mtime)(>=|<=|>|<|=)(.+)$", re.I)
+
+
+def parse_size(text):
+    """解析 "10MB"、"1.5g"、"4096" 形式的大小，返回字节数"""
+    match = re.match(r"^\s*([\d.]+)\s*([a-zA-Z]*)\s*$", text)
+    if not match or match.group(2).lower() not in SIZE_UNITS:
+        raise ValueError(f"无法识别的大小: {text}")
+    return float(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+
+def parse_time(text, now=None):
+    """解析 "2024-01-01"、"2024-01-01 12:00" 或 "7d"（7天前）形式的时间，返回时间戳"""
+    text = text.strip()
+    match = re.match(r"^(\d+(?:\.\d+)?)([dh])$", text, re.I)
+    if match:
+        seconds = float(match.group(1)) * (86400 if match.group(2).lower() == "d" else 3600)
+        return (time.time() if now is None else now) - seconds
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"无法识别的时间: {text}")
+
+
+def parse_filter(text):
+    """把筛选文本解析为条目判断函数，空文本返回 None
+
+    以空白分隔：size>10MB、size<=1GB、mtime>2024-01-01、mtime<7d 按数值比较，
+    其他词要求文件名包含（不区分大小写），各条件同时满足。
+    """
+    words = []
+    comparisons = []
+    for token in text.split():
+        match = _FILTER_TERM.match(token)
+        if match is None:
+            words.append(token.lower())
+            continue
+        field, op, value = match.groups()
+        if field.lower() == "size":
+            comparisons.append(("size_bytes", _COMPARISONS[op], parse_size(value)))
+        else:
+            comparisons.append(("mtime", _COMPARISONS[op], parse_time(value)))
+    if not words and not comparisons:
+        return None
+
+    def predicate(entry):
+        for field, compare, value in comparisons:
+            if not compare(entry[field], value):
+                return False
+        if words:
+            name = entry["name"].lower()
+            return all(word in name for word in words)
+        return True
+
+    return predicate
+
+
+def sort_entries(entries, sort_key):
+    """稳定排序，条目较多时分块排序后归并，供后台线程调用"""
+    if len(entries) <= SORT_CHUNK:
+        return sorted(entries, key=sort_key)
+    chunks = [sorted(entries[i:i + SORT_CHUNK], key=sort_key) for i in range(0, len(entries), SORT_CHUNK)]
+    # 键相等时 heapq.merge 按块的顺序输出，与整体稳定排序的结果一致
+    return list(heapq.merge(*chunks, key=sort_key))
+
+
+def bisect_key(view, key, sort_key, right=False):
+    """在按 sort_key 有序的列表中二分查找 key 的插入位置（bisect 的 key 参数需要 Python 3.10）"""
+    low, high = 0, len(view)
+    while low < high:
+        middle = (low + high) // 2
+        value = sort_key(view[middle])
+        if value < key or (right and value == key):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def merge_sorted(view, entries, sort_key):
+    """把新条目插入有序列表，只复制一次原列表
+
+    新条目ID最大，插在相等键的后面，与整体稳定排序的结果一致。
+    """
+    merged = []
+    start = 0
+    # 新条目按键排序后插入位置单调不减
+    for entry in sorted(entries, key=sort_key):
+        index = bisect_key(view, sort_key(entry), sort_key, right=True)
+        merged.extend(view[start:index])
+        merged.append(entry)
+        start = index
+    merged.extend(view[start:])
+    return merged
+
+
+def find_sorted(view, entry, sort_key):
+    """按排序键二分查找条目（按ID比较）的位置，不在列表中时返回 None"""
+    key = sort_key(entry)
+    index = bisect_key(view, key, sort_key)
+    while index < len(view) and sort_key(view[index]) == key:
+        if view[index]["id"] == entry["id"]:
+            return index
+        index += 1
+    return None
+
+
+def remove_sorted(view, entries, sort_key):
+    """从有序列表中移除条目，只复制一次原列表"""
+    indexes = [i for i in (find_sorted(view, e, sort_key) for e in entries) if i is not None]
+    if not indexes:
+        return view
+    remaining = []
+    start = 0
+    for index in sorted(indexes):
+        remaining.extend(view[start:index])
+        start = index + 1
+    remaining.extend(view[start:])
+    return remaining
+
+
+def format_mtime(mtime):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))
+
+
+class VirtualFileList(tk.Frame):
+    """只渲染可见行的文件列表
+
+    ttk.Treeview 在上万行时插入、滚动和重绘都很慢，这里 Treeview 只保留与
+    可见高度相同数量的行，滚动时改写这些行的内容；完整的列表是按当前排序和
+    筛选得到的条目列表，滚动条按其长度换算。
+
+    全部条目按排序字段升序排列的顺序会被缓存，降序显示时取倒序；排序和筛选
+    在后台线程中进行，完成后回到 Tk 线程替换视图。注册表变更先合并，少量增删
+    直接在有序列表中插入删除，只有摘要等不显示的字段变化时原地替换条目。
+    选中状态按条目ID保存，滚动后保持不变。
+    """
+
+    def __init__(self, master, registry, on_change=None):
+        tk.Frame.__init__(self, master)
+        self.registry = registry
+        # 视图重建后调用 on_change(显示数, 总数)
+        self.on_change = on_change
+        self.sort_key = "name"
+        self.descending = False
+        self.filter_text = ""
+        self._predicate = None
+        # 排序字段 -> 按该字段升序排列的全部条目
+        self._orders = {}
+        # 按当前字段升序排列、筛选后的条目，以及按方向显示的视图
+        self._matches = []
+        self.view = []
+        # 递增的重建代号，以及后台正在为哪一代重建（没有时为 None）
+        self._generation = 0
+        self._building = None
+        self.top = 0
+        self._selected = set()
+        # 当前渲染的行：Treeview 行ID与对应条目
+        self._rows = []
+        self._window = []
+        self._visible_rows = DEFAULT_VISIBLE_ROWS
+        # 不带 Shift/Ctrl 的点击会替换选择，包括不可见的已选条目
+        self._replace_selection = False
+        self._pending_deltas = []
+        self._refresh_scheduled = False
+        # 最近一次重建和渲染的耗时（秒）
+        self._rebuild_time = 0.0
+        self.render_time = 0.0
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in COLUMNS], show="headings", selectmode="extended")
+        for key, title, width in COLUMNS:
+            self.tree.heading(key, text=title, command=lambda k=key: self.toggle_sort(k))
+            self.tree.column(key, width=width)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind("<Configure>", lambda e: self.render())
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Button-1>", self.on_click)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-self._visible_rows) or "break")
+        self.tree.bind("<Next>", lambda e: self.scroll(self._visible_rows) or "break")
+        self.tree.bind("<Control-Home>", lambda e: self.scroll_to(0) or "break")
+        self.tree.bind("<Control-End>", lambda e: self.scroll_to(len(self.view)) or "break")
+        self.tree.bind("<Up>", lambda e: self.on_arrow(-1))
+        self.tree.bind("<Down>", lambda e: self.on_arrow(1))
+
+        self.registry.subscribe(self.on_registry_change)
+        self.rebuild()
+
+    @property
+    def selected_ids(self):
+        """选中条目的ID"""
+        return sorted(self._selected)
+
+    # ===== 视图 =====
+
+    def set_sort(self, key, descending=False):
+        if key not in SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {key}")
+        same_key = key == self.sort_key
+        self.sort_key = key
+        self.descending = descending
+        for column, title, _ in COLUMNS:
+            arrow = (" ▼" if descending else " ▲") if column == key else ""
+            self.tree.heading(column, text=title + arrow)
+        if not same_key:
+            self.rebuild()
+        elif self._building != self._generation:
+            # 只切换方向：倒序显示已有的结果；后台重建进行中时由重建完成后按新方向显示
+            self._show(self._matches)
+
+    def toggle_sort(self, key):
+        """点击列标题：同一列切换方向，其他列按升序"""
+        self.set_sort(key, descending=not self.descending if key == self.sort_key else False)
+
+    def set_filter(self, text):
+        """设置筛选条件，格式错误时抛出 ValueError"""
+        predicate = parse_filter(text)
+        self.filter_text = text
+        self._predicate = predicate
+        self.top = 0
+        self.rebuild()
+
+    def rebuild(self):
+        """按当前排序和筛选重建视图
+
+        已缓存当前字段的顺序且不筛选时直接显示，否则交给后台线程，
+        完成前界面保持原来的视图。
+        """
+        self._generation += 1
+        order = self._orders.get(self.sort_key)
+        if order is not None and self._predicate is None:
+            self._show(order)
+            # 被取代的后台重建期间留下的变更
+            if self._pending_deltas:
+                self._apply_deltas()
+            return
+        self._building = self._generation
+        threading.Thread(
+            target=self._build,
+            args=(self._generation, self.sort_key, self._predicate, order),
+            daemon=True
+        ).start()
+
+    def _build(self, generation, key, predicate, order):
+        """后台线程：排序并筛选，结果交回 Tk 线程"""
+        started = time.perf_counter()
+        if order is None:
+            order = sort_entries(self.registry.snapshot(), SORT_KEYS[key])
+        if generation != self._generation:
+            return
+        matches = order if predicate is None else [e for e in order if predicate(e)]
+        self.after(0, self._finish_build, generation, key, order, matches, time.perf_counter() - started)
+
+    def _finish_build(self, generation, key, order, matches, elapsed):
+        # 排序或筛选条件已经改变，有更新的重建在进行
+        if generation != self._generation:
+            return
+        self._building = None
+        self._orders[key] = order
+        self._rebuild_time = elapsed
+        self._show(matches)
+        # 重建期间到达的变更可能已包含在快照中，重复应用不会产生重复的条目
+        if self._pending_deltas:
+            self._apply_deltas()
+
+    def _show(self, matches, notify=True):
+        """显示按当前字段升序排列、筛选后的条目"""
+        self._matches = matches
+        self.view = matches[::-1] if self.descending else matches
+        self._selected = {i for i in self._selected if i in self.registry}
+        self.render()
+        if notify and self.on_change is not None:
+            self.on_change(len(self.view), len(self.registry))
+
+    def on_registry_change(self, delta):
+        """注册表变更回调，可能来自非UI线程"""
+        self.after(0, self._queue_delta, delta)
+
+    def _queue_delta(self, delta):
+        self._pending_deltas.append(delta)
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            # 重建较慢时拉长合并间隔，扫描大文件夹时后台不会一直在重建
+            delay = max(REFRESH_DELAY_MS, int(self._rebuild_time * 1000 * 4))
+            self.after(delay, self._apply_deltas)
+
+    def _apply_deltas(self):
+        """应用合并期间的变更
+
+        少量增删直接在有序列表中插入和删除；变更较多或显示字段变化时
+        在后台重建。后台重建进行中时，变更留到重建完成后再应用。
+        """
+        self._refresh_scheduled = False
+        if self._building == self._generation:
+            return
+        deltas, self._pending_deltas = self._pending_deltas, []
+        if not deltas:
+            return
+        changes = sum(len(d.added) + len(d.removed) for d in deltas)
+        # 只维护当前字段的顺序，其他字段的缓存在注册表变化后失效
+        key = self.sort_key
+        order = self._orders.get(key)
+        self._orders = {}
+        if order is None or changes > INCREMENTAL_LIMIT:
+            self.rebuild()
+            return
+
+        sort_key = SORT_KEYS[key]
+        predicate = self._predicate
+        matches = self._matches
+        for delta in deltas:
+            order = self._merge_delta(order, delta, sort_key)
+            if predicate is not None and order is not None:
+                matches = self._merge_delta(matches, delta, sort_key, predicate)
+            if order is None or matches is None:
+                self.rebuild()
+                return
+        self._orders[key] = order
+        self._show(order if predicate is None else matches, notify=bool(changes))
+
+    def _merge_delta(self, view, delta, sort_key, predicate=None):
+        """把一次变更应用到按 sort_key 升序的列表，返回新列表，需要重建时返回 None
+
+        通知可能乱序到达，也可能已经包含在后台重建取得的快照中：条目以注册表中
+        的当前版本为准，已在列表中的新增条目会被跳过。
+        """
+        if delta.removed:
+            view = remove_sorted(view, delta.removed, sort_key)
+        added = []
+        for entry in delta.added:
+            entry = self.registry.get(entry["id"])
+            if entry is None or (predicate is not None and not predicate(entry)):
+                continue
+            if find_sorted(view, entry, sort_key) is None:
+                added.append(entry)
+        if added:
+            view = merge_sorted(view, added, sort_key)
+        for entry in delta.updated:
+            entry = self.registry.get(entry["id"])
+            if entry is None:
+                continue
+            # 显示字段未变时排序键不变，可以按新条目定位旧条目
+            index = find_sorted(view, entry, sort_key)
+            if index is None:
+                if predicate is None or predicate(entry):
+                    return None
+                continue
+            if any(view[index][f] != entry[f] for f in VIEW_FIELDS):
+                return None
+            view[index] = entry
+        return view
+
+    # ===== 渲染 =====
+
+    def measure_rows(self):
+        """按控件高度和行高计算可见行数"""
+        height = self.tree.winfo_height()
+        if height <= 1 or not self._rows:
+            return self._visible_rows
+        bbox = self.tree.bbox(self._rows[0])
+        if not bbox:
+            return self._visible_rows
+        y, row_height = bbox[1], bbox[3]
+        return max(1, (height - y) // max(1, row_height))
+
+    def render(self):
+        """把视图中从 top 开始的可见窗口写入 Treeview"""
+        started = time.perf_counter()
+        self._visible_rows = self.measure_rows()
+        rows = self._visible_rows
+        self.top = max(0, min(self.top, len(self.view) - rows))
+        self._window = self.view[self.top:self.top + rows]
+
+        # 行数与窗口一致，多删少补
+        while len(self._rows) > len(self._window):
+            self.tree.delete(self._rows.pop())
+        while len(self._rows) < len(self._window):
+            self._rows.append(self.tree.insert("", tk.END))
+
+        selection = []
+        for iid, entry in zip(self._rows, self._window):
+            self.tree.item(iid, values=(entry["name"], entry["size"], format_mtime(entry["mtime"]), entry["path"]))
+            if entry["id"] in self._selected:
+                selection.append(iid)
+        self.tree.selection_set(selection)
+
+        if self.view:
+            self.scrollbar.set(self.top / len(self.view), (self.top + len(self._window)) / len(self.view))
+        else:
+            self.scrollbar.set(0, 1)
+        self.render_time = time.perf_counter() - started
+
+    # ===== 滚动和选择 =====
+
+    def scroll(self, rows):
+        self.scroll_to(self.top + rows)
+
+    def scroll_to(self, top):
+        top = max(0, min(int(top), len(self.view) - self._visible_rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def on_scrollbar(self, command, value, unit=None):
+        if command == "moveto":
+            self.scroll_to(float(value) * len(self.view))
+        elif command == "scroll":
+            step = self._visible_rows if unit == "pages" else 1
+            self.scroll(int(value) * step)
+
+    def on_mousewheel(self, event):
+        # Windows 每格 120，macOS 为较小的整数
+        delta = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self.scroll(-delta * 3)
+
+    def on_arrow(self, step):
+        """在首行/末行按方向键时滚动视图，并把选择移到新出现的行"""
+        rows = self._rows
+        if not rows:
+            return None
+        focus = self.tree.focus()
+        at_edge = (step < 0 and focus == rows[0] and self.top > 0) or \
+                  (step > 0 and focus == rows[-1] and self.top + len(rows) < len(self.view))
+        if not at_edge:
+            return None
+        self.scroll(step)
+        edge = rows[0] if step < 0 else rows[-1]
+        self._selected = {self._window[rows.index(edge)]["id"]}
+        self.render()
+        self.tree.focus(edge)
+        return "break"
+
+    def on_click(self, event):
+        # 0x1 为 Shift，0x4 为 Control
+        self._replace_selection = not event.state & 0x5
+
+    def on_select(self, event=None):
+        """把可见行的选中状态同步到按ID保存的选择集合"""
+        if self._replace_selection:
+            self._replace_selection = False
+            self._selected.clear()
+        selection = set(self.tree.selection())
+        for iid, entry in zip(self._rows, self._window):
+            if iid in selection:
+                self._selected.add(entry["id"])
+            else:
+                self._selected.discard(entry["id"])